@@ -0,0 +1,959 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Dict
+from codec import BinaryCodec, JsonCodec
+
+
+def _rate(count: int, seconds: float) -> float:
+    return count / seconds if seconds > 0 else float('inf')
+
+
+def bench_codec(count: int = 50000):
+    """Compare encode/decode throughput of the JSON and binary codecs on a transaction and a full inv"""
+    messages = {
+        'transaction': {
+            'type': 'transaction',
+            'transaction': {
+                'id': 'f' * 64,
+                'sender': 'a' * 64,
+                'recipient': 'b' * 64,
+                'amount': 12.5,
+                'timestamp': 1700000000,
+                'signature': 's' * 88
+            }
+        },
+        # The most common gossip message: a batch of max_inv transaction IDs
+        'inv': {'type': 'inv', 'ids': [hashlib.sha256(str(i).encode()).hexdigest() for i in range(500)]},
+    }
+    results = {}
+    for kind, message in messages.items():
+        # Keep each case to a similar number of encoded bytes
+        repeat = max(1, count * 300 // len(json.dumps(message)))
+        for codec in (JsonCodec(), BinaryCodec()):
+            start = time.perf_counter()
+            frames = [codec.encode(message) for _ in range(repeat)]
+            encode_time = time.perf_counter() - start
+
+            stream = b''.join(frames)
+            start = time.perf_counter()
+            if isinstance(codec, BinaryCodec):
+                decoded, _ = codec.decode_all(stream)
+            else:
+                decoded = [json.loads(line) for line in stream.splitlines()]
+            respond_time = time.perf_counter() - start
+            assert len(decoded) == repeat and decoded[0] == message
+
+            results[f'{kind}_{codec.name}'] = {
+                'bytes_per_message': len(frames[0]),
+                'encode_per_sec': _rate(repeat, encode_time),
+                'decode_per_sec': _rate(repeat, respond_time)
+            }
+
+    print("Codec benchmark:")
+    print("-" * 50)
+    for name, result in results.items():
+        print(f"{name:>18}: {result['bytes_per_message']:,} bytes/msg, "
+              f"encode {result['encode_per_sec']:,.0f}/s, decode {result['decode_per_sec']:,.0f}/s")
+    print("-" * 50)
+    return results
+
+
+def _signed_transactions(count: int, senders: int = 8, scheme: str = 'rsa-pss'):
+    from transaction import Transaction
+    from utils import generate_key_pair, serialize_public_key
+
+    keys = [generate_key_pair(scheme) for _ in range(senders)]
+    transactions = []
+    for i in range(count):
+        private_key, public_key = keys[i % senders]
+        tx = Transaction.create(serialize_public_key(public_key), f"recipient-{i}", float(i))
+        tx.sign(private_key)
+        transactions.append(tx.to_dict())
+    return transactions
+
+
+def bench_verify(count: int = 2000):
+    """Signature verification throughput inline vs. on the process pool by core count"""
+    from verification import VerificationPipeline, verify_batch
+
+    transactions = _signed_transactions(count)
+    results = {}
+
+    start = time.perf_counter()
+    assert all(verify_batch(transactions))
+    results['inline'] = _rate(count, time.perf_counter() - start)
+
+    async def run_pipeline(workers: int) -> float:
+        pipeline = VerificationPipeline(workers=workers)
+        # Warm the pool so process start-up is not measured
+        await asyncio.gather(*(pipeline.submit(tx) for tx in transactions[:workers * pipeline.batch_size]))
+        start = time.perf_counter()
+        verdicts = await asyncio.gather(*(pipeline.submit(tx) for tx in transactions))
+        elapsed = time.perf_counter() - start
+        pipeline.close()
+        assert all(verdicts)
+        return _rate(count, elapsed)
+
+    cores = os.cpu_count() or 1
+    for workers in sorted({1, 2, 4, cores}):
+        if workers <= cores:
+            results[f'{workers}_workers'] = asyncio.run(run_pipeline(workers))
+
+    print("Verification benchmark:")
+    print("-" * 50)
+    for name, rate in results.items():
+        print(f"{name:>12}: {rate:,.0f} verifies/s")
+    print("-" * 50)
+    return results
+
+
+def bench_keys(count: int = 2000):
+    """Per-verify latency with and without the public key cache"""
+    from cryptography.hazmat.primitives import serialization
+    from transaction import Transaction
+    from utils import public_key_cache, deserialize_public_key
+
+    transactions = [Transaction.from_dict(data) for data in _signed_transactions(count)]
+    results = {}
+
+    start = time.perf_counter()
+    for tx in transactions:
+        assert tx.verify(serialization.load_pem_public_key(tx.verification_key().encode()))
+    results['uncached'] = (time.perf_counter() - start) / count
+
+    public_key_cache.clear()
+    start = time.perf_counter()
+    for tx in transactions:
+        assert tx.verify(deserialize_public_key(tx.verification_key()))
+    results['cached'] = (time.perf_counter() - start) / count
+    results['hit_rate'] = public_key_cache.hit_rate
+
+    print("Key cache benchmark:")
+    print("-" * 50)
+    print(f"  uncached: {results['uncached'] * 1e6:,.1f} us/verify")
+    print(f"    cached: {results['cached'] * 1e6:,.1f} us/verify")
+    print(f"  hit rate: {results['hit_rate']:.1%}")
+    print("-" * 50)
+    return results
+
+
+def bench_signatures(count: int = 2000):
+    """Compare RSA-PSS and Ed25519 key generation, sign/verify rate and message size"""
+    from signatures import SCHEMES
+    from transaction import Transaction
+    from utils import deserialize_public_key, serialize_public_key
+
+    codec = BinaryCodec()
+    results = {}
+    for name, scheme in SCHEMES.items():
+        start = time.perf_counter()
+        private_key, public_key = scheme.generate_key_pair()
+        keygen = time.perf_counter() - start
+
+        sender = serialize_public_key(public_key)
+        transactions = [Transaction.create(sender, f"recipient-{i}", float(i)) for i in range(count)]
+        start = time.perf_counter()
+        for tx in transactions:
+            tx.sign(private_key)
+        sign_time = time.perf_counter() - start
+
+        key = deserialize_public_key(sender)
+        start = time.perf_counter()
+        for tx in transactions:
+            assert tx.verify(key)
+        verify_time = time.perf_counter() - start
+
+        results[name] = {
+            'keygen_ms': keygen * 1000,
+            'sign_per_sec': _rate(count, sign_time),
+            'verify_per_sec': _rate(count, verify_time),
+            'message_bytes': len(codec.encode({'type': 'transaction', 'transaction': transactions[0].to_dict()}))
+        }
+
+    print("Signature scheme benchmark:")
+    print("-" * 50)
+    for name, result in results.items():
+        print(f"{name:>8}: keygen {result['keygen_ms']:.1f} ms, sign {result['sign_per_sec']:,.0f}/s, "
+              f"verify {result['verify_per_sec']:,.0f}/s, {result['message_bytes']} bytes/tx")
+    print("-" * 50)
+    return results
+
+
+def bench_mempool(count: int = 150000, capacity: int = 100000):
+    """Admission, eviction and selection cost of the transaction pool at 100k+ entries"""
+    import random
+    from transaction import Transaction, TransactionPool
+
+    rng = random.Random(1)
+    transactions = []
+    for i in range(count):
+        tx = Transaction(f"sender-{i % 1000}", f"recipient-{i}", rng.uniform(0, 1000))
+        tx.signature = bytes(64)
+        transactions.append(tx)
+    pool = TransactionPool(max_count=capacity)
+
+    start = time.perf_counter()
+    for tx in transactions:
+        pool.add_transaction(tx)
+    admit = (time.perf_counter() - start) / count
+
+    start = time.perf_counter()
+    pool.top(1000)
+    top = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(1000):
+        pool.pending_from(f"sender-{i}")
+    by_sender = (time.perf_counter() - start) / 1000
+
+    print("Mempool benchmark:")
+    print("-" * 50)
+    print(f"  admitted {count:,} into a {capacity:,} cap ({pool.evictions:,} evictions)")
+    print(f"  admission: {admit * 1e6:.1f} us/tx")
+    print(f"  top 1000: {top * 1e3:.2f} ms")
+    print(f"  pending_from: {by_sender * 1e6:.1f} us")
+    print("-" * 50)
+    return {'admit_us': admit * 1e6, 'top1000_ms': top * 1e3, 'pending_from_us': by_sender * 1e6,
+            'evictions': pool.evictions}
+
+
+def bench_hashing(count: int = 200000):
+    """Transaction ID throughput: legacy f-string hash vs. canonical encoding, one by one and batched"""
+    from transaction import Transaction, hash_transactions
+
+    def build():
+        return [Transaction(f"{i % 1000:064x}", f"recipient-{i}", float(i), timestamp=1700000000 + i)
+                for i in range(count)]
+
+    results = {}
+    transactions = build()
+    start = time.perf_counter()
+    for tx in transactions:
+        hashlib.sha256(f"{tx.sender}{tx.recipient}{tx.amount}{tx.timestamp}".encode()).hexdigest()
+    results['legacy'] = _rate(count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for tx in transactions:
+        tx.calculate_hash()
+    results['canonical'] = _rate(count, time.perf_counter() - start)
+
+    transactions = build()
+    start = time.perf_counter()
+    hash_transactions(transactions)
+    results['batched'] = _rate(count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for tx in transactions:
+        tx.calculate_hash()
+    results['memoized'] = _rate(count, time.perf_counter() - start)
+
+    print("Transaction hashing benchmark:")
+    print("-" * 50)
+    for name, rate in results.items():
+        print(f"{name:>10}: {rate:,.0f} hashes/s")
+    print("-" * 50)
+    return results
+
+
+def _mine(block):
+    from chain import NONCE, meets_target
+
+    prefix = hashlib.sha256(block.header_prefix())
+    nonce = 0
+    while True:
+        digest = prefix.copy()
+        digest.update(NONCE.pack(nonce))
+        if meets_target(digest.hexdigest(), block.bits):
+            block.set_nonce(nonce)
+            return block
+        nonce += 1
+
+
+def bench_chain(blocks: int = 200, per_block: int = 100, bits: int = 8):
+    """Block validation throughput, and the cost of a short reorg on a long chain"""
+    from chain import Block, Chain
+    from transaction import Transaction
+    from utils import generate_key_pair, serialize_public_key
+
+    private_key, public_key = generate_key_pair('ed25519')
+    sender = serialize_public_key(public_key)
+    start_time = int(time.time()) - blocks - 10
+    source = Chain(bits=bits, max_block_transactions=per_block, verify_signatures=False)
+    chain_blocks = []
+    for height in range(blocks):
+        transactions = []
+        for i in range(per_block):
+            tx = Transaction.create(sender, f"recipient-{height}-{i}", float(i))
+            tx.sign(private_key)
+            transactions.append(tx)
+        block = _mine(Block(source.height + 1, source.tip.hash, transactions, bits, timestamp=start_time + height))
+        source.add_block(block)
+        chain_blocks.append(block)
+
+    results = {}
+    for verify in (False, True):
+        chain = Chain(bits=bits, max_block_transactions=per_block, verify_signatures=verify)
+        start = time.perf_counter()
+        for block in chain_blocks:
+            chain.add_block(block)
+        results['signatures' if verify else 'headers_and_merkle'] = _rate(blocks, time.perf_counter() - start)
+
+    # A two-block branch forking one block below the tip overtakes it
+    fork_parent = chain.entries[chain.active[-2]].block
+    first = _mine(Block(fork_parent.height + 1, fork_parent.calculate_hash(), [], bits,
+                        timestamp=fork_parent.timestamp + 5))
+    second = _mine(Block(first.height + 1, first.calculate_hash(), [], bits, timestamp=first.timestamp + 1))
+    chain.add_block(first)
+    start = time.perf_counter()
+    assert chain.add_block(second)
+    results['reorg_ms'] = (time.perf_counter() - start) * 1000
+
+    print("Chain benchmark:")
+    print("-" * 50)
+    print(f"  {blocks} blocks x {per_block} transactions")
+    print(f"  headers+merkle: {results['headers_and_merkle']:,.0f} blocks/s")
+    print(f"  with signatures: {results['signatures']:,.0f} blocks/s")
+    print(f"  depth-1 reorg at height {blocks}: {results['reorg_ms']:.2f} ms")
+    print("-" * 50)
+    return results
+
+
+def bench_mining(count: int = 200000, seconds: float = 2.0):
+    """Proof-of-work hash rate: full header per nonce vs. precomputed prefix, then per core on the pool"""
+    from chain import Block, ZERO_HASH
+    from miner import Miner, search_nonces
+
+    block = Block(1, ZERO_HASH, [], 64, timestamp=1700000000)
+    results = {}
+
+    start = time.perf_counter()
+    for nonce in range(count):
+        block.set_nonce(nonce)
+        block.calculate_hash()
+    results['full_header'] = _rate(count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    _, tried = search_nonces(block.header_prefix(), block.bits, 0, count, 0)
+    results['prefix_state'] = _rate(tried, time.perf_counter() - start)
+
+    async def run_pool(workers: int) -> float:
+        miner = Miner(workers=workers)
+        # Warm the pool so process start-up is not measured
+        await miner.mine(Block(1, ZERO_HASH, [], 1))
+        miner.hashes = 0
+        miner.elapsed = 0.0
+        search = asyncio.create_task(miner.mine(block))
+        await asyncio.sleep(seconds)
+        miner.cancel()
+        await search
+        miner.close()
+        return miner.hash_rate_per_core
+
+    cores = os.cpu_count() or 1
+    for workers in sorted({1, 2, 4, cores}):
+        if workers <= cores:
+            results[f'{workers}_workers_per_core'] = asyncio.run(run_pool(workers))
+
+    print("Mining benchmark:")
+    print("-" * 50)
+    for name, rate in results.items():
+        print(f"{name:>20}: {rate:,.0f} hashes/s")
+    print("-" * 50)
+    return results
+
+
+def bench_storage(count: int = 50000, peers: int = 1000):
+    """Batched vs. per-write commits, and warm-start time for pooled transactions and peers"""
+    import tempfile
+    from storage import Storage
+    from transaction import Transaction, TransactionPool
+    from utils import generate_key_pair, serialize_public_key
+
+    sender = serialize_public_key(generate_key_pair('ed25519')[1])
+    transactions = []
+    for i in range(count):
+        tx = Transaction.create(sender, f"recipient-{i}", float(i))
+        tx.signature = bytes(64)
+        transactions.append(tx)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        unbatched = Storage(os.path.join(directory, 'unbatched.db'), batch_size=1)
+        sample = transactions[:count // 10]
+        start = time.perf_counter()
+        for tx in sample:
+            unbatched.save_transaction(tx, pooled=True)
+        results['unbatched_writes_per_sec'] = _rate(len(sample), time.perf_counter() - start)
+        unbatched.close()
+
+        path = os.path.join(directory, 'node.db')
+        storage = Storage(path)
+        pool = TransactionPool(storage=storage)
+        start = time.perf_counter()
+        for tx in transactions:
+            pool.add_transaction(tx)
+        for i in range(peers):
+            storage.save_peer(f"10.0.{i // 256}.{i % 256}", 17000)
+        storage.close()
+        results['batched_writes_per_sec'] = _rate(count + peers, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        storage = Storage(path)
+        pool = TransactionPool(storage=storage)
+        restored_peers = storage.load_peers()
+        results['warm_start_ms'] = (time.perf_counter() - start) * 1000
+        storage.close()
+        assert len(pool) == count and len(restored_peers) == peers
+
+    print("Storage benchmark:")
+    print("-" * 50)
+    print(f"  per-write commits: {results['unbatched_writes_per_sec']:,.0f} writes/s")
+    print(f"    batched commits: {results['batched_writes_per_sec']:,.0f} writes/s (incl. pool admission)")
+    print(f"  warm start ({count:,} pending tx, {peers:,} peers): {results['warm_start_ms']:.0f} ms")
+    print("-" * 50)
+    return results
+
+
+def bench_txlog(count: int = 200000):
+    """Log append/read throughput, and pool memory holding objects vs. log offsets"""
+    import gc
+    import random
+    import tempfile
+    import tracemalloc
+    from transaction import Transaction, TransactionPool
+    from txlog import TransactionLog
+    from utils import generate_key_pair, serialize_public_key
+
+    public_key = serialize_public_key(generate_key_pair('ed25519')[1])
+
+    def build():
+        transactions = []
+        for i in range(count):
+            tx = Transaction(f"{i % 1000:064x}", f"recipient-{i}", float(i), timestamp=1700000000 + i,
+                             signature=bytes(64), scheme='ed25519', public_key=public_key)
+            tx.calculate_hash()
+            transactions.append(tx)
+        return transactions
+
+    def pool_memory(log=None) -> float:
+        gc.collect()
+        tracemalloc.start()
+        transactions = build()
+        pool = TransactionPool(max_count=count, max_bytes=1 << 40, log=log)
+        for tx in transactions:
+            pool.add_transaction(tx)
+        # Only the pool keeps the transactions once the source list is gone
+        transactions.clear()
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return current / count
+
+    results = {'objects_bytes_per_tx': pool_memory()}
+    with tempfile.TemporaryDirectory() as directory:
+        log = TransactionLog(directory)
+        transactions = build()
+        ids = [tx.calculate_hash() for tx in transactions]
+        size = sum(tx.encoded_size() for tx in transactions)
+        start = time.perf_counter()
+        for tx in transactions:
+            log.append(tx)
+        elapsed = time.perf_counter() - start
+        results['append_per_sec'] = _rate(count, elapsed)
+        results['append_mb_per_sec'] = _rate(size, elapsed) / 1e6
+
+        sample = random.Random(1).sample(ids, min(10000, len(ids)))
+        start = time.perf_counter()
+        for tx_id in sample:
+            log.get(tx_id)
+        results['get_us'] = (time.perf_counter() - start) / len(sample) * 1e6
+        start = time.perf_counter()
+        for tx_id in sample:
+            log.get_transaction(tx_id)
+        results['get_transaction_us'] = (time.perf_counter() - start) / len(sample) * 1e6
+        log.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        log = TransactionLog(directory)
+        results['offsets_bytes_per_tx'] = pool_memory(log)
+        log.close()
+
+    print("Transaction log benchmark:")
+    print("-" * 50)
+    print(f"  append: {results['append_per_sec']:,.0f} tx/s ({results['append_mb_per_sec']:,.1f} MB/s)")
+    print(f"  zero-copy get: {results['get_us']:.2f} us, decoded get: {results['get_transaction_us']:.2f} us")
+    print(f"  pool with objects: {results['objects_bytes_per_tx']:,.0f} bytes/tx")
+    print(f"  pool with offsets: {results['offsets_bytes_per_tx']:,.0f} bytes/tx")
+    print("-" * 50)
+    return results
+
+
+def bench_sync(count: int = 100000, port: int = 19500):
+    """Loopback catch-up time for a new node joining a peer that holds ``count`` transactions"""
+    import logging
+    from node import Node
+    from transaction import Transaction
+
+    logging.getLogger('node').setLevel(logging.WARNING)
+    transactions = [
+        Transaction(f"{i % 1000:064x}", f"recipient-{i}", float(i), timestamp=1700000000 + i,
+                    signature=bytes(64)).to_dict()
+        for i in range(count)
+    ]
+
+    async def catch_up(known_fraction: float, offset: int) -> float:
+        source = Node(host='127.0.0.1', port=port + offset, verify=False, seen_cache_size=count * 2)
+        joiner = Node(host='127.0.0.1', port=port + offset + 1, verify=False, seen_cache_size=count * 2)
+        for i, tx in enumerate(transactions):
+            source.known_transactions[tx['id']] = tx
+            if i < count * known_fraction:
+                joiner.known_transactions[tx['id']] = tx
+        servers = [asyncio.create_task(node.start()) for node in (source, joiner)]
+        await asyncio.sleep(0.2)
+
+        start = time.perf_counter()
+        await joiner.connect_to_peer('127.0.0.1', port + offset)
+        while not joiner.syncing:
+            await asyncio.sleep(0.001)
+        while joiner.syncing:
+            await asyncio.sleep(0.001)
+        elapsed = time.perf_counter() - start
+
+        await joiner.connections.close()
+        await source.connections.close()
+        for node, server in zip((source, joiner), servers):
+            node.server.close()
+            server.cancel()
+        return elapsed
+
+    results = {}
+    for offset, known_fraction in enumerate((0.0, 0.5)):
+        elapsed = asyncio.run(catch_up(known_fraction, offset * 2))
+        missing = count - int(count * known_fraction)
+        results[f'known_{int(known_fraction * 100)}pct'] = {'seconds': elapsed, 'tx_per_sec': _rate(missing, elapsed)}
+
+    print("Initial sync benchmark:")
+    print("-" * 50)
+    for name, result in results.items():
+        print(f"  {name}: {result['seconds']:.2f} s ({result['tx_per_sec']:,.0f} tx/s)")
+    print("-" * 50)
+    return results
+
+
+def bench_state(accounts: int = 100000, count: int = 100000):
+    """Pool admission with and without balance checks, block application and snapshot size"""
+    import random
+    import tempfile
+    from chain import Block
+    from state import AccountState
+    from transaction import Transaction, TransactionPool
+
+    rng = random.Random(1)
+    state = AccountState({f"account-{i}": 1000.0 for i in range(accounts)})
+    transactions = []
+    for i in range(count):
+        tx = Transaction(f"account-{rng.randrange(accounts)}", f"account-{rng.randrange(accounts)}",
+                         rng.uniform(1, 100), timestamp=1700000000 + i)
+        tx.signature = bytes(64)
+        transactions.append(tx)
+
+    results = {}
+    for name, pool_state in (('unchecked', None), ('checked', state)):
+        pool = TransactionPool(max_count=count, state=pool_state)
+        start = time.perf_counter()
+        for tx in transactions:
+            pool.add_transaction(tx)
+        results[f'admit_{name}_us'] = (time.perf_counter() - start) / count * 1e6
+
+    block = Block(1, '0' * 64, transactions[:2000], 0)
+    block.calculate_hash()
+    start = time.perf_counter()
+    state.apply_block(block)
+    applied = time.perf_counter() - start
+    start = time.perf_counter()
+    state.revert_block(block)
+    reverted = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'state.snap')
+        start = time.perf_counter()
+        state.save(path)
+        save = time.perf_counter() - start
+        size = os.path.getsize(path)
+        start = time.perf_counter()
+        state.load(path)
+        load = time.perf_counter() - start
+    results.update({
+        'apply_tx_per_sec': _rate(len(block.transactions), applied),
+        'revert_tx_per_sec': _rate(len(block.transactions), reverted),
+        'snapshot_bytes_per_account': size / accounts,
+        'snapshot_save_s': save,
+        'snapshot_load_s': load
+    })
+
+    print("Account state benchmark:")
+    print("-" * 50)
+    print(f"  admission without balance check: {results['admit_unchecked_us']:.1f} us/tx")
+    print(f"  admission with balance check: {results['admit_checked_us']:.1f} us/tx")
+    print(f"  apply block: {results['apply_tx_per_sec']:,.0f} tx/s, revert: {results['revert_tx_per_sec']:,.0f} tx/s")
+    print(f"  snapshot of {accounts:,} accounts: {size / accounts:.1f} bytes/account, "
+          f"save {save:.2f} s, load {load:.2f} s")
+    print("-" * 50)
+    return results
+
+
+def bench_metrics(count: int = 50000):
+    """Per-message handling cost of a node with metrics off and on, and scrape render time"""
+    import logging
+    from node import Node
+    from transaction import Transaction
+
+    logging.getLogger('node').setLevel(logging.WARNING)
+    messages = [
+        {'type': 'transaction', 'transaction': Transaction(
+            f"{i % 1000:064x}", f"recipient-{i}", float(i), timestamp=1700000000 + i,
+            signature=bytes(64)).to_dict()}
+        for i in range(count)
+    ]
+
+    async def handle(metrics_port) -> float:
+        node = Node(host='127.0.0.1', port=0, verify=False, seen_cache_size=count * 2,
+                    metrics_port=metrics_port)
+        start = time.perf_counter()
+        for message in messages:
+            await node.handle_message(message, None, ('127.0.0.1', 1))
+        elapsed = time.perf_counter() - start
+        if node.metrics is not None:
+            start = time.perf_counter()
+            node.metrics.registry.render()
+            results['render_ms'] = (time.perf_counter() - start) * 1e3
+        return elapsed
+
+    results = {}
+    for name, metrics_port in (('off', None), ('on', 0)):
+        results[f'metrics_{name}_us'] = asyncio.run(handle(metrics_port)) / count * 1e6
+    results['overhead_pct'] = (results['metrics_on_us'] / results['metrics_off_us'] - 1) * 100
+
+    print("Metrics overhead benchmark:")
+    print("-" * 50)
+    print(f"  handle transaction, metrics off: {results['metrics_off_us']:.2f} us")
+    print(f"  handle transaction, metrics on: {results['metrics_on_us']:.2f} us "
+          f"({results['overhead_pct']:+.1f}%)")
+    print(f"  render scrape: {results['render_ms']:.2f} ms")
+    print("-" * 50)
+    return results
+
+
+def bench_gossip(count: int = 5000, nodes: int = 4, port: int = 19600):
+    """Line-topology relay time and event-loop lag under direct, queued and rate-limited INFO logging"""
+    import logging
+    import tempfile
+    from logs import configure_logging, stop_logging
+    from node import Node
+    from transaction import Transaction
+
+    transactions = [
+        Transaction(f"{i % 1000:064x}", f"recipient-{i}", float(i), timestamp=1700000000 + i,
+                    signature=bytes(64)).to_dict()
+        for i in range(count)
+    ]
+
+    async def relay(offset: int) -> Dict:
+        peers = [Node(host='127.0.0.1', port=port + offset + i, verify=False) for i in range(nodes)]
+        servers = [asyncio.create_task(node.start()) for node in peers]
+        await asyncio.sleep(0.2)
+        for a, b in zip(peers, peers[1:]):
+            await a.connect_to_peer(b.host, b.port)
+        while any(node.syncing for node in peers):
+            await asyncio.sleep(0.01)
+
+        # A probe task measures how late the loop wakes it
+        lags = []
+        done = asyncio.Event()
+
+        async def probe():
+            while not done.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(0.001)
+                lags.append(time.perf_counter() - start - 0.001)
+
+        probe_task = asyncio.create_task(probe())
+        start = time.perf_counter()
+        for i, tx in enumerate(transactions):
+            await peers[0].broadcast_transaction(tx)
+            if i % 100 == 99:
+                await asyncio.sleep(0)
+        last = peers[-1]
+        while len(last.known_transactions) < count and time.perf_counter() - start < 60:
+            await asyncio.sleep(0.005)
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe_task
+
+        for node, server in zip(peers, servers):
+            await node.connections.close()
+            node.server.close()
+            server.cancel()
+        lags.sort()
+        return {
+            'seconds': elapsed,
+            'tx_per_sec': _rate(count, elapsed),
+            'lag_p50_ms': lags[len(lags) // 2] * 1e3 if lags else 0.0,
+            'lag_p99_ms': lags[int(len(lags) * 0.99)] * 1e3 if lags else 0.0,
+            'lag_max_ms': lags[-1] * 1e3 if lags else 0.0
+        }
+
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    logging.getLogger('node').setLevel(logging.NOTSET)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        modes = (('direct', None), ('queued', None), ('rate_limited', 10.0))
+        for offset, (name, rate) in enumerate(modes):
+            root.handlers = []
+            handler = logging.FileHandler(os.path.join(directory, f'{name}.log'))
+            handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+            if name == 'direct':
+                # What Node.__init__ used to set up: handlers run on the event loop
+                root.addHandler(handler)
+                root.setLevel(logging.INFO)
+            else:
+                configure_logging(logging.INFO, handlers=[handler], rate=rate)
+            try:
+                results[name] = asyncio.run(relay(offset * nodes))
+            finally:
+                stop_logging()
+                handler.close()
+            results[name]['log_bytes'] = os.path.getsize(os.path.join(directory, f'{name}.log'))
+    root.handlers, root.level = saved_handlers, saved_level
+
+    print(f"Gossip benchmark ({count:,} transactions over {nodes} nodes in a line):")
+    print("-" * 50)
+    for name, result in results.items():
+        print(f"  {name}: {result['seconds']:.2f} s ({result['tx_per_sec']:,.0f} tx/s), "
+              f"loop lag p50 {result['lag_p50_ms']:.2f} ms, p99 {result['lag_p99_ms']:.1f} ms, "
+              f"log {result['log_bytes']:,} bytes")
+    print("-" * 50)
+    return results
+
+
+def bench_simulation(nodes: int = 10, transactions: int = 1000, port: int = 19700, transport: str = 'tcp'):
+    """End-to-end propagation over a random topology; see simulation.py for the full suite"""
+    import logging
+    from simulation import run
+
+    logging.getLogger('node').setLevel(logging.WARNING)
+    result = asyncio.run(run(nodes, 'random', 4, transactions, base_port=port, transport=transport))
+
+    print(f"Simulation benchmark ({nodes} nodes, random degree 4, {transactions:,} transactions, {transport}):")
+    print("-" * 50)
+    latency = result['latency_ms']
+    print(f"  propagation: p50 {latency['p50']:.0f} ms, p90 {latency['p90']:.0f} ms, "
+          f"p99 {latency['p99']:.0f} ms ({result['coverage']:.0%} delivered)")
+    print(f"  per transaction: {result['messages_per_tx']:.1f} messages, {result['bytes_per_tx']:,.0f} bytes")
+    print(f"  cpu per node: {result['cpu_seconds_per_node']:.3f} s, "
+          f"rss growth per node: {result['rss_growth_per_node_bytes'] / 1024:,.0f} KiB")
+    print("-" * 50)
+    return result
+
+
+def bench_transport(messages: int = 20000, connections: int = 500, port: int = 19750):
+    """Message throughput and connection setup rate, TCP loopback against in-memory"""
+    from connection import ConnectionManager
+    from transport import MemoryNetwork, TcpTransport
+
+    async def measure(transport) -> Dict[str, float]:
+        received = 0
+        done = asyncio.Event()
+
+        async def handle(reader, writer):
+            nonlocal received
+            codec = BinaryCodec()
+            while await codec.read(reader) is not None:
+                received += 1
+                if received == messages:
+                    done.set()
+            writer.close()
+
+        server = await transport.start_server(handle, '127.0.0.1', port)
+        manager = ConnectionManager(lambda *args: asyncio.sleep(0), transport=transport, max_queue=messages,
+                                    codec='binary')
+        await manager.connect(('127.0.0.1', port))
+        message = {'type': 'inv', 'ids': [hashlib.sha256(b'x').hexdigest()] * 10}
+        start = time.perf_counter()
+        for _ in range(messages):
+            manager.send(('127.0.0.1', port), message)
+        await asyncio.wait_for(done.wait(), 60)
+        send_time = time.perf_counter() - start
+        await manager.close()
+
+        start = time.perf_counter()
+        for _ in range(connections):
+            _, writer = await transport.open_connection('127.0.0.1', port)
+            writer.close()
+            await writer.wait_closed()
+        connect_time = time.perf_counter() - start
+        server.close()
+        await server.wait_closed()
+        return {'messages_per_sec': _rate(messages, send_time), 'connections_per_sec': _rate(connections, connect_time)}
+
+    results = {
+        'tcp': asyncio.run(measure(TcpTransport())),
+        'memory': asyncio.run(measure(MemoryNetwork().transport())),
+    }
+
+    print(f"Transport benchmark ({messages:,} inv messages of 10 IDs, {connections} connections):")
+    print("-" * 50)
+    for name, result in results.items():
+        print(f"  {name}: {result['messages_per_sec']:,.0f} messages/s, "
+              f"{result['connections_per_sec']:,.0f} connections/s")
+    print("-" * 50)
+    return results
+
+
+def bench_reconcile(trials: int = 20):
+    """Sketch bytes against flooding inv bytes per peer, and decode success rate, by set size and difference"""
+    from reconcile import IBLT, cells_for, new_salt, sketch_ids
+
+    codec = BinaryCodec()
+    results = {}
+    for size in (1000, 10000):
+        ids = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(size)]
+        for difference in (10, 100, 1000):
+            if difference >= size:
+                continue
+            # Each side holds the shared IDs plus half of the difference
+            shared, only_a, only_b = ids[difference:], ids[:difference // 2], ids[difference // 2:difference]
+            ours, theirs = shared + only_a, shared + only_b
+
+            cells = cells_for(difference)
+            decoded = 0
+            respond_time = 0.0
+            sketch_bytes = 0
+            for _ in range(trials):
+                # A fresh salt each round, so the responder rebuilds its sketch as it would live
+                salt = new_salt()
+                sketch, _ = sketch_ids(ours, salt, cells)
+                message = {'type': 'reconcile', 'salt': salt.hex(), 'sketch': sketch.to_bytes()}
+                sketch_bytes = len(codec.encode(message))
+                start = time.perf_counter()
+                own, _ = sketch_ids(theirs, salt, cells)
+                complete, _, _ = own.subtract(IBLT.from_bytes(sketch.to_bytes())).decode()
+                respond_time += time.perf_counter() - start
+                decoded += complete
+
+            # Either way the missing IDs still have to be named once
+            reply_bytes = len(codec.encode({'type': 'inv', 'ids': only_b})) + 9 * len(only_a)
+            flood_bytes = len(codec.encode({'type': 'inv', 'ids': shared + only_a}))
+            results[f'{size}_diff_{difference}'] = {
+                'cells': cells,
+                'reconcile_bytes': sketch_bytes + reply_bytes,
+                'flood_bytes': flood_bytes,
+                'decode_rate': decoded / trials,
+                'respond_ms': respond_time / trials * 1000
+            }
+
+    print("Set reconciliation benchmark (bytes per peer per round):")
+    print("-" * 50)
+    for name, result in results.items():
+        print(f"  {name}: {result['reconcile_bytes']:,} vs flood {result['flood_bytes']:,} bytes, "
+              f"{result['cells']} cells, decoded {result['decode_rate']:.0%} in {result['respond_ms']:.2f} ms")
+    print("-" * 50)
+    return results
+
+
+class _DictTransaction:
+    """The pre-__slots__ layout: instance dict, PEM sender, base64 signature, no cached hash"""
+
+    def __init__(self, sender: str, recipient: str, amount: float, timestamp: int, signature: str):
+        self.sender = sender
+        self.recipient = recipient
+        self.amount = amount
+        self.timestamp = timestamp
+        self.signature = signature
+
+
+def bench_memory(count: int = 1000000, senders: int = 1000):
+    """Memory per pooled transaction: compact representation vs. the old dict-based layout"""
+    import base64
+    import gc
+    import tracemalloc
+    from transaction import Transaction
+    from utils import generate_key_pair, serialize_public_key
+
+    pem = serialize_public_key(generate_key_pair('rsa-pss')[1])
+    # Decoded network messages give every transaction its own string objects
+    sender_keys = [pem[:-30] + f"{i:029d}\n" for i in range(senders)]
+    signature = bytes(range(64))
+    results = {}
+
+    def measure(build) -> float:
+        gc.collect()
+        tracemalloc.start()
+        pool = {}
+        for i in range(count):
+            tx = build(i)
+            pool[i] = tx
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del pool
+        return current / count
+
+    results['dict_layout'] = measure(lambda i: _DictTransaction(
+        ''.join(sender_keys[i % senders]), f"recipient-{i % senders}", float(i), 1700000000 + i,
+        base64.b64encode(signature).decode()
+    ))
+    results['compact'] = measure(lambda i: Transaction.from_dict({
+        'sender': f"{i % senders:064x}", 'recipient': f"recipient-{i % senders}",
+        'amount': float(i), 'timestamp': 1700000000 + i, 'signature': signature,
+        'public_key': ''.join(sender_keys[i % senders])
+    }))
+
+    print("Transaction memory benchmark:")
+    print("-" * 50)
+    print(f"  dict layout: {results['dict_layout']:,.0f} bytes/tx")
+    print(f"      compact: {results['compact']:,.0f} bytes/tx")
+    print(f"    reduction: {results['dict_layout'] / results['compact']:.1f}x")
+    print("-" * 50)
+    return results
+
+
+BENCHMARKS = {
+    'codec': bench_codec,
+    'verify': bench_verify,
+    'keys': bench_keys,
+    'signatures': bench_signatures,
+    'mempool': bench_mempool,
+    'memory': bench_memory,
+    'hashing': bench_hashing,
+    'chain': bench_chain,
+    'mining': bench_mining,
+    'storage': bench_storage,
+    'txlog': bench_txlog,
+    'sync': bench_sync,
+    'gossip': bench_gossip,
+    'simulation': bench_simulation,
+    'state': bench_state,
+    'metrics': bench_metrics,
+    'reconcile': bench_reconcile,
+    'transport': bench_transport,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Deso P2P microbenchmarks")
+    parser.add_argument('names', nargs='*', help=f"Benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmark: {', '.join(sorted(unknown))}")
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
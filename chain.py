@@ -0,0 +1,446 @@
+import hashlib
+import logging
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+from transaction import Transaction, TransactionPool, hash_transactions
+from utils import deserialize_public_key
+
+# Header layout; the nonce comes last so miners can hash the prefix once:
+#   version:u8 | height:u32 | previous_hash:32 | merkle_root:32 | timestamp:i64 | bits:u8 | nonce:u64
+BLOCK_VERSION = 1
+HEADER = struct.Struct('>BI32s32sqBQ')
+NONCE = struct.Struct('>Q')
+NONCE_OFFSET = HEADER.size - NONCE.size
+_COUNT = struct.Struct('>I')
+ZERO_HASH = '0' * 64
+MEDIAN_TIME_SPAN = 11
+
+
+class BlockError(ValueError):
+    """A block failed validation"""
+
+
+class BlockBodyError(BlockError):
+    """A block's transactions do not match or satisfy its header.
+
+    The hash covers only the header, and transaction IDs leave out
+    signatures and keys, so a relay can spoil the body of a valid block
+    without changing its hash. Such a failure says nothing about other
+    copies of the block, which must not be marked invalid.
+    """
+
+
+def compute_merkle_root(tx_ids: List[str]) -> str:
+    """Merkle root over transaction IDs, duplicating the last node of odd levels"""
+    if not tx_ids:
+        return ZERO_HASH
+    sha256 = hashlib.sha256
+    level = [bytes.fromhex(tx_id) for tx_id in tx_ids]
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+
+def meets_target(block_hash: str, bits: int) -> bool:
+    """Whether a hash has at least ``bits`` leading zero bits"""
+    return int(block_hash, 16) >> (256 - bits) == 0
+
+
+class Block:
+    """A header plus its transactions; the hash covers only the header"""
+
+    __slots__ = ('height', 'previous_hash', 'merkle_root', 'timestamp', 'bits', 'nonce',
+                 'transactions', '_hash')
+
+    def __init__(self, height: int, previous_hash: str, transactions: List[Transaction], bits: int,
+                 timestamp: int = None, nonce: int = 0, merkle_root: str = None):
+        self.height = height
+        self.previous_hash = previous_hash
+        self.transactions = transactions
+        self.bits = bits
+        self.timestamp = int(time.time()) if timestamp is None else timestamp
+        self.nonce = nonce
+        self.merkle_root = merkle_root or compute_merkle_root(hash_transactions(transactions))
+        self._hash = None
+
+    def header_prefix(self) -> bytes:
+        """Header bytes up to, not including, the nonce"""
+        return self.header()[:NONCE_OFFSET]
+
+    def header(self) -> bytes:
+        return HEADER.pack(BLOCK_VERSION, self.height, bytes.fromhex(self.previous_hash),
+                           bytes.fromhex(self.merkle_root), self.timestamp, self.bits, self.nonce)
+
+    def set_nonce(self, nonce: int):
+        """Set the nonce found by a miner"""
+        self.nonce = nonce
+        self._hash = None
+
+    def calculate_hash(self) -> str:
+        """SHA-256 of the header, computed once per nonce"""
+        if self._hash is None:
+            self._hash = hashlib.sha256(self.header()).hexdigest()
+        return self._hash
+
+    def work(self) -> int:
+        """Expected number of hashes needed to find this block"""
+        return 1 << self.bits
+
+    def serialize(self) -> bytes:
+        """Header, transaction count, then each canonical transaction with a length prefix"""
+        parts = [self.header(), _COUNT.pack(len(self.transactions))]
+        for tx in self.transactions:
+            data = tx.serialize()
+            parts.append(_COUNT.pack(len(data)))
+            parts.append(data)
+        return b''.join(parts)
+
+    @classmethod
+    def deserialize(cls, data) -> 'Block':
+        view = memoryview(data)
+        if len(view) < HEADER.size + _COUNT.size:
+            raise BlockError("Truncated block")
+        version, height, previous_hash, root, timestamp, bits, nonce = HEADER.unpack_from(view)
+        if version != BLOCK_VERSION:
+            raise BlockError(f"Unsupported block version: {version}")
+        (count,) = _COUNT.unpack_from(view, HEADER.size)
+        offset = HEADER.size + _COUNT.size
+        transactions = []
+        try:
+            for _ in range(count):
+                (length,) = _COUNT.unpack_from(view, offset)
+                offset += _COUNT.size
+                if offset + length > len(view):
+                    raise BlockError("Truncated block")
+                transactions.append(Transaction.deserialize(view[offset:offset + length]))
+                offset += length
+        except struct.error:
+            raise BlockError("Truncated block")
+        if offset != len(view):
+            raise BlockError("Trailing bytes after block")
+        return cls(height, previous_hash.hex(), transactions, bits, timestamp=timestamp,
+                   nonce=nonce, merkle_root=root.hex())
+
+    def to_dict(self) -> Dict:
+        return {
+            'hash': self.calculate_hash(),
+            'height': self.height,
+            'previous_hash': self.previous_hash,
+            'merkle_root': self.merkle_root,
+            'timestamp': self.timestamp,
+            'bits': self.bits,
+            'nonce': self.nonce,
+            'transactions': [tx.calculate_hash() for tx in self.transactions]
+        }
+
+
+class ChainEntry:
+    """Index record for a validated block; ``work`` is cumulative from genesis"""
+
+    __slots__ = ('block', 'hash', 'height', 'parent', 'work')
+
+    def __init__(self, block: Block, parent: Optional['ChainEntry']):
+        self.block = block
+        self.hash = block.calculate_hash()
+        self.height = block.height
+        self.parent = parent
+        self.work = (parent.work if parent else 0) + block.work()
+
+
+class Chain:
+    """Block tree with most-work fork choice.
+
+    Every block is validated once, against its own parent, when it arrives:
+    proof of work, Merkle root, height and timestamp. Cumulative work is stored
+    per entry, so choosing a tip is a comparison, and switching tips walks back
+    only to the fork point instead of replaying the chain. Checks that depend
+    on the active branch (no transaction included twice) run as blocks are
+    connected during a switch; a failure marks the block invalid and restores
+    the previous tip.
+    """
+
+    def __init__(self, bits: int = 16, max_block_transactions: int = 2000,
+                 max_future_drift: int = 7200, verify_signatures: bool = True,
+                 pool: Optional[TransactionPool] = None, genesis: Optional[Block] = None,
+                 max_orphans: int = 1000, storage=None, state=None):
+        self.bits = bits
+        self.max_block_transactions = max_block_transactions
+        self.max_future_drift = max_future_drift
+        self.verify_signatures = verify_signatures
+        self.pool = pool
+        self.max_orphans = max_orphans
+
+        genesis = genesis or Block(0, ZERO_HASH, [], bits, timestamp=0)
+        self.genesis = ChainEntry(genesis, None)
+        self.tip = self.genesis
+        self.entries: Dict[str, ChainEntry] = {self.genesis.hash: self.genesis}
+        # Hashes of the active chain by height, and where each transaction was included
+        self.active: List[str] = [self.genesis.hash]
+        self.tx_index: Dict[str, str] = {}
+        # previous_hash -> {hash: block} for blocks that arrived before their parent
+        self.orphans: Dict[str, Dict[str, Block]] = {}
+        self.invalid = set()
+        self.logger = logging.getLogger(__name__)
+
+        # Account balances follow the active chain; with a state, blocks whose
+        # senders overspend are rejected when connected
+        self.state = None
+        if state is not None and state.tip is None:
+            state.apply_block(genesis)
+
+        # Stored blocks had their signatures checked when first accepted, so
+        # a restart re-indexes them with the cheap checks only
+        self.storage = None
+        if storage is not None:
+            self.verify_signatures = False
+            for block in storage.load_blocks():
+                try:
+                    self.add_block(block)
+                except BlockError as e:
+                    self.logger.warning("Skipping stored block: %s", e)
+            self.verify_signatures = verify_signatures
+            self.storage = storage
+        if state is not None:
+            self._catch_up_state(state)
+        self.state = state
+
+    def _catch_up_state(self, state):
+        """Bring a state loaded from a snapshot up to the tip, replaying from genesis if it is off the active chain"""
+        if self.block_at(state.height) is None or self.active[state.height] != state.tip:
+            if state.tip is not None:
+                self.logger.warning("State snapshot is not on the active chain; rebuilding from genesis")
+            state.reset()
+            state.apply_block(self.genesis.block)
+        for height in range(state.height + 1, len(self.active)):
+            entry = self.entries[self.active[height]]
+            try:
+                state.apply_block(entry.block)
+            except BlockError as e:
+                # Stored before the state check rejected it, or by an older version
+                self.logger.warning("Dropping stored branch at height %d: %s", height, e)
+                self._drop_branch(entry)
+                break
+
+    def _drop_branch(self, entry: ChainEntry):
+        """Disconnect and forget ``entry`` and every block built on it"""
+        while self.tip.height >= entry.height:
+            self._disconnect(self.tip)
+        bad = {entry.hash}
+        for other in sorted(self.entries.values(), key=lambda e: e.height):
+            if other.parent is not None and other.parent.hash in bad:
+                bad.add(other.hash)
+        for block_hash in bad:
+            del self.entries[block_hash]
+            if self.storage is not None:
+                self.storage.remove_block(block_hash)
+        self.invalid.update(bad)
+
+    @property
+    def height(self) -> int:
+        return self.tip.height
+
+    def block_at(self, height: int) -> Optional[Block]:
+        """Block at a height on the active chain"""
+        if 0 <= height < len(self.active):
+            return self.entries[self.active[height]].block
+        return None
+
+    def get_block(self, block_hash: str) -> Optional[Block]:
+        entry = self.entries.get(block_hash)
+        return entry.block if entry else None
+
+    def __contains__(self, block_hash: str) -> bool:
+        return block_hash in self.entries
+
+    def __len__(self) -> int:
+        return len(self.active)
+
+    def assemble(self, pool: Optional[TransactionPool] = None, timestamp: int = None) -> Block:
+        """Build an unsolved block on the tip from the pool's best transactions"""
+        pool = pool or self.pool
+        transactions = []
+        spent: Dict[str, float] = {}
+        if pool is not None:
+            # Over-select so transactions already on chain do not leave the block short
+            for tx in pool.top(self.max_block_transactions * 2):
+                if tx.calculate_hash() not in self.tx_index:
+                    if self.state is not None:
+                        total = spent.get(tx.sender, 0.0) + tx.amount
+                        if total > self.state.balance(tx.sender):
+                            continue
+                        spent[tx.sender] = total
+                    transactions.append(tx)
+                    if len(transactions) == self.max_block_transactions:
+                        break
+        timestamp = int(time.time()) if timestamp is None else timestamp
+        timestamp = max(timestamp, self.median_time(self.tip) + 1)
+        return Block(self.tip.height + 1, self.tip.hash, transactions, self.bits, timestamp=timestamp)
+
+    def median_time(self, entry: ChainEntry) -> int:
+        """Median timestamp of the last few blocks ending at ``entry``"""
+        timestamps = []
+        while entry is not None and len(timestamps) < MEDIAN_TIME_SPAN:
+            timestamps.append(entry.block.timestamp)
+            entry = entry.parent
+        timestamps.sort()
+        return timestamps[len(timestamps) // 2]
+
+    def check_block(self, block: Block):
+        """Checks that need nothing but the block itself"""
+        if block.bits != self.bits:
+            raise BlockError(f"Wrong difficulty: {block.bits}")
+        if not meets_target(block.calculate_hash(), block.bits):
+            raise BlockError("Insufficient proof of work")
+        if len(block.transactions) > self.max_block_transactions:
+            raise BlockBodyError(f"Too many transactions: {len(block.transactions)}")
+        tx_ids = hash_transactions(block.transactions)
+        # Also rules out repeating the last transactions of an odd Merkle
+        # level, which leaves the root unchanged (CVE-2012-2459)
+        if len(set(tx_ids)) != len(tx_ids):
+            raise BlockBodyError("Duplicate transaction in block")
+        if compute_merkle_root(tx_ids) != block.merkle_root:
+            raise BlockBodyError("Merkle root mismatch")
+        if self.verify_signatures:
+            for tx in block.transactions:
+                try:
+                    valid = tx.verify(deserialize_public_key(tx.verification_key()))
+                except Exception:
+                    # An unparseable key, e.g. a fingerprint sender with no key attached
+                    valid = False
+                if not valid:
+                    raise BlockBodyError(f"Invalid signature: {tx.calculate_hash()}")
+
+    def check_against_parent(self, block: Block, parent: ChainEntry):
+        """Checks that need only the parent entry, not the whole chain"""
+        if block.height != parent.height + 1:
+            raise BlockError(f"Wrong height: {block.height}")
+        if block.timestamp <= self.median_time(parent):
+            raise BlockError("Timestamp not after median of recent blocks")
+        if block.timestamp > time.time() + self.max_future_drift:
+            raise BlockError("Timestamp too far in the future")
+
+    def add_block(self, block: Block) -> bool:
+        """Validate and index a block; returns True if the tip changed"""
+        block_hash = block.calculate_hash()
+        if block_hash in self.entries:
+            return False
+        if block_hash in self.invalid or block.previous_hash in self.invalid:
+            self.invalid.add(block_hash)
+            raise BlockError(f"Block builds on an invalid block: {block_hash}")
+
+        parent = self.entries.get(block.previous_hash)
+        if parent is None:
+            self._add_orphan(block)
+            return False
+
+        tip = self.tip
+        self._connect_entry(block, parent)
+        # Blocks waiting on this one can now be validated too
+        pending = [block_hash]
+        while pending:
+            for orphan in self.orphans.pop(pending.pop(), {}).values():
+                try:
+                    self._connect_entry(orphan, self.entries[orphan.previous_hash])
+                    pending.append(orphan.calculate_hash())
+                except BlockError as e:
+                    self.logger.warning("Rejected orphan block: %s", e)
+        return self.tip is not tip
+
+    def _connect_entry(self, block: Block, parent: ChainEntry):
+        try:
+            self.check_block(block)
+            self.check_against_parent(block, parent)
+        except BlockBodyError:
+            raise
+        except BlockError:
+            self.invalid.add(block.calculate_hash())
+            raise
+        entry = ChainEntry(block, parent)
+        self.entries[entry.hash] = entry
+        if self.storage is not None:
+            self.storage.save_block(block)
+        if entry.work > self.tip.work:
+            self._reorganize(entry)
+
+    def _add_orphan(self, block: Block):
+        if sum(len(blocks) for blocks in self.orphans.values()) >= self.max_orphans:
+            self.orphans.pop(next(iter(self.orphans)))
+        self.orphans.setdefault(block.previous_hash, {})[block.calculate_hash()] = block
+
+    def fork_point(self, a: ChainEntry, b: ChainEntry) -> Tuple[ChainEntry, List[ChainEntry], List[ChainEntry]]:
+        """Common ancestor of two entries, plus the entries above it on each side"""
+        a_side, b_side = [], []
+        while a.height > b.height:
+            a_side.append(a)
+            a = a.parent
+        while b.height > a.height:
+            b_side.append(b)
+            b = b.parent
+        while a is not b:
+            a_side.append(a)
+            b_side.append(b)
+            a, b = a.parent, b.parent
+        return a, a_side, b_side[::-1]
+
+    def _reorganize(self, new_tip: ChainEntry):
+        """Switch the active chain to ``new_tip``, touching only blocks above the fork"""
+        fork, disconnect, connect = self.fork_point(self.tip, new_tip)
+        for entry in disconnect:
+            self._disconnect(entry)
+
+        connected = []
+        for entry in connect:
+            try:
+                self._connect(entry)
+            except BlockError:
+                # Undo the partial switch and restore the old branch
+                bad = connect[len(connected):]
+                self.invalid.update(e.hash for e in bad)
+                for e in bad:
+                    self.entries.pop(e.hash, None)
+                    if self.storage is not None:
+                        self.storage.remove_block(e.hash)
+                for e in reversed(connected):
+                    self._disconnect(e)
+                for e in reversed(disconnect):
+                    self._connect(e)
+                raise
+
+            connected.append(entry)
+
+        if disconnect:
+            self.logger.info("Reorganized %d blocks at height %d", len(disconnect), fork.height)
+
+    def _connect(self, entry: ChainEntry):
+        tx_ids = [tx.calculate_hash() for tx in entry.block.transactions]
+        for tx_id in tx_ids:
+            if tx_id in self.tx_index:
+                raise BlockError(f"Transaction already on chain: {tx_id}")
+        if self.state is not None:
+            self.state.apply_block(entry.block)
+        for tx_id in tx_ids:
+            self.tx_index[tx_id] = entry.hash
+        del self.active[entry.height:]
+        self.active.append(entry.hash)
+        self.tip = entry
+        if self.pool is not None:
+            for tx_id in tx_ids:
+                self.pool.remove_transaction(tx_id)
+            if self.state is not None and self.pool.state is not None:
+                self.pool.revalidate({tx.sender for tx in entry.block.transactions})
+
+    def _disconnect(self, entry: ChainEntry):
+        if self.state is not None and not self.state.revert_block(entry.block):
+            # Undo records only reach back ``max_undo`` blocks
+            self.state.reset()
+            for height in range(entry.height):
+                self.state.apply_block(self.entries[self.active[height]].block)
+        for tx in entry.block.transactions:
+            self.tx_index.pop(tx.calculate_hash(), None)
+            if self.pool is not None:
+                self.pool.add_transaction(tx)
+        del self.active[entry.height:]
+        self.tip = entry.parent
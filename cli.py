@@ -3,15 +3,15 @@ import cmd
 import json
 from node import Node
 from transaction import Transaction
-from utils import generate_key_pair
+from utils import generate_key_pair, serialize_public_key
 
 class DesoCLI(cmd.Cmd):
     prompt = 'deso> '
 
-    def __init__(self):
+    def __init__(self, scheme: str = 'ed25519'):
         super().__init__()
         self.node: Node | None = None
-        self.private_key, self.public_key = generate_key_pair()
+        self.private_key, self.public_key = generate_key_pair(scheme)
 
     def do_start(self, arg):
         """Start the node: start [port]"""
@@ -43,7 +43,7 @@ class DesoCLI(cmd.Cmd):
             amount = float(amount)
 
             # Create and sign transaction
-            tx = Transaction(str(self.public_key), recipient, amount)
+            tx = Transaction.create(serialize_public_key(self.public_key), recipient, amount)
             tx.sign(self.private_key)
 
             # Broadcast transaction
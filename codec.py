@@ -0,0 +1,348 @@
+import codecs
+import json
+import struct
+from typing import List, Optional, Tuple
+
+# Largest frame (or JSON line) accepted from a peer
+MAX_FRAME_SIZE = 4 * 1024 * 1024
+
+# Message types with a one-byte code on the binary wire; anything else is
+# sent with code 0 and its 'type' kept in the body
+MESSAGE_TYPES = [
+    'hello', 'hello_ack', 'get_peers', 'peers', 'ping', 'pong',
+    'inv', 'getdata', 'transaction', 'find_node', 'nodes',
+    'sync', 'sync_batch', 'sync_ack',
+    'reconcile', 'reconcile_want', 'reconcile_fail',
+]
+TYPE_CODES = {name: code for code, name in enumerate(MESSAGE_TYPES, start=1)}
+
+_utf8_decode = codecs.utf_8_decode
+_HEADER = struct.Struct('>IB')
+_U8 = struct.Struct('>B')
+_U32 = struct.Struct('>I')
+_I64 = struct.Struct('>q')
+_F64 = struct.Struct('>d')
+
+# Value tags for the packed body. _DIGESTS is a list of lowercase 64-digit
+# hex strings (transaction and block IDs) sent as raw 32-byte digests.
+_NONE, _FALSE, _TRUE, _INT, _BIGINT, _FLOAT, _STR8, _STR32, _BYTES, _LIST, _DICT, _DIGESTS = range(12)
+
+
+class CodecError(ValueError):
+    """Raised when a peer sends a malformed or oversized message"""
+
+
+class JsonCodec:
+    """Newline-delimited JSON; the default, as C-level parsing decodes small messages fastest"""
+
+    name = 'json'
+
+    def __init__(self, max_size: int = MAX_FRAME_SIZE):
+        self.max_size = max_size
+        # Size of the message most recently returned by ``read``
+        self.last_size = 0
+
+    def encode(self, message: dict) -> bytes:
+        return json.dumps(message, separators=(',', ':')).encode() + b'\n'
+
+    async def read(self, reader, prefix: bytes = b'') -> Optional[dict]:
+        """Read one message, returning None at end of stream"""
+        try:
+            line = prefix + await reader.readline()
+        except ValueError as e:
+            raise CodecError(f"Message exceeds limit: {str(e)}")
+        if not line:
+            return None
+        if len(line) > self.max_size:
+            raise CodecError(f"Message of {len(line)} bytes exceeds limit")
+        self.last_size = len(line)
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError as e:
+            raise CodecError(f"Invalid JSON: {str(e)}")
+        except RecursionError:
+            raise CodecError("Message nested too deeply")
+
+
+class BinaryCodec:
+    """Length-prefixed binary frames.
+
+    Each frame is a 4-byte big-endian length, a message type byte and a
+    struct-packed body. Bodies are decoded straight from a memoryview over
+    the received buffer, so no intermediate slices are copied. Lists of
+    hex IDs go as raw digests, halving inv and block announcements.
+    """
+
+    name = 'binary'
+
+    def __init__(self, max_size: int = MAX_FRAME_SIZE):
+        self.max_size = max_size
+        # Size of the frame most recently returned by ``read``
+        self.last_size = 0
+
+    def encode(self, message: dict) -> bytes:
+        code = TYPE_CODES.get(message.get('type'), 0)
+        if code:
+            message = {key: value for key, value in message.items() if key != 'type'}
+        out = bytearray(_HEADER.size)
+        _pack(message, out)
+        _HEADER.pack_into(out, 0, len(out) - 4, code)
+        return bytes(out)
+
+    def decode(self, buffer, offset: int = 0) -> Tuple[Optional[dict], int]:
+        """Decode the frame at ``offset``.
+
+        Returns the message and the offset just past it, or ``(None, offset)``
+        if the buffer does not yet hold a whole frame.
+        """
+        view = memoryview(buffer)
+        if len(view) - offset < _HEADER.size:
+            return None, offset
+        length, code = _HEADER.unpack_from(view, offset)
+        if not 1 <= length <= self.max_size:
+            raise CodecError(f"Invalid frame length {length}")
+        end = offset + 4 + length
+        if len(view) < end:
+            return None, offset
+        return self._decode_body(view[:end], offset + _HEADER.size, code), end
+
+    def decode_all(self, buffer) -> Tuple[List[dict], int]:
+        """Decode every complete frame in a buffer, returning them and the bytes consumed"""
+        messages = []
+        offset = 0
+        while True:
+            message, offset_after = self.decode(buffer, offset)
+            if message is None:
+                return messages, offset
+            messages.append(message)
+            offset = offset_after
+
+    def _decode_body(self, view: memoryview, offset: int, code: int) -> dict:
+        try:
+            message, end = _unpack(view, offset)
+        except (struct.error, IndexError, UnicodeDecodeError) as e:
+            raise CodecError(f"Malformed frame: {str(e)}")
+        except RecursionError:
+            raise CodecError("Frame nested too deeply")
+        if end != len(view) or not isinstance(message, dict):
+            raise CodecError("Malformed frame body")
+        if code:
+            if code > len(MESSAGE_TYPES):
+                raise CodecError(f"Unknown message type code {code}")
+            message['type'] = MESSAGE_TYPES[code - 1]
+        return message
+
+    async def read(self, reader, prefix: bytes = b'') -> Optional[dict]:
+        """Read one frame, returning None at end of stream"""
+        try:
+            header = prefix + await reader.readexactly(_HEADER.size - len(prefix))
+        except EOFError as e:
+            if e.partial or prefix:
+                raise CodecError("Truncated frame header")
+            return None
+        length, code = _HEADER.unpack(header)
+        if not 1 <= length <= self.max_size:
+            raise CodecError(f"Invalid frame length {length}")
+        try:
+            body = await reader.readexactly(length - 1)
+        except EOFError:
+            raise CodecError("Truncated frame")
+        self.last_size = 4 + length
+        return self._decode_body(memoryview(body), 0, code)
+
+
+CODECS = {
+    JsonCodec.name: JsonCodec,
+    BinaryCodec.name: BinaryCodec,
+}
+
+
+def get_codec(name: str):
+    """Create a codec by name"""
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown codec: {name}")
+
+
+async def read_first(reader) -> Tuple[object, Optional[dict]]:
+    """Detect the codec a peer opened with and read its first message.
+
+    JSON messages always start with ``{`` while a binary frame starts with
+    the high byte of its length, which is zero for any frame under the size
+    limit, so the first byte on a stream tells the two apart.
+    """
+    prefix = await reader.read(1)
+    if not prefix:
+        return None, None
+    codec = JsonCodec() if prefix == b'{' else BinaryCodec()
+    return codec, await codec.read(reader, prefix)
+
+
+_KEY_CACHE = {}
+
+
+def _pack_key(key: str) -> bytes:
+    """Dict keys are short and repetitive, so their encoding is cached"""
+    packed = _KEY_CACHE.get(key)
+    if packed is None:
+        raw = key.encode()
+        if len(raw) > 255:
+            raise ValueError(f"Key too long: {key[:32]}...")
+        packed = bytes((len(raw),)) + raw
+        if len(_KEY_CACHE) < 1024:
+            _KEY_CACHE[key] = packed
+    return packed
+
+
+def _pack(value, out: bytearray):
+    kind = type(value)
+    if kind is str:
+        raw = value.encode()
+        if len(raw) < 256:
+            out += bytes((_STR8, len(raw)))
+        else:
+            out.append(_STR32)
+            out += _U32.pack(len(raw))
+        out += raw
+    elif kind is dict:
+        out.append(_DICT)
+        out += _U32.pack(len(value))
+        for key, item in value.items():
+            out += _pack_key(key if type(key) is str else str(key))
+            _pack(item, out)
+    elif value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif kind is int or isinstance(value, int):
+        if -2 ** 63 <= value < 2 ** 63:
+            out.append(_INT)
+            out += _I64.pack(value)
+        else:
+            raw = value.to_bytes((value.bit_length() + 8) // 8, 'big', signed=True)
+            out.append(_BIGINT)
+            out += _U32.pack(len(raw))
+            out += raw
+    elif kind is float:
+        out.append(_FLOAT)
+        out += _F64.pack(value)
+    elif kind is list or kind is tuple:
+        raw = _pack_digests(value)
+        if raw is not None:
+            out.append(_DIGESTS)
+            out += _U32.pack(len(value))
+            out += raw
+            return
+        out.append(_LIST)
+        out += _U32.pack(len(value))
+        for item in value:
+            _pack(item, out)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        out.append(_BYTES)
+        out += _U32.pack(len(value))
+        out += value
+    elif isinstance(value, str):
+        _pack(str(value), out)
+    elif isinstance(value, dict):
+        _pack(dict(value), out)
+    else:
+        raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def _pack_digests(items) -> Optional[bytes]:
+    """Raw bytes of a list of hex digests, or None if it is anything else"""
+    if not items or type(items[0]) is not str or len(items[0]) != 64:
+        return None
+    try:
+        joined = ''.join(items)
+        if set(map(len, items)) != {64}:
+            return None
+        raw = bytes.fromhex(joined)
+    except (TypeError, ValueError):
+        return None
+    # fromhex skips whitespace and accepts upper case; neither would round-trip
+    return raw if raw.hex() == joined else None
+
+
+def _slice(view: memoryview, offset: int, length: int) -> memoryview:
+    end = offset + length
+    if end > len(view):
+        raise CodecError("Value runs past end of frame")
+    return view[offset:end]
+
+
+def _unpack(view: memoryview, offset: int):
+    tag = view[offset]
+    offset += 1
+    if tag == _STR8:
+        end = offset + 1 + view[offset]
+        if end > len(view):
+            raise CodecError("Value runs past end of frame")
+        return _utf8_decode(view[offset + 1:end], 'strict', True)[0], end
+    if tag == _DICT:
+        count = _U32.unpack_from(view, offset)[0]
+        offset += 4
+        result = {}
+        size = len(view)
+        for _ in range(count):
+            end = offset + 1 + view[offset]
+            if end > size:
+                raise CodecError("Key runs past end of frame")
+            key = _utf8_decode(view[offset + 1:end], 'strict', True)[0]
+            # Short strings and numbers are most values; skip the call for them
+            tag = view[end]
+            if tag == _STR8:
+                offset = end + 2 + view[end + 1]
+                if offset > size:
+                    raise CodecError("Value runs past end of frame")
+                result[key] = _utf8_decode(view[end + 2:offset], 'strict', True)[0]
+            elif tag == _INT:
+                result[key] = _I64.unpack_from(view, end + 1)[0]
+                offset = end + 9
+            elif tag == _FLOAT:
+                result[key] = _F64.unpack_from(view, end + 1)[0]
+                offset = end + 9
+            else:
+                result[key], offset = _unpack(view, end)
+        return result, offset
+    if tag == _INT:
+        return _I64.unpack_from(view, offset)[0], offset + 8
+    if tag == _FLOAT:
+        return _F64.unpack_from(view, offset)[0], offset + 8
+    if tag == _NONE:
+        return None, offset
+    if tag == _TRUE:
+        return True, offset
+    if tag == _FALSE:
+        return False, offset
+    if tag == _STR32:
+        length = _U32.unpack_from(view, offset)[0]
+        offset += 4
+        return _utf8_decode(_slice(view, offset, length), 'strict', True)[0], offset + length
+    if tag == _BYTES:
+        length = _U32.unpack_from(view, offset)[0]
+        offset += 4
+        return bytes(_slice(view, offset, length)), offset + length
+    if tag == _BIGINT:
+        length = _U32.unpack_from(view, offset)[0]
+        offset += 4
+        return int.from_bytes(_slice(view, offset, length), 'big', signed=True), offset + length
+    if tag == _DIGESTS:
+        count = _U32.unpack_from(view, offset)[0]
+        offset += 4
+        if not count:
+            return [], offset
+        # One hex call with a separator every digest, then a C-level split
+        return _slice(view, offset, count * 32).hex(' ', 32).split(' '), offset + count * 32
+    if tag == _LIST:
+        count = _U32.unpack_from(view, offset)[0]
+        offset += 4
+        items = []
+        for _ in range(count):
+            item, offset = _unpack(view, offset)
+            items.append(item)
+        return items, offset
+    raise CodecError(f"Unknown value tag {tag}")
@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import random
+import time
+import weakref
+from typing import Awaitable, Callable, Dict, List, Optional
+from codec import CodecError, get_codec
+from transport import TcpTransport
+
+# What to discard when a peer's send queue is full
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+
+class PeerConnection:
+    """A single long-lived stream to a peer with its own send queue"""
+
+    def __init__(self, peer: tuple, manager: 'ConnectionManager'):
+        self.peer = peer
+        self.manager = manager
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=manager.max_queue)
+        self.dropped = 0
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.failures = 0
+        self._reader_task: Optional[asyncio.Task] = None
+        self._sender_task = asyncio.create_task(self._send_loop())
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+
+    def attach(self, reader, writer, read: bool = True):
+        """Use an already-open stream for this peer"""
+        self.reader, self.writer = reader, writer
+        if read:
+            self._reader_task = asyncio.create_task(self._read_loop(reader, writer))
+
+    def detach(self):
+        """Forget the current stream; the next send reconnects"""
+        self.reader, self.writer = None, None
+
+    def send(self, message: dict) -> bool:
+        """Queue a message for delivery, applying the drop policy when full"""
+        if self.queue.full():
+            self.dropped += 1
+            if self.manager.drop_policy == DROP_NEWEST:
+                return False
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+        return True
+
+    async def connect(self) -> bool:
+        """Open an outbound stream and perform the handshake"""
+        host, port = self.peer
+        try:
+            async with self.manager.slots:
+                reader, writer = await asyncio.wait_for(
+                    self.manager.transport.open_connection(host, port),
+                    self.manager.connect_timeout
+                )
+                self.manager.register(writer, self.manager.codec)
+                hello = self.manager.handshake()
+                if hello is not None:
+                    writer.write(self.manager.codec.encode(hello))
+                    await asyncio.wait_for(writer.drain(), self.manager.send_deadline)
+        except (OSError, asyncio.TimeoutError) as e:
+            self.manager.logger.debug("Connect to %s failed: %s", self.peer, e)
+            return False
+
+        self.attach(reader, writer)
+        return True
+
+    async def _reconnect(self) -> bool:
+        """Reconnect with exponential backoff, giving up after max_retries"""
+        while self.failures < self.manager.max_retries:
+            if await self.connect():
+                return True
+            self.failures += 1
+            delay = min(self.manager.backoff_max, self.manager.backoff_base * 2 ** (self.failures - 1))
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+        return False
+
+    async def _send_loop(self):
+        """Drain the send queue onto the stream, reconnecting as needed.
+
+        Queued messages are coalesced into writes of up to ``max_batch_bytes``. A peer
+        that cannot absorb it within ``send_deadline`` is treated as stalled:
+        its stream is dropped and the batch retried on a fresh connection.
+        """
+        try:
+            while True:
+                batch = [await self.queue.get()]
+                while True:
+                    if not self.connected and not await self._reconnect():
+                        self.manager.lost(self)
+                        return
+                    writer = self.writer
+                    # Encode per attempt: a reconnect may land on a stream
+                    # using a different codec
+                    codec = self.manager.codec_for(writer)
+                    chunks = [codec.encode(message) for message in batch]
+                    size = sum(len(chunk) for chunk in chunks)
+                    while not self.queue.empty() and size < self.manager.max_batch_bytes:
+                        batch.append(self.queue.get_nowait())
+                        chunks.append(codec.encode(batch[-1]))
+                        size += len(chunks[-1])
+                    data = b''.join(chunks)
+                    try:
+                        async with self.manager.slots:
+                            started = time.perf_counter()
+                            writer.write(data)
+                            await asyncio.wait_for(writer.drain(), self.manager.send_deadline)
+                        metrics = self.manager.metrics
+                        if metrics is not None:
+                            metrics.send_seconds.observe(time.perf_counter() - started)
+                            for message, chunk in zip(batch, chunks):
+                                metrics.sent(message.get('type'), len(chunk))
+                        self.failures = 0
+                        self.manager.on_sent(self.peer, batch)
+                        break
+                    except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+                        self.manager.logger.debug("Send to %s failed: %r", self.peer, e)
+                        self.failures += 1
+                        self.detach()
+                        writer.close()
+        except asyncio.CancelledError:
+            pass
+
+    async def _read_loop(self, reader, writer):
+        """Dispatch messages arriving on an outbound stream"""
+        codec = self.manager.codec_for(writer)
+        try:
+            while True:
+                message = await codec.read(reader)
+                if message is None:
+                    break
+                if self.manager.metrics is not None:
+                    self.manager.metrics.received(message.get('type'), codec.last_size)
+                await self.manager.on_message(message, writer, self.peer)
+        except (ConnectionError, OSError, CodecError) as e:
+            self.manager.logger.debug("Read from %s failed: %s", self.peer, e)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if self.writer is writer:
+                self.detach()
+            writer.close()
+
+    async def close(self):
+        """Stop the send/read tasks and close the stream"""
+        for task in (self._sender_task, self._reader_task):
+            if task is not None:
+                task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        self.detach()
+
+
+class ConnectionManager:
+    """Keeps one persistent, multiplexed stream per peer.
+
+    Outbound streams opened by ``connect`` and inbound streams registered with
+    ``attach`` are both reused for sending, so broadcasting is a queue push per
+    peer instead of a fresh TCP handshake. Each peer's queue is bounded: when
+    it fills up, ``drop_policy`` decides whether the oldest queued message or
+    the new one is discarded, so a slow peer never holds up the others.
+
+    Outbound streams speak ``codec``; inbound streams keep whichever codec the
+    remote side opened with, as recorded by ``register``. ``on_sent`` is
+    called with each batch of messages once it has drained to the peer.
+    """
+
+    def __init__(self, on_message: Callable[[dict, asyncio.StreamWriter, tuple], Awaitable[None]],
+                 handshake: Callable[[], Optional[dict]] = lambda: None,
+                 on_lost: Callable[[tuple], None] = lambda peer: None,
+                 on_sent: Callable[[tuple, List[dict]], None] = lambda peer, batch: None,
+                 connect_timeout: float = 5.0, max_retries: int = 5,
+                 backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 max_queue: int = 1000, drop_policy: str = DROP_OLDEST,
+                 send_deadline: float = 2.0, max_concurrent: int = 64,
+                 max_batch_bytes: int = 64 * 1024, codec: str = 'json', metrics=None,
+                 transport=None):
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.on_message = on_message
+        self.handshake = handshake
+        self.on_lost = on_lost
+        self.on_sent = on_sent
+        self.max_queue = max_queue
+        self.drop_policy = drop_policy
+        self.send_deadline = send_deadline
+        self.max_batch_bytes = max_batch_bytes
+        # Bounds how many peers may be connecting or flushing at once
+        self.slots = asyncio.Semaphore(max_concurrent)
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.codec = get_codec(codec)
+        self.stream_codecs = weakref.WeakKeyDictionary()
+        self.connections: Dict[tuple, PeerConnection] = {}
+        # Optional NodeMetrics counting traffic per message type
+        self.metrics = metrics
+        # Opens outbound streams; see transport.py
+        self.transport = transport or TcpTransport()
+        self.logger = logging.getLogger(__name__)
+
+    def register(self, writer, codec):
+        """Record the codec a stream speaks"""
+        self.stream_codecs[writer] = codec
+
+    def codec_for(self, writer):
+        """Codec for a stream, defaulting to the preferred outbound codec"""
+        return self.stream_codecs.get(writer, self.codec)
+
+    def encode(self, writer, message: dict) -> bytes:
+        """Encode a message for a particular stream"""
+        data = self.codec_for(writer).encode(message)
+        if self.metrics is not None:
+            self.metrics.sent(message.get('type'), len(data))
+        return data
+
+    def get(self, peer: tuple) -> PeerConnection:
+        """Get the connection for a peer, creating it if needed"""
+        conn = self.connections.get(peer)
+        if conn is None:
+            conn = PeerConnection(peer, self)
+            self.connections[peer] = conn
+        return conn
+
+    async def connect(self, peer: tuple) -> bool:
+        """Open an outbound stream to a peer unless one is already up"""
+        conn = self.get(peer)
+        if conn.connected:
+            return True
+        return await conn.connect()
+
+    def attach(self, peer: tuple, reader, writer):
+        """Register an inbound stream so it is reused for sends to the peer"""
+        conn = self.get(peer)
+        if not conn.connected:
+            conn.attach(reader, writer, read=False)
+
+    def detach(self, writer):
+        """Forget an inbound stream that has closed"""
+        for conn in self.connections.values():
+            if conn.writer is writer:
+                conn.detach()
+
+    def send(self, peer: tuple, message: dict) -> bool:
+        """Queue a message to a single peer"""
+        return self.get(peer).send(message)
+
+    def broadcast(self, message: dict, peers) -> int:
+        """Queue a message to each of the given peers, returning how many accepted it"""
+        return sum(self.send(peer, message) for peer in peers)
+
+    def queue_depths(self) -> Dict[tuple, int]:
+        """Number of messages waiting in each peer's send queue"""
+        return {peer: conn.queue.qsize() for peer, conn in self.connections.items()}
+
+    def lost(self, conn: PeerConnection):
+        """Drop a peer whose reconnect attempts are exhausted"""
+        if self.connections.get(conn.peer) is conn:
+            del self.connections[conn.peer]
+        self.logger.warning("Peer %s unreachable, dropping", conn.peer)
+        self.on_lost(conn.peer)
+
+    async def close(self):
+        """Close every peer connection"""
+        connections = list(self.connections.values())
+        self.connections.clear()
+        for conn in connections:
+            await conn.close()
@@ -0,0 +1,118 @@
+import functools
+import hashlib
+import random
+import time
+from collections import OrderedDict, namedtuple
+from typing import Dict, List, Optional
+
+Contact = namedtuple('Contact', ['node_id', 'host', 'port'])
+
+
+@functools.lru_cache(maxsize=65536)
+def node_key(node_id: str) -> int:
+    """Position of a node ID in the 160-bit XOR keyspace"""
+    return int.from_bytes(hashlib.sha1(node_id.encode()).digest(), 'big')
+
+
+def distance(a: int, b: int) -> int:
+    """XOR distance between two keys"""
+    return a ^ b
+
+
+class KBucket:
+    """Up to ``k`` contacts ordered from least to most recently seen"""
+
+    def __init__(self, k: int):
+        self.k = k
+        self.contacts: 'OrderedDict[str, Contact]' = OrderedDict()
+        self.replacements: 'OrderedDict[str, Contact]' = OrderedDict()
+        self.last_updated = time.monotonic()
+
+    def update(self, contact: Contact) -> bool:
+        """Mark a contact as seen; returns False if the bucket is full and it was only cached"""
+        self.last_updated = time.monotonic()
+        if contact.node_id in self.contacts:
+            self.contacts.move_to_end(contact.node_id)
+            self.contacts[contact.node_id] = contact
+            return True
+        if len(self.contacts) < self.k:
+            self.contacts[contact.node_id] = contact
+            return True
+        self.replacements.pop(contact.node_id, None)
+        self.replacements[contact.node_id] = contact
+        while len(self.replacements) > self.k:
+            self.replacements.popitem(last=False)
+        return False
+
+    def remove(self, node_id: str):
+        """Drop a contact, promoting the freshest replacement into its slot"""
+        if self.contacts.pop(node_id, None) is not None and self.replacements:
+            _, replacement = self.replacements.popitem()
+            self.contacts[replacement.node_id] = replacement
+
+    def oldest(self) -> Optional[Contact]:
+        return next(iter(self.contacts.values()), None)
+
+
+class RoutingTable:
+    """Kademlia routing table keyed by XOR distance from our own node ID.
+
+    Bucket ``i`` holds contacts whose distance has its highest set bit at
+    position ``i``, so the table keeps at most ``k`` contacts per distance
+    order of magnitude: O(k log N) state for an N-node network.
+    """
+
+    def __init__(self, node_id: str, k: int = 20):
+        self.node_id = node_id
+        self.key = node_key(node_id)
+        self.k = k
+        self.buckets: Dict[int, KBucket] = {}
+
+    def bucket_index(self, key: int) -> int:
+        return distance(self.key, key).bit_length() - 1
+
+    def update(self, contact: Contact) -> Optional[Contact]:
+        """Record that a contact was seen.
+
+        If its bucket is full the contact goes to the replacement cache and the
+        bucket's least recently seen contact is returned, so the caller can
+        ping it and ``remove`` it if it is dead.
+        """
+        if contact.node_id == self.node_id:
+            return None
+        index = self.bucket_index(node_key(contact.node_id))
+        bucket = self.buckets.get(index)
+        if bucket is None:
+            bucket = self.buckets[index] = KBucket(self.k)
+        if bucket.update(contact):
+            return None
+        return bucket.oldest()
+
+    def remove(self, node_id: str):
+        """Forget a contact that failed to respond"""
+        bucket = self.buckets.get(self.bucket_index(node_key(node_id)))
+        if bucket is not None:
+            bucket.remove(node_id)
+
+    def closest(self, key: int, count: Optional[int] = None) -> List[Contact]:
+        """The ``count`` known contacts nearest to ``key``"""
+        contacts = [contact for bucket in self.buckets.values() for contact in bucket.contacts.values()]
+        contacts.sort(key=lambda contact: distance(node_key(contact.node_id), key))
+        return contacts[:count or self.k]
+
+    def stale_buckets(self, max_age: float) -> List[int]:
+        """Indices of buckets with no activity in the last ``max_age`` seconds"""
+        now = time.monotonic()
+        return [index for index, bucket in self.buckets.items() if now - bucket.last_updated > max_age]
+
+    def random_key_in_bucket(self, index: int) -> int:
+        """A random key that falls into bucket ``index``, used to refresh it"""
+        offset = (1 << index) | random.getrandbits(index) if index > 0 else 1
+        return self.key ^ offset
+
+    def __len__(self) -> int:
+        return sum(len(bucket.contacts) for bucket in self.buckets.values())
+
+    def __iter__(self):
+        for bucket in self.buckets.values():
+            yield from bucket.contacts.values()
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import logging
+import socket
+import struct
+from typing import Callable, Optional, Set
+
+MULTICAST_GROUP = '239.255.77.77'
+MULTICAST_PORT = 17777
+MAX_DATAGRAM = 1024
+
+
+class MulticastDiscovery(asyncio.DatagramProtocol):
+    """Zero-config LAN discovery over UDP multicast.
+
+    Every node periodically announces ``(node_id, host, port)`` to a multicast
+    group and listens for the announcements of others. When a node it has not
+    heard from before shows up, it answers with an immediate announcement of
+    its own, so a newcomer learns about the existing nodes within one round
+    trip instead of waiting for the next period.
+    """
+
+    def __init__(self, node_id: str, host: str, port: int,
+                 on_peer: Callable[[tuple, str], None],
+                 group: str = MULTICAST_GROUP, group_port: int = MULTICAST_PORT,
+                 interface: str = '0.0.0.0', interval: float = 30.0, ttl: int = 1):
+        self.node_id = node_id
+        self.host = host
+        self.port = port
+        self.on_peer = on_peer
+        self.group = group
+        self.group_port = group_port
+        self.interface = interface
+        self.interval = interval
+        self.ttl = ttl
+        self.seen: Set[str] = set()
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self._announce_task: Optional[asyncio.Task] = None
+        self._reply_pending = False
+        self.logger = logging.getLogger(__name__)
+
+    def _make_socket(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', self.group_port))
+        membership = struct.pack('4s4s', socket.inet_aton(self.group), socket.inet_aton(self.interface))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.ttl)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.interface))
+        sock.setblocking(False)
+        return sock
+
+    async def start(self):
+        """Join the group and start announcing"""
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, sock=self._make_socket())
+        self._announce_task = asyncio.create_task(self._announce_loop())
+        self.logger.info("Multicast discovery on %s:%s", self.group, self.group_port)
+
+    def announce(self):
+        """Send one announcement to the group"""
+        if self.transport is None:
+            return
+        message = {
+            'type': 'announce',
+            'node_id': self.node_id,
+            'host': self.host,
+            'port': self.port
+        }
+        self.transport.sendto(json.dumps(message).encode(), (self.group, self.group_port))
+
+    async def _announce_loop(self):
+        while True:
+            self.announce()
+            await asyncio.sleep(self.interval)
+
+    def _reply(self):
+        self._reply_pending = False
+        self.announce()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        if len(data) > MAX_DATAGRAM:
+            return
+        try:
+            message = json.loads(data)
+            if not isinstance(message, dict) or message.get('type') != 'announce':
+                return
+            node_id, host, port = message['node_id'], message['host'], int(message['port'])
+            # Anything else on the group must not reach on_peer or the seen set
+            if not isinstance(node_id, str) or not isinstance(host, str) or not 0 < port < 65536:
+                return
+        except (ValueError, KeyError, TypeError, RecursionError):
+            # A kilobyte of brackets is enough to exhaust json's recursion limit
+            return
+        if node_id == self.node_id:
+            return
+
+        # Nodes bound to the wildcard address are reachable at the sender's address
+        if host in ('0.0.0.0', ''):
+            host = addr[0]
+        self.on_peer((host, port), node_id)
+
+        if node_id not in self.seen:
+            self.seen.add(node_id)
+            # Coalesce replies when several newcomers appear at once
+            if not self._reply_pending:
+                self._reply_pending = True
+                asyncio.get_running_loop().call_later(0.05, self._reply)
+
+    def error_received(self, exc):
+        self.logger.debug("Multicast discovery error: %s", exc)
+
+    def close(self):
+        """Stop announcing and leave the group"""
+        if self._announce_task is not None:
+            self._announce_task.cancel()
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
@@ -0,0 +1,112 @@
+import atexit
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional, Tuple
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener: Optional[QueueListener] = None
+_handler: Optional[QueueHandler] = None
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per message template.
+
+    Records are keyed by logger and unformatted message, so every "Received
+    new transaction: %s" shares one bucket whatever the ID. Each key may log
+    ``burst`` records at once and ``rate`` per second after that; records
+    at ``exempt_level`` or above always pass. The next record let through
+    for a key notes how many were suppressed in between.
+    """
+
+    def __init__(self, rate: float = 10.0, burst: int = 20, exempt_level: int = logging.ERROR,
+                 max_keys: int = 4096):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.exempt_level = exempt_level
+        self.max_keys = max_keys
+        # key -> [tokens, last refill, suppressed]
+        self.buckets: Dict[Tuple[str, str], List[float]] = {}
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.exempt_level:
+            return True
+        key = (record.name, record.msg if isinstance(record.msg, str) else repr(type(record.msg)))
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            # Pre-formatted messages make a key per call; start over rather than grow
+            if len(self.buckets) >= self.max_keys:
+                self.buckets.clear()
+            bucket = self.buckets[key] = [self.burst, now, 0]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            bucket[2] += 1
+            self.suppressed += 1
+            return False
+        bucket[0] = tokens - 1
+        if bucket[2]:
+            record.msg = f"{record.msg} ({int(bucket[2])} similar messages suppressed)"
+            bucket[2] = 0
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Queue the record itself and leave formatting to the listener thread.
+
+    The stock handler merges ``args`` into the message before queueing, which
+    puts the formatting cost back on the caller. Log arguments must therefore
+    not be mutated after the call.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def configure_logging(level: int = logging.INFO, handlers: Optional[List[logging.Handler]] = None,
+                      rate: Optional[float] = 10.0, burst: int = 20) -> QueueListener:
+    """Route the root logger through a queue drained by a background thread.
+
+    Callers only append the record to a queue; ``handlers`` (a stderr stream
+    handler by default) run on the listener thread, so slow I/O never stalls
+    the event loop. With ``rate`` set, each message template is rate limited
+    before it is queued. Calling again replaces the previous pipeline.
+    """
+    global _listener, _handler
+    stop_logging()
+    if handlers is None:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers = [handler]
+
+    log_queue = queue.SimpleQueue()
+    _handler = DeferredQueueHandler(log_queue)
+    if rate is not None:
+        _handler.addFilter(RateLimitFilter(rate, burst))
+    root = logging.getLogger()
+    root.addHandler(_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and restore direct logging"""
+    global _listener, _handler
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
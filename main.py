@@ -1,14 +1,12 @@
 import asyncio
 import logging
 from cli import start_cli
+from logs import configure_logging
 
 async def main():
     """Main entry point for the Deso P2P application"""
-    # Setup logging
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
+    # Log through a background thread, rate limiting noisy messages
+    configure_logging(logging.INFO)
     logger = logging.getLogger(__name__)
 
     try:
@@ -16,7 +14,7 @@ async def main():
         logger.info("Starting Deso P2P application...")
         await asyncio.get_event_loop().run_in_executor(None, start_cli)
     except Exception as e:
-        logger.error(f"Application error: {str(e)}")
+        logger.error("Application error: %s", e)
         raise
 
 if __name__ == "__main__":
@@ -0,0 +1,213 @@
+import asyncio
+import bisect
+import logging
+import math
+from typing import Callable, Dict, List, Optional, Sequence
+
+# Seconds; spans an in-process queue hop up to a stalled peer
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonic count, optionally split by label values"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, *labels: str):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in self.values.items()]
+
+
+class Gauge:
+    """Current value; with ``function`` it is read only when scraped"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, function: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.help = help
+        self.function = function
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self) -> List[str]:
+        value = self.function() if self.function is not None else self.value
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram:
+    """Bucketed observations; each one costs a bisect and two additions"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_format_value(self.sum)}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class Registry:
+    """Named metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, help, function))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+class NodeMetrics:
+    """The counters and histograms a node updates on its hot paths.
+
+    A node without metrics holds None instead of this object, so every
+    instrumented site costs one ``is not None`` check when scraping is off.
+    Gauges such as peer count and queue depth are computed from the node
+    only when scraped.
+    """
+
+    def __init__(self, registry: Optional[Registry] = None):
+        self.registry = registry or Registry()
+        r = self.registry
+        self.messages_in = r.counter('deso_messages_received_total', "Messages received by type", ('type',))
+        self.bytes_in = r.counter('deso_bytes_received_total', "Bytes received by message type", ('type',))
+        self.messages_out = r.counter('deso_messages_sent_total', "Messages sent by type", ('type',))
+        self.bytes_out = r.counter('deso_bytes_sent_total', "Bytes sent by message type", ('type',))
+        self.transactions = r.counter('deso_transactions_received_total',
+                                      "Transactions received, by whether they were new or duplicates", ('result',))
+        self.announced = r.counter('deso_inv_ids_received_total',
+                                   "IDs received in inv messages, by whether they were new or duplicates", ('result',))
+        self.fanout_seconds = r.histogram('deso_broadcast_fanout_seconds',
+                                          "Time from accepting a transaction to its inv draining to every peer")
+        self.send_seconds = r.histogram('deso_send_seconds', "Time to write and drain one batch to a peer")
+        self.verify_seconds = r.histogram('deso_verify_seconds', "Signature verification latency per transaction")
+        self.scrapes = 0
+
+    def received(self, message_type: str, size: int):
+        self.messages_in.inc(1, message_type)
+        self.bytes_in.inc(size, message_type)
+
+    def sent(self, message_type: str, size: int):
+        self.messages_out.inc(1, message_type)
+        self.bytes_out.inc(size, message_type)
+
+    def bind(self, node):
+        """Register gauges read from ``node`` at scrape time"""
+        r = self.registry
+        r.gauge('deso_peers', "Connected peers", lambda: len(node.peers))
+        r.gauge('deso_known_transactions', "Transactions in the seen cache", lambda: len(node.known_transactions))
+        r.gauge('deso_verifying_transactions', "Transactions awaiting signature verification",
+                lambda: len(node.verifying))
+        r.gauge('deso_send_queue_depth', "Messages waiting in all peer send queues",
+                lambda: sum(node.connections.queue_depths().values()))
+        r.gauge('deso_send_queue_max_depth', "Longest peer send queue",
+                lambda: max(node.connections.queue_depths().values(), default=0))
+        r.gauge('deso_send_dropped', "Messages dropped from full send queues",
+                lambda: sum(conn.dropped for conn in node.connections.connections.values()))
+
+
+class MetricsServer:
+    """Minimal HTTP server for ``GET /metrics`` on the node's own event loop"""
+
+    def __init__(self, metrics: NodeMetrics, host: str = '127.0.0.1', port: int = 9100,
+                 timeout: float = 5.0):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.server = None
+        self.logger = logging.getLogger(__name__)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.logger.info("Serving metrics on http://%s:%s/metrics", self.host, self.port)
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), self.timeout)
+            while (await asyncio.wait_for(reader.readline(), self.timeout)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body, content_type = '200 OK', self.metrics.registry.render().encode(), CONTENT_TYPE
+                self.metrics.scrapes += 1
+            else:
+                status, body, content_type = '404 Not Found', b'Not found\n', 'text/plain'
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, OSError, ValueError) as e:
+            self.logger.debug("Metrics request failed: %s", e)
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
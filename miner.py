@@ -0,0 +1,135 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional, Tuple
+from chain import NONCE, Block, BlockError, Chain
+
+MAX_NONCE = (1 << 64) - 1
+
+# Shared with worker processes through the pool initializer; bumping it
+# abandons every in-flight search for the previous job
+_current_job = None
+
+
+def _init_worker(current_job):
+    global _current_job
+    _current_job = current_job
+
+
+def search_nonces(prefix: bytes, bits: int, start: int, count: int, job: int,
+                  check_interval: int = 4096) -> Tuple[Optional[int], int]:
+    """Scan ``count`` nonces from ``start``; returns (nonce or None, hashes tried)"""
+    state = hashlib.sha256(prefix)
+    target = (1 << (256 - bits)).to_bytes(33, 'big')[1:] if bits else b'\xff' * 33
+    pack = NONCE.pack
+    stop = min(start + count, MAX_NONCE + 1)
+    tried = 0
+    for chunk_start in range(start, stop, check_interval):
+        if _current_job is not None and _current_job.value != job:
+            break
+        chunk_stop = min(chunk_start + check_interval, stop)
+        for nonce in range(chunk_start, chunk_stop):
+            digest = state.copy()
+            digest.update(pack(nonce))
+            if digest.digest() < target:
+                return nonce, tried + nonce - chunk_start + 1
+        tried += chunk_stop - chunk_start
+    return None, tried
+
+
+class Miner:
+    """Proof-of-work search spread over a process pool.
+
+    The header is hashed up to the nonce once; workers copy that SHA-256 state
+    and only feed it the 8 nonce bytes. The nonce space is handed out in
+    ``chunk``-sized ranges, keeping two per worker in flight. The first
+    solution, or ``cancel`` when a new tip arrives, bumps a shared job counter
+    that every worker polls, so all of them stop within ``check_interval``
+    hashes.
+    """
+
+    def __init__(self, workers: Optional[int] = None, chunk: int = 1 << 18, check_interval: int = 4096):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk = chunk
+        self.check_interval = check_interval
+        self.current_job = multiprocessing.Value('Q', 0, lock=False)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                            initargs=(self.current_job,))
+        self.hashes = 0
+        self.elapsed = 0.0
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def hash_rate(self) -> float:
+        return self.hashes / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def hash_rate_per_core(self) -> float:
+        return self.hash_rate / self.workers
+
+    def cancel(self):
+        """Abandon the current search, e.g. because the tip changed"""
+        self.current_job.value += 1
+
+    async def mine(self, block: Block, start_nonce: int = 0) -> Optional[Block]:
+        """Find a nonce for ``block``; returns None if cancelled or the nonce space runs out"""
+        loop = asyncio.get_running_loop()
+        self.current_job.value += 1
+        job = self.current_job.value
+        prefix = block.header_prefix()
+        next_nonce = start_nonce
+        pending = set()
+        started = time.perf_counter()
+
+        def dispatch():
+            nonlocal next_nonce
+            while len(pending) < self.workers * 2 and next_nonce <= MAX_NONCE and self.current_job.value == job:
+                pending.add(loop.run_in_executor(self.executor, search_nonces, prefix, block.bits,
+                                                 next_nonce, self.chunk, job, self.check_interval))
+                next_nonce += self.chunk
+
+        found = None
+        try:
+            dispatch()
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    nonce, tried = future.result()
+                    self.hashes += tried
+                    if nonce is not None and found is None:
+                        found = nonce
+                        self.cancel()
+                if found is None:
+                    dispatch()
+        finally:
+            if self.current_job.value == job:
+                self.cancel()
+            self.elapsed += time.perf_counter() - started
+
+        if found is None:
+            return None
+        block.set_nonce(found)
+        return block
+
+    async def run(self, chain: Chain, on_block: Callable[[Block], None] = None):
+        """Mine on the chain's tip forever; call ``cancel`` when another block arrives"""
+        while True:
+            block = await self.mine(chain.assemble())
+            if block is None or block.previous_hash != chain.tip.hash:
+                continue
+            try:
+                chain.add_block(block)
+            except BlockError as e:
+                self.logger.error("Mined an invalid block: %s", e)
+                continue
+            self.logger.info("Mined block %d: %s", block.height, block.calculate_hash())
+            if on_block:
+                on_block(block)
+
+    def close(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,59 +1,166 @@
 
 import asyncio
-import json
 import socket
 import logging
-from typing import Set
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 import random
+from codec import get_codec
+from dht import Contact, RoutingTable, distance, node_key
+from discovery import MulticastDiscovery
+from storage import Storage
+from transport import TcpTransport
+
+class SubnetScanner:
+    """Concurrent TCP probe of many (host, port) pairs.
+
+    Probes run on a fixed pool of workers with a per-probe connect timeout.
+    Hosts where no port answered are skipped until ``dead_ttl`` passes, and
+    endpoints that answered on an earlier sweep are probed first.
+    """
+
+    def __init__(self, concurrency: int = 256, timeout: float = 0.5, dead_ttl: float = 900.0,
+                 transport=None):
+        self.transport = transport or TcpTransport()
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.dead_ttl = dead_ttl
+        self.dead_hosts: Dict[str, float] = {}
+        self.last_alive: Set[tuple] = set()
+
+    async def probe(self, host: str, port: int) -> bool:
+        """Check whether anything accepts TCP connections on host:port"""
+        try:
+            _, writer = await asyncio.wait_for(self.transport.open_connection(host, port), self.timeout)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+        return True
+
+    def order_targets(self, hosts: Iterable[str], ports: Iterable[int]) -> List[tuple]:
+        """Targets to probe: previous responders first, recently dead hosts skipped"""
+        now = time.monotonic()
+        ports = list(ports)
+        targets = [
+            (host, port) for host in hosts
+            if self.dead_hosts.get(host, 0) <= now
+            for port in ports
+        ]
+        targets.sort(key=lambda target: target not in self.last_alive)
+        return targets
+
+    async def scan(self, hosts: Iterable[str], ports: Iterable[int]) -> Set[tuple]:
+        """Probe every host on every port and return the endpoints that answered"""
+        pending = deque(self.order_targets(hosts, ports))
+        probed_hosts = {host for host, _ in pending}
+        alive: Set[tuple] = set()
+
+        async def worker():
+            while pending:
+                host, port = pending.popleft()
+                if await self.probe(host, port):
+                    alive.add((host, port))
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(pending)))))
+
+        now = time.monotonic()
+        alive_hosts = {host for host, _ in alive}
+        for host in probed_hosts - alive_hosts:
+            self.dead_hosts[host] = now + self.dead_ttl
+        for host in alive_hosts:
+            self.dead_hosts.pop(host, None)
+        self.last_alive = alive
+        return alive
 
 class NetworkManager:
-    def __init__(self):
+    def __init__(self, codec: str = 'json', scan_concurrency: int = 256, scan_timeout: float = 0.5,
+                 routing: Optional[RoutingTable] = None, address: Optional[tuple] = None,
+                 alpha: int = 3, bucket_refresh: float = 900.0, request_timeout: float = 5.0,
+                 storage: Optional[Storage] = None, transport=None):
         self.known_nodes: Set[tuple] = set()
+        self.codec = get_codec(codec)
         self.logger = logging.getLogger(__name__)
         self.port_range = (17000, 17010)  # Range of ports to scan
+        # TCP by default; tests and simulations can pass a MemoryTransport
+        self.transport = transport or TcpTransport()
+        self.scanner = SubnetScanner(concurrency=scan_concurrency, timeout=scan_timeout,
+                                     transport=self.transport)
+        self.multicast = None
+
+        # Kademlia overlay: when a routing table is given, peer discovery uses
+        # iterative find_node lookups instead of swapping full peer lists.
+        # ``address`` is the (host, port) advertised to the nodes we query.
+        self.routing = routing
+        self.address = address
+        self.alpha = alpha
+        self.bucket_refresh = bucket_refresh
+        self.request_timeout = request_timeout
+
+        # Peers from the last run seed discovery so a restart skips rediscovery
+        self.storage = storage
+        if storage is not None:
+            for host, port, node_id in storage.load_peers():
+                self.known_nodes.add((host, port))
+                if routing is not None and node_id:
+                    routing.update(Contact(node_id, host, port))
 
     async def start_discovery(self):
         """Start pure P2P node discovery"""
         while True:
             try:
-                # Local network discovery
-                await self.discover_local_nodes()
+                # Local network discovery; multicast announcements replace
+                # the subnet scan when enabled
+                if self.multicast is None:
+                    await self.discover_local_nodes()
                 # Ask known peers for their peers
-                await self.exchange_peer_lists()
+                if self.routing is not None:
+                    await self.refresh_routing()
+                else:
+                    await self.exchange_peer_lists()
+                self.save_peers()
                 await asyncio.sleep(300)  # Every 5 minutes
             except Exception as e:
-                self.logger.error(f"Discovery error: {str(e)}")
+                self.logger.error("Discovery error: %s", e)
 
     async def discover_local_nodes(self):
         """Discover nodes on local network"""
         local_ip = self.get_local_ip()
         network_prefix = '.'.join(local_ip.split('.')[:-1])
-        
-        for i in range(1, 255):
-            target_ip = f"{network_prefix}.{i}"
-            for port in range(self.port_range[0], self.port_range[1]):
-                try:
-                    reader, writer = await asyncio.open_connection(target_ip, port)
-                    self.known_nodes.add((target_ip, port))
-                    writer.close()
-                    await writer.wait_closed()
-                except:
-                    continue
+
+        hosts = [f"{network_prefix}.{i}" for i in range(1, 255)]
+        start = time.monotonic()
+        found = await self.scanner.scan(hosts, range(self.port_range[0], self.port_range[1]))
+        self.known_nodes |= found
+        self.logger.info("Local scan found %d nodes in %.1fs", len(found), time.monotonic() - start)
+        return found
+
+    async def start_multicast_discovery(self, node_id: str, host: str, port: int, **options):
+        """Announce this node on the LAN multicast group and learn others from their announcements"""
+        self.multicast = MulticastDiscovery(
+            node_id, host, port,
+            on_peer=lambda peer, peer_id: self.known_nodes.add(peer),
+            **options
+        )
+        await self.multicast.start()
 
     async def exchange_peer_lists(self):
         """Exchange peer lists with known peers"""
         for peer in self.known_nodes.copy():
             try:
-                reader, writer = await asyncio.open_connection(peer[0], peer[1])
+                reader, writer = await self.transport.open_connection(peer[0], peer[1])
                 message = {
                     'type': 'get_peers'
                 }
-                writer.write(json.dumps(message).encode() + b'\n')
+                writer.write(self.codec.encode(message))
                 await writer.drain()
 
-                data = await reader.readline()
-                if data:
-                    response = json.loads(data.decode())
+                response = await self.codec.read(reader)
+                if response:
                     if response['type'] == 'peers':
                         for peer_info in response['peers']:
                             self.known_nodes.add((peer_info['host'], peer_info['port']))
@@ -61,7 +168,109 @@ class NetworkManager:
                 writer.close()
                 await writer.wait_closed()
             except Exception:
-                self.known_nodes.remove(peer)
+                self.forget_node(peer)
+
+    async def query_find_node(self, host: str, port: int,
+                              target: int) -> Optional[Tuple[Contact, List[Contact]]]:
+        """Ask one node for the contacts it knows closest to ``target``"""
+        message = {'type': 'find_node', 'target': format(target, 'x'), 'node_id': self.routing.node_id}
+        if self.address is not None:
+            message['host'], message['port'] = self.address
+        try:
+            reader, writer = await asyncio.wait_for(
+                self.transport.open_connection(host, port), self.request_timeout
+            )
+            try:
+                writer.write(self.codec.encode(message))
+                await writer.drain()
+                response = await asyncio.wait_for(self.codec.read(reader), self.request_timeout)
+            finally:
+                writer.close()
+            if not response or response.get('type') != 'nodes':
+                return None
+            responder = Contact(response['node_id'], host, port)
+            contacts = [Contact(n['node_id'], n['host'], n['port']) for n in response['nodes']]
+            return responder, contacts
+        except (OSError, asyncio.TimeoutError, ValueError, KeyError, TypeError):
+            return None
+
+    async def lookup(self, target: int) -> List[Contact]:
+        """Iterative Kademlia lookup for the ``k`` nodes closest to ``target``.
+
+        Each round queries the ``alpha`` closest contacts not yet asked and
+        merges their answers; the lookup ends once the ``k`` closest contacts
+        seen have all responded, which takes O(log N) rounds.
+        """
+        k = self.routing.k
+        shortlist: Dict[str, Contact] = {c.node_id: c for c in self.routing.closest(target, k)}
+        queried: Set[str] = set()
+        failed: Set[str] = set()
+
+        def by_distance(contact: Contact) -> int:
+            return distance(node_key(contact.node_id), target)
+
+        while True:
+            ranked = sorted((c for c in shortlist.values() if c.node_id not in failed), key=by_distance)
+            candidates = [c for c in ranked[:k] if c.node_id not in queried][:self.alpha]
+            if not candidates:
+                return ranked[:k]
+
+            results = await asyncio.gather(*(self.query_find_node(c.host, c.port, target) for c in candidates))
+            for contact, result in zip(candidates, results):
+                queried.add(contact.node_id)
+                if result is None:
+                    failed.add(contact.node_id)
+                    self.routing.remove(contact.node_id)
+                    continue
+                self.add_contact(contact)
+                for found in result[1]:
+                    if found.node_id != self.routing.node_id:
+                        shortlist.setdefault(found.node_id, found)
+
+    def add_contact(self, contact: Contact):
+        """Record a live contact in the routing table and the flat node set"""
+        self.routing.update(contact)
+        self.known_nodes.add((contact.host, contact.port))
+        if self.storage is not None:
+            self.storage.save_peer(contact.host, contact.port, contact.node_id)
+
+    def forget_node(self, node: tuple):
+        """Drop a dead node from the known set and storage"""
+        self.known_nodes.discard(node)
+        if self.storage is not None:
+            self.storage.remove_peer(*node)
+
+    def save_peers(self):
+        """Persist the known node set"""
+        if self.storage is not None:
+            for host, port in self.known_nodes:
+                self.storage.save_peer(host, port)
+
+    async def bootstrap(self, seeds: Iterable[tuple]) -> int:
+        """Join the overlay through seed (host, port) pairs, then look up our own ID"""
+        results = await asyncio.gather(*(
+            self.query_find_node(host, port, self.routing.key) for host, port in seeds
+        ))
+        for result in results:
+            if result is not None:
+                responder, contacts = result
+                self.add_contact(responder)
+                for contact in contacts:
+                    self.routing.update(contact)
+        await self.lookup(self.routing.key)
+        return len(self.routing)
+
+    async def refresh_routing(self):
+        """Liveness-check full buckets and look up random IDs in stale ones"""
+        for bucket in list(self.routing.buckets.values()):
+            oldest = bucket.oldest()
+            if bucket.replacements and oldest is not None:
+                if await self.ping_node(oldest.host, oldest.port):
+                    bucket.update(oldest)
+                else:
+                    bucket.remove(oldest.node_id)
+        for index in self.routing.stale_buckets(self.bucket_refresh):
+            await self.lookup(self.routing.random_key_in_bucket(index))
 
     def get_local_ip(self):
         """Get local IP address"""
@@ -82,19 +291,20 @@ class NetworkManager:
             for node in self.known_nodes:
                 if not await self.ping_node(node[0], node[1]):
                     dead_nodes.add(node)
-            self.known_nodes -= dead_nodes
+            for node in dead_nodes:
+                self.forget_node(node)
             await asyncio.sleep(60)
 
     async def ping_node(self, host: str, port: int) -> bool:
         """Ping a node to check if it's alive"""
         try:
-            reader, writer = await asyncio.open_connection(host, port)
+            reader, writer = await self.transport.open_connection(host, port)
             message = {'type': 'ping'}
-            writer.write(json.dumps(message).encode() + b'\n')
+            writer.write(self.codec.encode(message))
             await writer.drain()
-            data = await reader.readline()
+            response = await self.codec.read(reader)
             writer.close()
             await writer.wait_closed()
-            return data and json.loads(data.decode()).get('type') == 'pong'
+            return bool(response) and response.get('type') == 'pong'
         except:
             return False
@@ -1,89 +1,243 @@
 import asyncio
-import json
+import base64
 import logging
-from typing import Set, Dict
+import random
+import struct
+import time
+from typing import Set, Dict, List, Optional
+from codec import CodecError, read_first
+from connection import ConnectionManager, DROP_OLDEST
+from dht import Contact, RoutingTable
+from metrics import MetricsServer, NodeMetrics
+from reconcile import DEFAULT_DIFFERENCE_RATE, IBLT, MAX_CELLS, cells_for, new_salt, sketch_ids, sketch_pays
+from seen_cache import BloomFilter, SeenCache
+from storage import Storage
+from transaction import Transaction
+from transport import TcpTransport
 from utils import generate_node_id
+from verification import VerificationPipeline
 
 class Node:
-    def __init__(self, host: str = '0.0.0.0', port: int = 8000):
+    def __init__(self, host: str = '0.0.0.0', port: int = 8000,
+                 max_queue: int = 1000, send_deadline: float = 2.0,
+                 drop_policy: str = DROP_OLDEST, inv_interval: float = 0.1,
+                 max_inv: int = 500, getdata_timeout: float = 5.0,
+                 seen_cache_size: int = 100000, seen_ttl: float = 3600.0,
+                 codec: str = 'json', verify: bool = True,
+                 verifier: Optional[VerificationPipeline] = None,
+                 storage: Optional[Storage] = None, sync_batch: int = 500,
+                 sync_window: int = 4, sync_timeout: float = 30.0,
+                 reconcile_interval: Optional[float] = None, flood_peers: Optional[int] = None,
+                 metrics_port: Optional[int] = None, metrics_host: str = '127.0.0.1',
+                 metrics: Optional[NodeMetrics] = None, transport=None):
         self.host = host
         self.port = port
+        # TCP by default; a MemoryTransport runs the node on a simulated network
+        self.transport = transport or TcpTransport()
         self.node_id = generate_node_id()
         self.peers: Set[tuple] = set()
-        self.known_transactions: Dict[str, dict] = {}
+        self.known_transactions = SeenCache(max_size=seen_cache_size, ttl=seen_ttl)
         self.server = None
+        self.routing = RoutingTable(self.node_id)
 
-        # Setup logging with more detailed format
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        # Warm start: transactions still inside the seen TTL and the peers
+        # from the last run come back from storage
+        self.storage = storage
+        self.saved_peers: List[tuple] = []
+        if storage is not None:
+            for tx in storage.load_transactions(max_age=seen_ttl):
+                self.known_transactions[tx.calculate_hash()] = tx.to_dict()
+            self.saved_peers = [(host, port) for host, port, _ in storage.load_peers()]
+
+        # Inventory gossip: IDs waiting to be announced per peer, and IDs we
+        # have asked for with getdata but not yet received. Other peers that
+        # announce a requested ID are remembered in order, and asked in turn
+        # whenever a getdata goes ``getdata_timeout`` without an answer.
+        self.inv_interval = inv_interval
+        self.max_inv = max_inv
+        self.getdata_timeout = getdata_timeout
+        self.pending_inv: Dict[tuple, List[str]] = {}
+        self.requested: Dict[str, float] = {}
+        self.announcers: Dict[str, List[tuple]] = {}
+        self._getdata_timer = None
+        self._inv_task = None
+        # tx ID -> [announced at, peers whose inv has not drained yet], kept
+        # only when metrics are on, to time broadcast fanout
+        self.fanout_pending: Dict[str, list] = {}
+
+        # Inbound transactions are signature-checked on a process pool before
+        # being admitted or relayed. Nodes sharing a process can share one
+        # pipeline by passing it as ``verifier``.
+        self._owns_verifier = verifier is None and verify
+        if self._owns_verifier:
+            verifier = VerificationPipeline()
+        self.verifier = verifier
+        self.verifying: Set[str] = set()
+        self.rejected = SeenCache(max_size=10000, ttl=seen_ttl, bloom=False)
+
+        # Initial sync: a new outbound peer sends a Bloom filter of what we
+        # hold and streams back the rest, ``sync_batch`` transactions per
+        # message with at most ``sync_window`` batches awaiting our ack
+        self.sync_batch = sync_batch
+        self.sync_window = sync_window
+        self.sync_timeout = sync_timeout
+        self.sync_windows: Dict[asyncio.StreamWriter, asyncio.Semaphore] = {}
+        self.syncing: Set[tuple] = set()
+        # peer -> timer giving up on a sync that sent nothing for ``sync_timeout``
+        self.sync_timers: Dict[tuple, asyncio.TimerHandle] = {}
+
+        # Reconciliation: flooding is cut to ``flood_peers`` random peers per
+        # transaction and each other peer gets the ID in its reconciliation
+        # set instead. Every ``reconcile_interval`` seconds each peer is sent
+        # an IBLT sketch of its set and replies with what either side is
+        # missing; the set then starts over, so a sketch only ever covers
+        # what changed since the last round with that peer. A round whose
+        # sketch would cost more than announcing both sets (a burst, where
+        # most IDs differ) sends no sketch, and both sides flood their sets.
+        self.reconcile_interval = reconcile_interval
+        self.flood_peers = flood_peers
+        self.reconcile_sets: Dict[tuple, Set[str]] = {}
+        # peer -> node ID from its hello or hello_ack; of each pair only the
+        # node with the lower ID starts rounds
+        self.peer_ids: Dict[tuple, str] = {}
+        # peer -> (salt, cells, short ID map, started) of our open round
+        self.reconciling: Dict[tuple, tuple] = {}
+        # peer -> its set size and the share of the smaller set that differed
+        # in the last round, from which the next sketch is sized
+        self.remote_counts: Dict[tuple, int] = {}
+        self.difference_rates: Dict[tuple, float] = {}
+        self._reconcile_task = None
+
+        # Metrics are collected only when they can be scraped or a harness
+        # passes its own; otherwise ``self.metrics`` is None and instrumented
+        # paths skip them
+        if metrics is None and metrics_port is not None:
+            metrics = NodeMetrics()
+        self.metrics = metrics
+        self.metrics_server = None
+        if metrics_port is not None:
+            self.metrics_server = MetricsServer(self.metrics, metrics_host, metrics_port)
+
+        self.connections = ConnectionManager(
+            self.handle_message,
+            handshake=self.hello_message,
+            on_lost=self.peer_lost,
+            on_sent=self.inventory_sent,
+            max_queue=max_queue,
+            send_deadline=send_deadline,
+            drop_policy=drop_policy,
+            codec=codec,
+            metrics=self.metrics,
+            transport=self.transport
         )
+        if self.metrics is not None:
+            self.metrics.bind(self)
+
+        # Handlers are the application's business (see logs.configure_logging);
+        # messages below are %-style so disabled levels never format them
         self.logger = logging.getLogger(__name__)
 
     async def start(self):
         """Start the node server"""
         try:
-            self.server = await asyncio.start_server(
-                self.handle_connection, self.host, self.port
-            )
-            self.logger.info(f"Node {self.node_id} started on {self.host}:{self.port}")
+            self.server = await self.transport.start_server(self.handle_connection, self.host, self.port)
+            self.logger.info("Node %s started on %s:%s", self.node_id, self.host, self.port)
+            if self.metrics_server is not None:
+                await self.metrics_server.start()
+            for host, port in self.saved_peers:
+                asyncio.create_task(self.connect_to_peer(host, port))
+            if self.reconcile_interval:
+                self._reconcile_task = asyncio.create_task(self.reconcile_loop())
             await self.server.serve_forever()
         except Exception as e:
-            self.logger.error(f"Failed to start node: {str(e)}")
+            self.logger.error("Failed to start node: %s", e)
             raise
 
-    async def connect_to_peer(self, host: str, port: int):
-        """Connect to a new peer"""
-        try:
-            self.logger.info(f"Attempting to connect to peer {host}:{port}")
-            reader, writer = await asyncio.open_connection(host, port)
-            self.peers.add((host, port))
+    async def stop(self):
+        """Stop serving and close every peer connection and background task"""
+        for task in (self._inv_task, self._reconcile_task):
+            if task is not None:
+                task.cancel()
+        self._inv_task = self._reconcile_task = None
+        if self._getdata_timer is not None:
+            self._getdata_timer.cancel()
+            self._getdata_timer = None
+        for peer in list(self.sync_timers):
+            self.end_sync(peer)
+        if self.server is not None:
+            self.server.close()
+        await self.connections.close()
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
+        if self._owns_verifier:
+            self.verifier.close()
+        self.logger.info("Node %s stopped", self.node_id)
 
-            # Send node info
-            message = {
-                'type': 'hello',
-                'node_id': self.node_id,
-                'host': self.host,
-                'port': self.port
-            }
-            writer.write(json.dumps(message).encode() + b'\n')
-            await writer.drain()
+    def hello_message(self) -> dict:
+        """Handshake sent first on every outbound stream"""
+        return {
+            'type': 'hello',
+            'node_id': self.node_id,
+            'host': self.host,
+            'port': self.port
+        }
 
-            self.logger.info(f"Successfully connected to peer {host}:{port}")
+    async def connect_to_peer(self, host: str, port: int):
+        """Connect to a new peer, keeping the stream open for later sends"""
+        self.logger.info("Attempting to connect to peer %s:%s", host, port)
+        if await self.connections.connect((host, port)):
+            self.peers.add((host, port))
+            if self.storage is not None:
+                self.storage.save_peer(host, port)
+            self.logger.info("Successfully connected to peer %s:%s", host, port)
             return True
-        except Exception as e:
-            self.logger.error(f"Failed to connect to peer {host}:{port}: {str(e)}")
-            if (host, port) in self.peers:
-                self.peers.remove((host, port))
-            return False
+
+        self.logger.error("Failed to connect to peer %s:%s", host, port)
+        self.peers.discard((host, port))
+        return False
 
     async def handle_connection(self, reader, writer):
         """Handle incoming connections"""
         peer_addr = writer.get_extra_info('peername')
-        self.logger.info(f"New connection from {peer_addr}")
+        self.logger.info("New connection from %s", peer_addr)
 
+        peer = None
+        codec = None
         while True:
             try:
-                data = await reader.readline()
-                if not data:
+                if codec is None:
+                    # The first message fixes the codec for this stream
+                    codec, message = await read_first(reader)
+                    if codec is not None:
+                        self.connections.register(writer, codec)
+                else:
+                    message = await codec.read(reader)
+                if message is None:
                     break
+                if self.metrics is not None:
+                    self.metrics.received(message.get('type'), codec.last_size)
 
-                message = json.loads(data.decode())
-                self.logger.debug(f"Received message from {peer_addr}: {message['type']}")
-                await self.handle_message(message, writer)
+                self.logger.debug("Received message from %s: %s", peer_addr, message['type'])
+                if message['type'] == 'hello':
+                    peer = (message['host'], message['port'])
+                await self.handle_message(message, writer, peer)
 
-            except json.JSONDecodeError as e:
-                self.logger.error(f"Invalid JSON from {peer_addr}: {str(e)}")
+            except CodecError as e:
+                self.logger.error("Invalid message from %s: %s", peer_addr, e)
                 break
             except Exception as e:
-                self.logger.error(f"Error handling connection from {peer_addr}: {str(e)}")
+                self.logger.error("Error handling connection from %s: %s", peer_addr, e)
                 break
 
+        self.connections.detach(writer)
         writer.close()
-        await writer.wait_closed()
-        self.logger.info(f"Connection closed with {peer_addr}")
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+        self.logger.info("Connection closed with %s", peer_addr)
 
-    async def handle_message(self, message: dict, writer):
+    async def handle_message(self, message: dict, writer, peer: tuple = None):
         """Handle incoming messages"""
         try:
             if message['type'] == 'get_peers':
@@ -91,42 +245,532 @@ class Node:
                     'type': 'peers',
                     'peers': [{'host': peer[0], 'port': peer[1]} for peer in self.peers]
                 }
-                writer.write(json.dumps(response).encode() + b'\n')
+                writer.write(self.connections.encode(writer, response))
                 await writer.drain()
             elif message['type'] == 'hello':
-                self.peers.add((message['host'], message['port']))
-                self.logger.info(f"Added new peer: {message['host']}:{message['port']}")
+                peer = (message['host'], message['port'])
+                self.peers.add(peer)
+                self.connections.attach(peer, None, writer)
+                self.routing.update(Contact(message['node_id'], *peer))
+                self.peer_ids[peer] = message['node_id']
+                if self.storage is not None:
+                    self.storage.save_peer(*peer, message['node_id'])
+                self.logger.info("Added new peer: %s:%s", message['host'], message['port'])
                 response = {
                     'type': 'hello_ack',
                     'node_id': self.node_id
                 }
-                writer.write(json.dumps(response).encode() + b'\n')
+                writer.write(self.connections.encode(writer, response))
+                await writer.drain()
+
+            elif message['type'] == 'hello_ack':
+                if peer is not None:
+                    self.routing.update(Contact(message['node_id'], *peer))
+                    self.peer_ids[peer] = message['node_id']
+                    self.expect_sync(peer)
+                writer.write(self.connections.encode(writer, self.sync_message()))
+                await writer.drain()
+
+            elif message['type'] == 'sync':
+                if writer not in self.sync_windows:
+                    asyncio.create_task(self.stream_sync(message, writer))
+
+            elif message['type'] == 'sync_batch':
+                asyncio.create_task(self.receive_sync_batch(message, writer, peer))
+
+            elif message['type'] == 'sync_ack':
+                window = self.sync_windows.get(writer)
+                if window is not None:
+                    window.release()
+
+            elif message['type'] == 'reconcile':
+                if peer is not None:
+                    for reply in self.answer_reconcile(message, peer):
+                        writer.write(self.connections.encode(writer, reply))
+                    await writer.drain()
+
+            elif message['type'] == 'reconcile_want':
+                if peer is not None:
+                    # Announced rather than sent, so the peer fetches only what
+                    # it has not picked up elsewhere since answering
+                    ids = self.reconciled_ids(peer, message)
+                    data = b''.join(
+                        self.connections.encode(writer, {'type': 'inv', 'ids': ids[i:i + self.max_inv]})
+                        for i in range(0, len(ids), self.max_inv)
+                    )
+                    if data:
+                        writer.write(data)
+                        await writer.drain()
+
+            elif message['type'] == 'reconcile_fail':
+                if peer is not None:
+                    self.retry_reconcile(peer, message)
+
+            elif message['type'] == 'ping':
+                writer.write(self.connections.encode(writer, {'type': 'pong', 'node_id': self.node_id}))
+                await writer.drain()
+
+            elif message['type'] == 'find_node':
+                if 'host' in message:
+                    self.routing.update(Contact(message['node_id'], message['host'], message['port']))
+                closest = self.routing.closest(int(message['target'], 16))
+                response = {
+                    'type': 'nodes',
+                    'node_id': self.node_id,
+                    'nodes': [contact._asdict() for contact in closest]
+                }
+                writer.write(self.connections.encode(writer, response))
                 await writer.drain()
 
+            elif message['type'] == 'inv':
+                if peer in self.reconcile_sets:
+                    # The peer has these already; reconciling them again would only resend them
+                    self.reconcile_sets[peer].difference_update(message['ids'])
+                now = time.monotonic()
+                wanted = []
+                for tx_id in message['ids']:
+                    if (self.known_transactions.seen(tx_id) or tx_id in self.verifying
+                            or tx_id in self.rejected):
+                        continue
+                    if now - self.requested.get(tx_id, 0) > self.getdata_timeout:
+                        wanted.append(tx_id)
+                    elif peer is not None:
+                        # Already asked elsewhere; this peer is next if that goes unanswered
+                        others = self.announcers.setdefault(tx_id, [])
+                        if peer not in others:
+                            others.append(peer)
+                if self.metrics is not None:
+                    self.metrics.announced.inc(len(wanted), 'new')
+                    self.metrics.announced.inc(len(message['ids']) - len(wanted), 'duplicate')
+                if wanted:
+                    for tx_id in wanted:
+                        self.requested[tx_id] = now
+                    if self._getdata_timer is None:
+                        self._getdata_timer = asyncio.get_running_loop().call_later(
+                            self.getdata_timeout, self.retry_getdata)
+                    request = {'type': 'getdata', 'ids': wanted}
+                    writer.write(self.connections.encode(writer, request))
+                    await writer.drain()
+
+            elif message['type'] == 'getdata':
+                data = b''.join(
+                    self.connections.encode(writer, {
+                        'type': 'transaction',
+                        'transaction': self.known_transactions[tx_id]
+                    })
+                    for tx_id in message['ids'] if tx_id in self.known_transactions
+                )
+                if data:
+                    writer.write(data)
+                    await writer.drain()
+
             elif message['type'] == 'transaction':
-                tx_id = message['transaction']['id']
-                if tx_id not in self.known_transactions:
-                    self.known_transactions[tx_id] = message['transaction']
-                    self.logger.info(f"Received new transaction: {tx_id}")
-                    await self.broadcast_transaction(message['transaction'])
+                transaction = message['transaction']
+                tx_id = transaction['id']
+                self.requested.pop(tx_id, None)
+                self.announcers.pop(tx_id, None)
+                if (tx_id not in self.verifying and tx_id not in self.rejected
+                        and not self.known_transactions.seen(tx_id)):
+                    if self.metrics is not None:
+                        self.metrics.transactions.inc(1, 'new')
+                    if self.verifier is None:
+                        self.accept_transaction(transaction, peer)
+                    else:
+                        self.verifying.add(tx_id)
+                        asyncio.create_task(self.verify_transaction(transaction, peer))
+                elif self.metrics is not None:
+                    self.metrics.transactions.inc(1, 'duplicate')
         except Exception as e:
-            self.logger.error(f"Error handling message: {str(e)}")
+            self.logger.error("Error handling message: %s", e)
 
-    async def broadcast_transaction(self, transaction: dict):
-        """Broadcast transaction to all peers"""
-        message = {
-            'type': 'transaction',
-            'transaction': transaction
+    async def reconcile_loop(self):
+        """Send each peer we reconcile with a sketch of its set once per interval"""
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            for peer in [peer for peer in self.reconcile_sets if peer not in self.peers]:
+                del self.reconcile_sets[peer]
+                self.remote_counts.pop(peer, None)
+                self.difference_rates.pop(peer, None)
+                self.peer_ids.pop(peer, None)
+            salt = new_salt()
+            now = time.monotonic()
+            for peer in list(self.peers):
+                # Only the lower node ID of a pair starts rounds; if both did,
+                # each would empty its set before the other's sketch arrived
+                # and every ID would look like a difference. IDs come from the
+                # handshake, so both sides agree whatever addresses they see.
+                peer_id = self.peer_ids.get(peer)
+                if peer in self.syncing or peer_id is None or peer_id < self.node_id:
+                    continue
+                pending = self.reconciling.get(peer)
+                if pending is not None:
+                    if now - pending[3] < self.reconcile_interval * 10:
+                        continue
+                    # The peer never answered; its IDs go into the next round
+                    self.reconcile_sets.setdefault(peer, set()).update(pending[2].values())
+                # Sent even when empty: the peer's own set is only reconciled on our rounds
+                ids = self.reconcile_sets.pop(peer, set())
+                difference = self.estimate_difference(peer, len(ids))
+                if not sketch_pays(difference, len(ids) + self.remote_counts.get(peer, 0)):
+                    self.flush_reconcile(peer, salt, ids, now)
+                    continue
+                cells = cells_for(difference)
+                sketch, mapping = sketch_ids(ids, salt, cells)
+                self.reconciling[peer] = (salt, cells, mapping, now)
+                self.connections.send(peer, self.reconcile_message(salt, sketch, len(mapping)))
+
+    def flush_reconcile(self, peer: tuple, salt: bytes, ids: Set[str], started: float):
+        """Announce our set for a peer outright and send an empty sketch asking it to do the same"""
+        ids = list(ids)
+        for i in range(0, len(ids), self.max_inv):
+            self.connections.send(peer, {'type': 'inv', 'ids': ids[i:i + self.max_inv]})
+        # Halve the estimate, so a later round sketches again and measures afresh
+        rate = self.difference_rates.get(peer, DEFAULT_DIFFERENCE_RATE)
+        self.difference_rates[peer] = rate / 2
+        self.reconciling[peer] = (salt, 0, {}, started)
+        self.connections.send(peer, {'type': 'reconcile', 'salt': salt.hex(), 'sketch': '', 'count': len(ids)})
+
+    def reconcile_message(self, salt: bytes, sketch: IBLT, count: int) -> dict:
+        return {
+            'type': 'reconcile',
+            'salt': salt.hex(),
+            'sketch': base64.b64encode(sketch.to_bytes()).decode(),
+            'count': count
         }
 
-        for peer in self.peers.copy():  # Use copy to avoid modification during iteration
+    def answer_reconcile(self, message: dict, peer: tuple) -> List[dict]:
+        """Decode the difference between a peer's sketch and our set for that peer.
+
+        IDs only we hold are announced with a normal inv; the short IDs only
+        the peer holds are asked for with ``reconcile_want``. Our set for the
+        peer is consumed either way, unless the sketch fails to decode and
+        the peer has to retry with a bigger one. An empty sketch asks for
+        our whole set.
+        """
+        if not message['sketch']:
+            ids = list(self.reconcile_sets.pop(peer, set()))
+            replies = [{'type': 'inv', 'ids': ids[i:i + self.max_inv]} for i in range(0, len(ids), self.max_inv)]
+            replies.append({'type': 'reconcile_want', 'salt': message['salt'], 'ids': '',
+                            'count': len(ids), 'difference': 0})
+            return replies
+        salt = bytes.fromhex(message['salt'])
+        theirs = IBLT.from_bytes(base64.b64decode(message['sketch']))
+        if theirs.cells > MAX_CELLS:
+            raise ValueError(f"Sketch of {theirs.cells} cells exceeds limit")
+        ids = self.reconcile_sets.pop(peer, set())
+        ours, mapping = sketch_ids(ids, salt, theirs.cells)
+        complete, ours_only, theirs_only = ours.subtract(theirs).decode()
+        if not complete:
+            if ids:
+                self.reconcile_sets.setdefault(peer, set()).update(ids)
+            return [{'type': 'reconcile_fail', 'salt': message['salt'], 'cells': theirs.cells,
+                     'count': len(mapping)}]
+
+        replies = []
+        ids = [mapping[short] for short in ours_only if short in mapping]
+        for i in range(0, len(ids), self.max_inv):
+            replies.append({'type': 'inv', 'ids': ids[i:i + self.max_inv]})
+        wanted = struct.pack(f'<{len(theirs_only)}Q', *theirs_only)
+        replies.append({
+            'type': 'reconcile_want',
+            'salt': message['salt'],
+            'ids': base64.b64encode(wanted).decode(),
+            'count': len(mapping),
+            'difference': len(ours_only) + len(theirs_only)
+        })
+        return replies
+
+    def estimate_difference(self, peer: tuple, count: int) -> float:
+        """Expected symmetric difference between a set of ``count`` IDs and the peer's.
+
+        As in Erlay: at least the gap between the sizes, plus the share of
+        the smaller set that differed last round (DEFAULT_DIFFERENCE_RATE
+        until a round has completed).
+        """
+        remote = self.remote_counts.get(peer, 0)
+        rate = self.difference_rates.get(peer, DEFAULT_DIFFERENCE_RATE)
+        return abs(count - remote) + rate * min(count, remote)
+
+    def reconciled_ids(self, peer: tuple, message: dict) -> List[str]:
+        """Close our round with a peer and return the IDs it asked for"""
+        pending = self.reconciling.get(peer)
+        if pending is None or pending[0].hex() != message['salt']:
+            return []
+        del self.reconciling[peer]
+        mapping = pending[2]
+        self.remote_counts[peer] = message['count']
+        smaller = min(len(mapping), message['count'])
+        # A flushed round (no cells) measures nothing
+        if smaller and pending[1]:
+            self.difference_rates[peer] = (message['difference'] - abs(len(mapping) - message['count'])) / smaller
+        packed = base64.b64decode(message['ids'])
+        wanted = struct.unpack(f'<{len(packed) // 8}Q', packed)
+        return [mapping[short] for short in wanted if short in mapping]
+
+    def retry_reconcile(self, peer: tuple, message: dict):
+        """Resend a sketch that failed to decode, bigger, falling back to a Bloom sync past ``MAX_CELLS``"""
+        pending = self.reconciling.get(peer)
+        if pending is None or pending[0].hex() != message['salt'] or pending[1] != message['cells']:
+            return
+        salt, cells, mapping, started = pending
+        self.remote_counts[peer] = message['count']
+        if cells < MAX_CELLS:
+            self.difference_rates.pop(peer, None)
+            cells = min(MAX_CELLS, max(cells * 2, cells_for(self.estimate_difference(peer, len(mapping)))))
+            sketch, _ = sketch_ids(mapping.values(), salt, cells)
+            self.reconciling[peer] = (salt, cells, mapping, started)
+            self.connections.send(peer, self.reconcile_message(salt, sketch, len(mapping)))
+        else:
+            self.logger.info("Reconciliation with %s failed; falling back to a full sync", peer)
+            del self.reconciling[peer]
+            self.expect_sync(peer)
+            self.connections.send(peer, self.sync_message())
+
+    def sync_message(self) -> dict:
+        """Summary of the transactions we hold, sent to a peer we just joined"""
+        message = {'type': 'sync', 'count': len(self.known_transactions)}
+        if message['count']:
+            bloom = BloomFilter(message['count'])
+            for tx_id in self.known_transactions.keys():
+                bloom.add(tx_id)
+            message['bloom'] = base64.b64encode(bloom.to_bytes()).decode()
+            message['hashes'] = bloom.num_hashes
+        return message
+
+    async def stream_sync(self, request: dict, writer):
+        """Send a syncing peer every transaction its Bloom filter says it lacks"""
+        have = None
+        if request.get('bloom'):
             try:
-                self.logger.debug(f"Broadcasting transaction to peer {peer}")
-                reader, writer = await asyncio.open_connection(peer[0], peer[1])
-                writer.write(json.dumps(message).encode() + b'\n')
+                have = BloomFilter.from_bytes(base64.b64decode(request['bloom']), request.get('hashes'))
+            except ValueError as e:
+                self.logger.warning("Ignoring sync request with a bad Bloom filter: %s", e)
+                return
+        missing = [tx_id for tx_id in list(self.known_transactions.keys()) if have is None or tx_id not in have]
+
+        window = self.sync_windows[writer] = asyncio.Semaphore(self.sync_window)
+        sent = 0
+        try:
+            for seq, start in enumerate(range(0, len(missing), self.sync_batch)):
+                await asyncio.wait_for(window.acquire(), self.sync_timeout)
+                transactions = [
+                    self.known_transactions[tx_id] for tx_id in missing[start:start + self.sync_batch]
+                    if tx_id in self.known_transactions
+                ]
+                batch = {
+                    'type': 'sync_batch',
+                    'seq': seq,
+                    'transactions': transactions,
+                    'more': start + self.sync_batch < len(missing)
+                }
+                writer.write(self.connections.encode(writer, batch))
                 await writer.drain()
-                writer.close()
-                await writer.wait_closed()
-            except Exception as e:
-                self.logger.error(f"Failed to broadcast to {peer}: {str(e)}")
-                self.peers.remove(peer)  # Remove unreachable peer
\ No newline at end of file
+                sent += len(transactions)
+            if not missing:
+                writer.write(self.connections.encode(writer, {'type': 'sync_batch', 'seq': 0,
+                                                              'transactions': [], 'more': False}))
+                await writer.drain()
+            self.logger.info("Synced %d transactions to a peer holding %d", sent, request.get('count', 0))
+        except asyncio.TimeoutError:
+            self.logger.warning("Sync stalled after %d transactions; peer stopped acknowledging", sent)
+        except (ConnectionError, OSError) as e:
+            self.logger.error("Sync failed after %d transactions: %s", sent, e)
+        finally:
+            self.sync_windows.pop(writer, None)
+
+    async def receive_sync_batch(self, message: dict, writer, peer: tuple = None):
+        """Admit one sync batch, then acknowledge it so the sender may continue"""
+        # Verifying a batch can take a while; the clock restarts once it is acked
+        timer = self.sync_timers.pop(peer, None)
+        if timer is not None:
+            timer.cancel()
+        verifying = []
+        for transaction in message['transactions']:
+            tx_id = transaction['id']
+            if (tx_id in self.verifying or tx_id in self.rejected
+                    or self.known_transactions.seen(tx_id)):
+                if self.metrics is not None:
+                    self.metrics.transactions.inc(1, 'duplicate')
+                continue
+            if self.metrics is not None:
+                self.metrics.transactions.inc(1, 'new')
+            if self.verifier is None:
+                self.accept_transaction(transaction, peer)
+            else:
+                self.verifying.add(tx_id)
+                verifying.append(self.verify_transaction(transaction, peer))
+        if verifying:
+            await asyncio.gather(*verifying)
+        try:
+            writer.write(self.connections.encode(writer, {'type': 'sync_ack', 'seq': message['seq']}))
+            await writer.drain()
+        except (ConnectionError, OSError) as e:
+            self.logger.error("Could not acknowledge sync batch: %s", e)
+        if message['more'] and peer in self.syncing:
+            self.expect_sync(peer)
+        elif not message['more']:
+            self.end_sync(peer)
+            self.logger.info("Initial sync from %s complete; holding %d transactions", peer, len(self.known_transactions))
+
+    def expect_sync(self, peer: tuple):
+        """Mark a peer as syncing to us until its last batch or ``sync_timeout`` of silence"""
+        timer = self.sync_timers.pop(peer, None)
+        if timer is not None:
+            timer.cancel()
+        self.syncing.add(peer)
+        self.sync_timers[peer] = asyncio.get_running_loop().call_later(self.sync_timeout, self.sync_stalled, peer)
+
+    def end_sync(self, peer: tuple):
+        """Stop waiting for sync batches from a peer"""
+        timer = self.sync_timers.pop(peer, None)
+        if timer is not None:
+            timer.cancel()
+        self.syncing.discard(peer)
+
+    def sync_stalled(self, peer: tuple):
+        """Give up on a peer's sync so reconciliation and callers waiting on ``syncing`` go on"""
+        self.sync_timers.pop(peer, None)
+        if peer in self.syncing:
+            self.logger.warning("Initial sync from %s stalled; giving up on it", peer)
+            self.syncing.discard(peer)
+
+    def peer_lost(self, peer: tuple):
+        """Forget a peer the connection manager gave up on"""
+        self.peers.discard(peer)
+        self.peer_ids.pop(peer, None)
+        self.end_sync(peer)
+
+    async def verify_transaction(self, transaction: dict, peer: tuple = None):
+        """Check an inbound transaction's signature off the event loop, then admit it"""
+        tx_id = transaction['id']
+        started = time.perf_counter()
+        try:
+            valid = await self.verifier.submit(transaction)
+        except Exception as e:
+            # Not the transaction's fault; leave it unrejected so it can be fetched again
+            self.logger.error("Could not verify transaction %s: %s", tx_id, e)
+            return
+        finally:
+            self.verifying.discard(tx_id)
+        if self.metrics is not None:
+            self.metrics.verify_seconds.observe(time.perf_counter() - started)
+        if valid:
+            self.accept_transaction(transaction, peer)
+        else:
+            self.rejected[tx_id] = None
+            self.logger.warning("Rejected transaction with invalid signature: %s", tx_id)
+
+    def accept_transaction(self, transaction: dict, peer: tuple = None):
+        """Store a valid transaction and announce it to everyone but its source"""
+        tx_id = transaction['id']
+        # Keep only the fields the ID and signature cover, so a relay cannot
+        # pad what we store and serve on with keys of its own
+        try:
+            transaction = Transaction.from_dict(transaction).to_dict()
+        except (KeyError, TypeError, ValueError, OverflowError, struct.error) as e:
+            self.logger.warning("Dropping malformed transaction %s: %s", tx_id, e)
+            return
+        if transaction['id'] != tx_id:
+            self.logger.warning("Dropping transaction whose ID does not match its contents: %s", tx_id)
+            return
+        if not self.known_transactions.seen(tx_id):
+            self.known_transactions[tx_id] = transaction
+            self.persist_transaction(transaction)
+            self.logger.info("Received new transaction: %s", tx_id)
+            self.announce(tx_id, exclude=peer)
+
+    async def broadcast_transaction(self, transaction: dict):
+        """Accept a locally created transaction and announce it to all peers"""
+        tx_id = transaction['id']
+        if tx_id not in self.known_transactions:
+            self.known_transactions[tx_id] = transaction
+            self.persist_transaction(transaction)
+            self.announce(tx_id)
+
+    def persist_transaction(self, transaction: dict):
+        """Queue an accepted transaction for the next storage batch"""
+        if self.storage is not None:
+            try:
+                self.storage.save_transaction(Transaction.from_dict(transaction))
+            except (KeyError, TypeError, ValueError) as e:
+                self.logger.error("Could not store transaction %s: %s", transaction.get('id'), e)
+
+    def announce(self, tx_id: str, exclude: tuple = None):
+        """Queue a transaction ID for the next batched inv to every peer but ``exclude``"""
+        peers = [peer for peer in self.peers if peer != exclude]
+        if self.flood_peers is not None and len(peers) > self.flood_peers:
+            flooded = random.sample(peers, self.flood_peers)
+            if self.reconcile_interval:
+                # The rest learn of it through reconciliation
+                for peer in set(peers).difference(flooded):
+                    self.reconcile_sets.setdefault(peer, set()).add(tx_id)
+            peers = flooded
+        for peer in peers:
+            self.pending_inv.setdefault(peer, []).append(tx_id)
+        if self.metrics is not None and peers:
+            self.fanout_pending[tx_id] = [time.monotonic(), 0]
+        if self._inv_task is None and self.pending_inv:
+            self._inv_task = asyncio.create_task(self.flush_inventory())
+
+    async def flush_inventory(self):
+        """Send the IDs collected over one inv interval as batched inv messages"""
+        await asyncio.sleep(self.inv_interval)
+        self._inv_task = None
+        pending, self.pending_inv = self.pending_inv, {}
+        fanout = self.fanout_pending
+        for peer, ids in pending.items():
+            for i in range(0, len(ids), self.max_inv):
+                chunk = ids[i:i + self.max_inv]
+                if self.connections.send(peer, {'type': 'inv', 'ids': chunk}) and fanout:
+                    for tx_id in chunk:
+                        entry = fanout.get(tx_id)
+                        if entry is not None:
+                            entry[1] += 1
+
+        # Forget fanouts whose invs were all refused or dropped
+        now = time.monotonic()
+        for tx_id, (announced_at, waiting) in list(fanout.items()):
+            if not waiting or now - announced_at > self.getdata_timeout:
+                del fanout[tx_id]
+
+    def retry_getdata(self):
+        """Ask the next announcer for each transaction whose getdata went unanswered"""
+        self._getdata_timer = None
+        now = time.monotonic()
+        retries: Dict[tuple, List[str]] = {}
+        for tx_id, requested_at in list(self.requested.items()):
+            if now - requested_at <= self.getdata_timeout:
+                continue
+            others = self.announcers.get(tx_id)
+            while others and others[0] not in self.peers:
+                others.pop(0)
+            if others and not self.known_transactions.seen(tx_id) and tx_id not in self.verifying:
+                retries.setdefault(others.pop(0), []).append(tx_id)
+                self.requested[tx_id] = now
+            else:
+                del self.requested[tx_id]
+                self.announcers.pop(tx_id, None)
+        for peer, ids in retries.items():
+            self.logger.debug("Requesting %d unanswered transactions from %s", len(ids), peer)
+            for i in range(0, len(ids), self.max_inv):
+                self.connections.send(peer, {'type': 'getdata', 'ids': ids[i:i + self.max_inv]})
+        if self.requested:
+            delay = min(self.requested.values()) + self.getdata_timeout - now
+            self._getdata_timer = asyncio.get_running_loop().call_later(max(delay, 0.0), self.retry_getdata)
+
+    def inventory_sent(self, peer: tuple, batch: List[dict]):
+        """Observe fanout for each transaction whose inv has now drained to every peer"""
+        fanout = self.fanout_pending
+        if not fanout:
+            return
+        now = time.monotonic()
+        for message in batch:
+            if message.get('type') != 'inv':
+                continue
+            for tx_id in message['ids']:
+                entry = fanout.get(tx_id)
+                if entry is not None:
+                    entry[1] -= 1
+                    if entry[1] <= 0:
+                        del fanout[tx_id]
+                        self.metrics.fanout_seconds.observe(now - entry[0])
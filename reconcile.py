@@ -0,0 +1,132 @@
+import hashlib
+import math
+import os
+import struct
+from typing import Dict, List, Set, Tuple
+
+CELL = struct.Struct('<iQI')
+MIN_CELLS = 24
+MAX_CELLS = 32768
+# Share of the smaller set assumed to differ before a round has measured it
+DEFAULT_DIFFERENCE_RATE = 0.25
+# Wire bytes per base64 sketch cell and per ID in a JSON inv, to weigh a
+# round's sketch against announcing both sets outright
+SKETCH_CELL_BYTES = CELL.size * 4 / 3
+INV_ID_BYTES = 67
+
+
+def short_id(tx_id: str, salt: bytes) -> int:
+    """Salted 64-bit ID; a fresh salt per round stops crafted collisions from sticking"""
+    return int.from_bytes(hashlib.blake2b(bytes.fromhex(tx_id), digest_size=8, key=salt).digest(), 'little')
+
+
+def cells_for(difference: int, hashes: int = 3) -> int:
+    """Sketch size that decodes a symmetric difference of this size with high probability"""
+    # Small tables fail to peel more often, so the fixed headroom matters most there
+    cells = MIN_CELLS + math.ceil(difference * 2)
+    return min(MAX_CELLS, -(-cells // hashes) * hashes)
+
+
+def sketch_pays(difference: float, count: int) -> bool:
+    """Whether sketching a difference this large, then announcing it, beats announcing ``count`` IDs outright.
+
+    During bursts most of a round's IDs are still in flight to the peer and
+    differ; a sketch then costs more than the flooding it was meant to save.
+    """
+    cost = cells_for(difference) * SKETCH_CELL_BYTES + difference * INV_ID_BYTES
+    return cost < count * INV_ID_BYTES
+
+
+class IBLT:
+    """Invertible Bloom lookup table over 64-bit keys.
+
+    Each key lands in one cell of each of ``hashes`` equal subtables, adding
+    to the cell's count and XOR-ing itself and a checksum into it. Subtracting
+    two peers' tables cancels every key they share, leaving only the symmetric
+    difference, which ``decode`` peels out one pure cell at a time. Size is
+    proportional to the difference, not to the sets.
+    """
+
+    def __init__(self, cells: int, hashes: int = 3):
+        self.hashes = hashes
+        self.subtable = max(1, cells // hashes)
+        self.cells = self.subtable * hashes
+        self.counts = [0] * self.cells
+        self.key_sums = [0] * self.cells
+        self.check_sums = [0] * self.cells
+
+    def _cells(self, key: int) -> Tuple[List[int], int]:
+        digest = hashlib.blake2b(key.to_bytes(8, 'little'), digest_size=4 + 4 * self.hashes).digest()
+        values = struct.unpack(f'<{1 + self.hashes}I', digest)
+        positions = [i * self.subtable + values[i + 1] % self.subtable for i in range(self.hashes)]
+        return positions, values[0]
+
+    def _toggle(self, key: int, sign: int):
+        positions, check = self._cells(key)
+        for pos in positions:
+            self.counts[pos] += sign
+            self.key_sums[pos] ^= key
+            self.check_sums[pos] ^= check
+
+    def insert(self, key: int):
+        self._toggle(key, 1)
+
+    def subtract(self, other: 'IBLT') -> 'IBLT':
+        """Cell-wise difference; both tables must have the same shape"""
+        if (self.cells, self.hashes) != (other.cells, other.hashes):
+            raise ValueError("Cannot subtract sketches of different sizes")
+        result = IBLT(self.cells, self.hashes)
+        result.counts = [a - b for a, b in zip(self.counts, other.counts)]
+        result.key_sums = [a ^ b for a, b in zip(self.key_sums, other.key_sums)]
+        result.check_sums = [a ^ b for a, b in zip(self.check_sums, other.check_sums)]
+        return result
+
+    def decode(self) -> Tuple[bool, Set[int], Set[int]]:
+        """Peel the table; returns (complete, keys only in self, keys only in other)"""
+        ours, theirs = set(), set()
+        pending = list(range(self.cells))
+        while pending:
+            pos = pending.pop()
+            count = self.counts[pos]
+            if count not in (1, -1):
+                continue
+            key = self.key_sums[pos]
+            positions, check = self._cells(key)
+            if check != self.check_sums[pos] or key in ours or key in theirs:
+                continue
+            (ours if count == 1 else theirs).add(key)
+            if len(ours) + len(theirs) > self.cells:
+                break
+            self._toggle(key, -count)
+            pending.extend(positions)
+        complete = not any(self.counts) and not any(self.key_sums)
+        return complete, ours, theirs
+
+    def to_bytes(self) -> bytes:
+        return b''.join(CELL.pack(c, k, h) for c, k, h in zip(self.counts, self.key_sums, self.check_sums))
+
+    @classmethod
+    def from_bytes(cls, data: bytes, hashes: int = 3) -> 'IBLT':
+        if len(data) % CELL.size:
+            raise ValueError("Sketch length is not a whole number of cells")
+        sketch = cls(len(data) // CELL.size, hashes)
+        if sketch.cells * CELL.size != len(data):
+            raise ValueError("Sketch size does not match the hash count")
+        cells = list(CELL.iter_unpack(data))
+        sketch.counts = [c for c, _, _ in cells]
+        sketch.key_sums = [k for _, k, _ in cells]
+        sketch.check_sums = [h for _, _, h in cells]
+        return sketch
+
+
+def sketch_ids(ids, salt: bytes, cells: int) -> Tuple[IBLT, Dict[int, str]]:
+    """Sketch of a set of transaction IDs under ``salt``, plus the short ID to full ID map"""
+    mapping = {short_id(tx_id, salt): tx_id for tx_id in ids}
+    sketch = IBLT(cells)
+    for key in mapping:
+        sketch.insert(key)
+    return sketch, mapping
+
+
+def new_salt() -> bytes:
+    return os.urandom(8)
@@ -0,0 +1,208 @@
+import hashlib
+import math
+import struct
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+_TWO_U64 = struct.Struct('<QQ')
+
+# Most hash functions accepted in a filter from a peer; an optimal filter
+# needs about 10 at a 0.1% false positive rate
+MAX_HASHES = 32
+
+
+def bloom_positions(item: str, num_bits: int, num_hashes: int):
+    """Bit positions for an item, by double hashing one blake2b digest"""
+    h1, h2 = _TWO_U64.unpack(hashlib.blake2b(item.encode(), digest_size=16).digest())
+    h2 |= 1
+    return [(h1 + i * h2) % num_bits for i in range(num_hashes)]
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter that can be sent to a peer as bytes"""
+
+    def __init__(self, capacity: int = 100000, fp_rate: float = 0.001,
+                 num_bits: Optional[int] = None, num_hashes: Optional[int] = None):
+        capacity = max(1, capacity)
+        # Whole bytes, so the size survives a round trip through to_bytes
+        num_bits = num_bits or math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+        self.bits = bytearray(max(1, (num_bits + 7) // 8))
+        self.num_bits = len(self.bits) * 8
+        self.num_hashes = num_hashes or max(1, round(self.num_bits / capacity * math.log(2)))
+
+    @classmethod
+    def from_bytes(cls, data: bytes, num_hashes: int) -> 'BloomFilter':
+        if not data:
+            raise ValueError("Empty Bloom filter")
+        if type(num_hashes) is not int or not 1 <= num_hashes <= MAX_HASHES:
+            raise ValueError(f"Bloom filter hash count must be 1 to {MAX_HASHES}")
+        bloom = cls(num_bits=len(data) * 8, num_hashes=num_hashes)
+        bloom.bits = bytearray(data)
+        return bloom
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.bits)
+
+    def add(self, item: str):
+        for pos in bloom_positions(item, self.num_bits, self.num_hashes):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in bloom_positions(item, self.num_bits, self.num_hashes))
+
+
+class RollingBloomFilter:
+    """Bloom filter that remembers roughly the last ``capacity`` insertions.
+
+    Two generations are kept; once the current one has absorbed half the
+    capacity the older generation is discarded and a fresh one started, so
+    memory stays fixed no matter how many items pass through.
+    """
+
+    def __init__(self, capacity: int = 100000, fp_rate: float = 0.001):
+        self.generation_size = max(1, capacity // 2)
+        bits = math.ceil(-self.generation_size * math.log(fp_rate) / math.log(2) ** 2)
+        self.num_bits = max(8, bits)
+        self.num_hashes = max(1, round(self.num_bits / self.generation_size * math.log(2)))
+        self.current = bytearray((self.num_bits + 7) // 8)
+        self.previous = bytearray(len(self.current))
+        self.count = 0
+
+    def _positions(self, item: str):
+        return bloom_positions(item, self.num_bits, self.num_hashes)
+
+    def add(self, item: str):
+        """Insert an item, rolling to a new generation when the current one is full"""
+        if self.count >= self.generation_size:
+            self.previous = self.current
+            self.current = bytearray(len(self.previous))
+            self.count = 0
+        for pos in self._positions(item):
+            self.current[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        positions = self._positions(item)
+        return (all(self.current[p >> 3] & (1 << (p & 7)) for p in positions)
+                or all(self.previous[p >> 3] & (1 << (p & 7)) for p in positions))
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.current) + len(self.previous)
+
+
+class SeenCache:
+    """Size-capped, time-expiring map of recently seen IDs.
+
+    Entries are kept in insertion order, so both TTL expiry and size-cap
+    eviction pop from the oldest end in O(1). An optional rolling Bloom filter
+    prefilters ``seen()``: it may only answer "definitely not seen". A false
+    positive there would make the node skip a new transaction from every
+    peer, so anything the filter claims is confirmed against the cache.
+    """
+
+    def __init__(self, max_size: int = 100000, ttl: Optional[float] = 3600.0,
+                 bloom: bool = True, bloom_capacity: Optional[int] = None,
+                 bloom_fp_rate: float = 0.001):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: 'OrderedDict[str, Tuple[Any, float]]' = OrderedDict()
+        self.bloom = RollingBloomFilter(bloom_capacity or max_size * 4, bloom_fp_rate) if bloom else None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expired(self, inserted_at: float, now: float) -> bool:
+        return self.ttl is not None and now - inserted_at > self.ttl
+
+    def expire(self, now: Optional[float] = None):
+        """Drop entries older than the TTL"""
+        if self.ttl is None:
+            return
+        now = time.monotonic() if now is None else now
+        while self.entries:
+            key, (_, inserted_at) = next(iter(self.entries.items()))
+            if not self._expired(inserted_at, now):
+                break
+            del self.entries[key]
+            self.expirations += 1
+
+    def __setitem__(self, key: str, value: Any):
+        now = time.monotonic()
+        if key in self.entries:
+            del self.entries[key]
+        self.entries[key] = (value, now)
+        if self.bloom is not None:
+            self.bloom.add(key)
+        self.expire(now)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def add(self, key: str, value: Any = None):
+        self[key] = value
+
+    def _lookup(self, key: str):
+        entry = self.entries.get(key)
+        if entry is not None and self._expired(entry[1], time.monotonic()):
+            del self.entries[key]
+            self.expirations += 1
+            entry = None
+        return entry
+
+    def __contains__(self, key: str) -> bool:
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def seen(self, key: str) -> bool:
+        """True only if the key is cached; the Bloom filter just rules keys out early"""
+        if self.bloom is not None and key not in self.bloom:
+            self.misses += 1
+            return False
+        return key in self
+
+    def __getitem__(self, key: str) -> Any:
+        entry = self._lookup(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry[0]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        entry = self._lookup(key)
+        return default if entry is None else entry[0]
+
+    def __delitem__(self, key: str):
+        del self.entries[key]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.entries)
+
+    def keys(self):
+        return self.entries.keys()
+
+    def values(self):
+        return [value for value, _ in self.entries.values()]
+
+    def items(self):
+        return [(key, value) for key, (value, _) in self.entries.items()]
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss/eviction counters and current size"""
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'bloom_bytes': self.bloom.nbytes if self.bloom is not None else 0
+        }
@@ -0,0 +1,95 @@
+from typing import Dict
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa
+
+class SignatureScheme:
+    """A signing algorithm selectable by name in the transaction envelope"""
+
+    name = ''
+
+    def generate_key_pair(self):
+        raise NotImplementedError
+
+    def sign(self, private_key, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def verify(self, public_key, signature: bytes, data: bytes) -> bool:
+        raise NotImplementedError
+
+class RSAPSSScheme(SignatureScheme):
+    """RSA-2048 with PSS padding over SHA-256"""
+
+    name = 'rsa-pss'
+
+    # Signing parameters are immutable, so build them once rather than per call
+    pss_padding = padding.PSS(
+        mgf=padding.MGF1(hashes.SHA256()),
+        salt_length=padding.PSS.MAX_LENGTH
+    )
+    hash_algorithm = hashes.SHA256()
+
+    def generate_key_pair(self):
+        private_key = rsa.generate_private_key(
+            public_exponent=65537,
+            key_size=2048,
+            backend=default_backend()
+        )
+        return private_key, private_key.public_key()
+
+    def sign(self, private_key, data: bytes) -> bytes:
+        return private_key.sign(data, self.pss_padding, self.hash_algorithm)
+
+    def verify(self, public_key, signature: bytes, data: bytes) -> bool:
+        if not isinstance(public_key, rsa.RSAPublicKey):
+            return False
+        try:
+            public_key.verify(signature, data, self.pss_padding, self.hash_algorithm)
+            return True
+        except InvalidSignature:
+            return False
+
+class Ed25519Scheme(SignatureScheme):
+    """Ed25519: fast key generation and signing, 64-byte signatures"""
+
+    name = 'ed25519'
+
+    def generate_key_pair(self):
+        private_key = ed25519.Ed25519PrivateKey.generate()
+        return private_key, private_key.public_key()
+
+    def sign(self, private_key, data: bytes) -> bytes:
+        return private_key.sign(data)
+
+    def verify(self, public_key, signature: bytes, data: bytes) -> bool:
+        if not isinstance(public_key, ed25519.Ed25519PublicKey):
+            return False
+        try:
+            public_key.verify(signature, data)
+            return True
+        except InvalidSignature:
+            return False
+
+SCHEMES: Dict[str, SignatureScheme] = {
+    RSAPSSScheme.name: RSAPSSScheme(),
+    Ed25519Scheme.name: Ed25519Scheme(),
+}
+
+# Transactions without a 'scheme' field predate this module and are RSA-PSS
+DEFAULT_SCHEME = RSAPSSScheme.name
+
+def get_scheme(name: str) -> SignatureScheme:
+    """Look up a signature scheme by name"""
+    try:
+        return SCHEMES[name]
+    except KeyError:
+        raise ValueError(f"Unknown signature scheme: {name}")
+
+def scheme_for_key(private_key) -> SignatureScheme:
+    """The scheme that signs with a given private key"""
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return SCHEMES[Ed25519Scheme.name]
+    if isinstance(private_key, rsa.RSAPrivateKey):
+        return SCHEMES[RSAPSSScheme.name]
+    raise ValueError(f"Unsupported key type: {type(private_key).__name__}")
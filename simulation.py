@@ -0,0 +1,320 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import time
+from typing import Dict, List, Optional, Tuple
+from metrics import NodeMetrics
+from node import Node
+from transaction import Transaction
+from transport import MemoryNetwork
+from utils import generate_key_pair, serialize_public_key
+from verification import VerificationPipeline
+
+TOPOLOGIES = ('line', 'ring', 'star', 'mesh', 'random')
+TRANSPORTS = ('tcp', 'memory')
+
+# Named scenarios run by ``--suite``; each entry is passed to ``run``
+SCENARIOS = {
+    'line_10': {'nodes': 10, 'topology': 'line', 'transactions': 1000},
+    'random_20': {'nodes': 20, 'topology': 'random', 'degree': 4, 'transactions': 2000},
+    'star_20': {'nodes': 20, 'topology': 'star', 'transactions': 2000},
+    'random_20_reconcile': {'nodes': 20, 'topology': 'random', 'degree': 6, 'transactions': 2000,
+                            'reconcile_interval': 0.5, 'flood_peers': 2},
+    'random_1000_memory': {'nodes': 1000, 'topology': 'random', 'degree': 8, 'transactions': 200,
+                           'transport': 'memory', 'latency': 0.05, 'jitter': 0.02},
+}
+
+
+def build_topology(name: str, count: int, degree: int = 4,
+                   rng: Optional[random.Random] = None) -> List[Tuple[int, int]]:
+    """Edges (dialer, listener) between node indexes for a named topology"""
+    rng = rng or random.Random(1)
+    if name == 'line':
+        return [(i, i + 1) for i in range(count - 1)]
+    if name == 'ring':
+        return [(i, (i + 1) % count) for i in range(count)] if count > 2 else build_topology('line', count)
+    if name == 'star':
+        return [(i, 0) for i in range(1, count)]
+    if name == 'mesh':
+        return [(i, j) for i in range(count) for j in range(i + 1, count)]
+    if name == 'random':
+        # A ring keeps the graph connected; random chords bring the mean
+        # degree up to ``degree``
+        edges = set(build_topology('ring', count))
+        target = min(count * degree // 2, count * (count - 1) // 2)
+        while len(edges) < target:
+            a, b = rng.sample(range(count), 2)
+            if (b, a) not in edges:
+                edges.add((a, b))
+        return sorted(edges)
+    raise ValueError(f"Unknown topology: {name}")
+
+
+def _rss_bytes() -> int:
+    """Current resident set size, or the peak where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _percentile(values: List[float], q: float) -> float:
+    """``q``-th percentile of already sorted values"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+class SimNode(Node):
+    """Node that records when each transaction first reached it"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.arrivals: Dict[str, float] = {}
+
+    def accept_transaction(self, transaction: dict, peer: tuple = None):
+        super().accept_transaction(transaction, peer)
+        self.arrivals.setdefault(transaction['id'], time.perf_counter())
+
+
+class Simulation:
+    """N nodes wired into a topology, under injected load.
+
+    Every node is a real ``Node``, all sharing one event loop. Over the
+    ``tcp`` transport each has its own loopback server, so results include
+    codec, queueing, socket and scheduling costs but not real network
+    latency. The ``memory`` transport replaces sockets with a
+    ``MemoryNetwork`` adding ``latency``, ``jitter``, ``bandwidth`` and
+    ``loss`` per link; ``network.partition`` can split it mid-run.
+
+    Each node gets its own ``NodeMetrics``; traffic counted before the
+    first injection (handshakes and initial sync) is excluded from the
+    per-transaction figures. Everything runs in one process, so CPU time
+    per node is the process total divided by N.
+    """
+
+    def __init__(self, nodes: int = 10, topology: str = 'random', degree: int = 4,
+                 host: str = '127.0.0.1', base_port: int = 20000, seed: int = 1,
+                 signed: bool = False, transport: str = 'tcp', latency: float = 0.0, jitter: float = 0.0,
+                 bandwidth: Optional[float] = None, loss: float = 0.0, **node_options):
+        if topology not in TOPOLOGIES:
+            raise ValueError(f"Unknown topology: {topology}")
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown transport: {transport}")
+        self.count = nodes
+        self.topology = topology
+        self.degree = degree
+        self.host = host
+        self.base_port = base_port
+        self.rng = random.Random(seed)
+        self.signed = signed
+        self.node_options = node_options
+        self.network: Optional[MemoryNetwork] = None
+        if transport == 'memory':
+            self.network = MemoryNetwork(latency, jitter, bandwidth, loss, seed=seed)
+        self.nodes: List[SimNode] = []
+        self.edges: List[Tuple[int, int]] = []
+        self.injected: Dict[str, Tuple[int, float]] = {}
+        self.originated: List[int] = [0] * nodes
+        self.verifier: Optional[VerificationPipeline] = None
+        self._tasks: List[asyncio.Task] = []
+        self._baseline: Dict[str, Dict[str, float]] = {}
+        self._keys = generate_key_pair() if signed else None
+
+    async def start(self):
+        """Start every node, connect the topology and wait for initial sync"""
+        self.verifier = VerificationPipeline() if self.signed else None
+        for i in range(self.count):
+            node = SimNode(host=self.host, port=self.base_port + i, verify=self.signed,
+                           verifier=self.verifier, metrics=NodeMetrics(),
+                           transport=self.network.transport() if self.network is not None else None,
+                           **self.node_options)
+            self.nodes.append(node)
+            self._tasks.append(asyncio.create_task(node.start()))
+        while any(node.server is None for node in self.nodes):
+            await asyncio.sleep(0.01)
+
+        self.edges = build_topology(self.topology, self.count, self.degree, self.rng)
+        await asyncio.gather(*(
+            self.nodes[a].connect_to_peer(self.host, self.nodes[b].port) for a, b in self.edges
+        ))
+        await asyncio.sleep(0.1)
+        while any(node.syncing for node in self.nodes):
+            await asyncio.sleep(0.01)
+        self._baseline = self._traffic()
+
+    def make_transaction(self, seq: int) -> dict:
+        if self._keys is None:
+            return Transaction(f"{self.rng.getrandbits(256):064x}", f"recipient-{seq}", float(seq + 1),
+                               signature=bytes(64)).to_dict()
+        private_key, public_key = self._keys
+        tx = Transaction.create(serialize_public_key(public_key), f"recipient-{seq}", float(seq + 1))
+        tx.sign(private_key)
+        return tx.to_dict()
+
+    async def inject(self, count: int, rate: Optional[float] = None):
+        """Broadcast ``count`` transactions from random nodes, ``rate`` per second or as fast as possible"""
+        transactions = [self.make_transaction(len(self.injected) + i) for i in range(count)]
+        start = time.perf_counter()
+        for i, transaction in enumerate(transactions):
+            if rate:
+                delay = start + i / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif i % 100 == 99:
+                await asyncio.sleep(0)
+            origin = self.rng.randrange(self.count)
+            self.injected[transaction['id']] = (origin, time.perf_counter())
+            self.originated[origin] += 1
+            await self.nodes[origin].broadcast_transaction(transaction)
+
+    async def settle(self, timeout: float = 30.0) -> bool:
+        """Wait until every node holds every injected transaction"""
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            if all(len(node.arrivals) + self.originated[i] >= len(self.injected)
+                   for i, node in enumerate(self.nodes)):
+                return True
+            await asyncio.sleep(0.01)
+        return False
+
+    def _traffic(self) -> Dict[str, Dict[str, float]]:
+        totals: Dict[str, Dict[str, float]] = {'messages': {}, 'bytes': {}}
+        for node in self.nodes:
+            for kind, counter in (('messages', node.metrics.messages_out), ('bytes', node.metrics.bytes_out)):
+                for (message_type,), value in counter.values.items():
+                    totals[kind][message_type] = totals[kind].get(message_type, 0) + value
+        return totals
+
+    def report(self) -> Dict:
+        """Propagation latency, traffic per transaction and delivery coverage"""
+        latencies = []
+        for node in self.nodes:
+            for tx_id, arrived in node.arrivals.items():
+                injected = self.injected.get(tx_id)
+                if injected is not None:
+                    latencies.append(arrived - injected[1])
+        latencies.sort()
+        expected = len(self.injected) * (self.count - 1)
+
+        traffic = self._traffic()
+        sent = {
+            kind: {t: value - self._baseline[kind].get(t, 0) for t, value in values.items()
+                   if value - self._baseline[kind].get(t, 0)}
+            for kind, values in traffic.items()
+        }
+        count = len(self.injected) or 1
+        return {
+            'transactions': len(self.injected),
+            'deliveries': len(latencies),
+            'coverage': len(latencies) / expected if expected else 1.0,
+            'latency_ms': {
+                'mean': sum(latencies) / len(latencies) * 1e3 if latencies else 0.0,
+                'p50': _percentile(latencies, 50) * 1e3,
+                'p90': _percentile(latencies, 90) * 1e3,
+                'p99': _percentile(latencies, 99) * 1e3,
+                'max': latencies[-1] * 1e3 if latencies else 0.0,
+            },
+            'messages_per_tx': sum(sent['messages'].values()) / count,
+            'bytes_per_tx': sum(sent['bytes'].values()) / count,
+            'messages_by_type': sent['messages'],
+            'bytes_by_type': sent['bytes'],
+            'edges': len(self.edges),
+        }
+
+    async def stop(self):
+        for node in self.nodes:
+            await node.stop()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.verifier is not None:
+            self.verifier.close()
+
+
+async def run(nodes: int = 10, topology: str = 'random', degree: int = 4, transactions: int = 1000,
+              rate: Optional[float] = None, timeout: float = 60.0, base_port: int = 20000,
+              seed: int = 1, signed: bool = False, **node_options) -> Dict:
+    """Run one scenario end to end and return its results"""
+    rss_before = _rss_bytes()
+    simulation = Simulation(nodes, topology, degree, base_port=base_port, seed=seed, signed=signed,
+                            **node_options)
+    await simulation.start()
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    try:
+        await simulation.inject(transactions, rate)
+        settled = await simulation.settle(timeout)
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        result = simulation.report()
+    finally:
+        await simulation.stop()
+    rss_growth = _rss_bytes() - rss_before
+
+    result.update({
+        'config': {'nodes': nodes, 'topology': topology, 'degree': degree, 'transactions': transactions,
+                   'rate': rate, 'seed': seed, 'signed': signed, **node_options},
+        'settled': settled,
+        'seconds': elapsed,
+        'tx_per_sec': transactions / elapsed if elapsed > 0 else 0.0,
+        'cpu_seconds': cpu,
+        'cpu_seconds_per_node': cpu / nodes,
+        'rss_growth_bytes': rss_growth,
+        'rss_growth_per_node_bytes': rss_growth / nodes,
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a Deso P2P network on loopback and report JSON")
+    parser.add_argument('--nodes', type=int, default=10)
+    parser.add_argument('--topology', choices=TOPOLOGIES, default='random')
+    parser.add_argument('--degree', type=int, default=4, help="Mean degree of the random topology")
+    parser.add_argument('--transactions', type=int, default=1000)
+    parser.add_argument('--rate', type=float, help="Injected transactions per second (default: unpaced)")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Seconds to wait for full propagation")
+    parser.add_argument('--base-port', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--signed', action='store_true', help="Sign transactions and verify them at every hop")
+    parser.add_argument('--reconcile-interval', type=float)
+    parser.add_argument('--flood-peers', type=int)
+    parser.add_argument('--transport', choices=TRANSPORTS, default='tcp',
+                        help="Loopback sockets, or an in-memory network with the link options below")
+    parser.add_argument('--latency', type=float, default=0.0, help="One-way link delay in seconds (memory)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Extra random delay up to this (memory)")
+    parser.add_argument('--bandwidth', type=float, help="Bytes per second per link direction (memory)")
+    parser.add_argument('--loss', type=float, default=0.0, help="Fraction of writes dropped (memory)")
+    parser.add_argument('--suite', action='store_true', help="Run every named scenario instead")
+    parser.add_argument('--output', help="Write the JSON here as well as to stdout")
+    args = parser.parse_args()
+
+    if args.suite:
+        results = {}
+        for name, scenario in SCENARIOS.items():
+            results[name] = asyncio.run(run(base_port=args.base_port, **scenario))
+    else:
+        options = {}
+        if args.transport == 'memory':
+            options.update(transport='memory', latency=args.latency, jitter=args.jitter,
+                           bandwidth=args.bandwidth, loss=args.loss)
+        if args.reconcile_interval is not None:
+            options['reconcile_interval'] = args.reconcile_interval
+        if args.flood_peers is not None:
+            options['flood_peers'] = args.flood_peers
+        results = asyncio.run(run(args.nodes, args.topology, args.degree, args.transactions, args.rate,
+                                  args.timeout, args.base_port, args.seed, args.signed, **options))
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
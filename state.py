@@ -0,0 +1,182 @@
+import logging
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from chain import Block, BlockError
+
+# Snapshot layout, followed by a crc32 of everything before it:
+#   magic:4 | version:u8 | tip:32 | height:i64 | accounts:u32
+#   then per account: account_len:u16 account | balance:f64 | nonce:u64
+SNAPSHOT_MAGIC = b'DSAS'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('>4sB32sqI')
+ACCOUNT = struct.Struct('>dQ')
+_U16 = struct.Struct('>H')
+_CRC = struct.Struct('>I')
+
+
+class AccountState:
+    """Per-account balances and nonces as of the active chain tip.
+
+    Balances and nonces live in plain dicts, so a balance check is one
+    lookup. Applying a block records each touched account's previous values;
+    those undo records are kept for the last ``max_undo`` blocks, so
+    disconnecting a block in a reorg costs only the accounts it touched.
+    Every ``snapshot_interval`` blocks the whole state is written to ``path``
+    as a compact binary snapshot, which a restart loads instead of replaying
+    the chain from genesis.
+    """
+
+    def __init__(self, allocations: Optional[Dict[str, float]] = None, path: Optional[str] = None,
+                 snapshot_interval: int = 1000, max_undo: int = 1000):
+        self.allocations = dict(allocations or {})
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self.max_undo = max_undo
+        self.balances: Dict[str, float] = {}
+        self.nonces: Dict[str, int] = {}
+        self.tip: Optional[str] = None
+        self.height = -1
+        # block hash -> [(account, previous balance, previous nonce)]
+        self._undo: 'OrderedDict[str, List[Tuple[str, Optional[float], Optional[int]]]]' = OrderedDict()
+        self.logger = logging.getLogger(__name__)
+        self.reset()
+        if path is not None and os.path.exists(path):
+            try:
+                self.load(path)
+            except ValueError as e:
+                self.logger.warning("Ignoring state snapshot: %s", e)
+                self.reset()
+
+    def reset(self):
+        """Back to the genesis allocations"""
+        self.balances = {account: amount for account, amount in self.allocations.items() if amount}
+        self.nonces = {}
+        self.tip = None
+        self.height = -1
+        self._undo.clear()
+
+    def balance(self, account: str) -> float:
+        return self.balances.get(account, 0.0)
+
+    def nonce(self, account: str) -> int:
+        """Number of confirmed transactions the account has sent"""
+        return self.nonces.get(account, 0)
+
+    def apply_block(self, block: Block):
+        """Move the state forward by one block, rejecting it whole if any sender overspends"""
+        undo = []
+        touched = set()
+        balances = self.balances
+        nonces = self.nonces
+
+        def touch(account: str):
+            if account not in touched:
+                touched.add(account)
+                undo.append((account, balances.get(account), nonces.get(account)))
+
+        for tx in block.transactions:
+            amount = tx.amount
+            available = balances.get(tx.sender, 0.0)
+            if not amount > 0 or amount > available:
+                self._restore(undo)
+                if not amount > 0:
+                    raise BlockError(f"Non-positive amount: {tx.calculate_hash()}")
+                raise BlockError(f"Insufficient balance: {tx.calculate_hash()}")
+            touch(tx.sender)
+            touch(tx.recipient)
+            balances[tx.sender] = available - amount
+            balances[tx.recipient] = balances.get(tx.recipient, 0.0) + amount
+            nonces[tx.sender] = nonces.get(tx.sender, 0) + 1
+
+        block_hash = block.calculate_hash()
+        self._undo[block_hash] = undo
+        while len(self._undo) > self.max_undo:
+            self._undo.popitem(last=False)
+        self.tip = block_hash
+        self.height = block.height
+        if self.path is not None and self.snapshot_interval and block.height % self.snapshot_interval == 0:
+            self.save(self.path)
+
+    def revert_block(self, block: Block) -> bool:
+        """Undo the tip block; False if its undo record has been pruned"""
+        block_hash = block.calculate_hash()
+        if block_hash != self.tip or block_hash not in self._undo:
+            return False
+        self._restore(self._undo.pop(block_hash))
+        self.tip = block.previous_hash
+        self.height = block.height - 1
+        return True
+
+    def _restore(self, undo: List[Tuple[str, Optional[float], Optional[int]]]):
+        for account, balance, nonce in reversed(undo):
+            if balance is None:
+                self.balances.pop(account, None)
+            else:
+                self.balances[account] = balance
+            if nonce is None:
+                self.nonces.pop(account, None)
+            else:
+                self.nonces[account] = nonce
+
+    def save(self, path: str):
+        """Write a snapshot atomically; undo records are not kept"""
+        accounts = self.balances.keys() | self.nonces.keys()
+        parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, bytes.fromhex(self.tip or '00' * 32),
+                                      self.height, len(accounts))]
+        for account in accounts:
+            name = account.encode()
+            parts.append(_U16.pack(len(name)))
+            parts.append(name)
+            parts.append(ACCOUNT.pack(self.balances.get(account, 0.0), self.nonces.get(account, 0)))
+        data = b''.join(parts)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.write(_CRC.pack(zlib.crc32(data)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def load(self, path: str):
+        """Replace the state with a snapshot written by ``save``"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < SNAPSHOT_HEADER.size + _CRC.size:
+            raise ValueError("Truncated state snapshot")
+        body = memoryview(data)[:-_CRC.size]
+        if zlib.crc32(body) != _CRC.unpack_from(data, len(body))[0]:
+            raise ValueError("State snapshot checksum mismatch")
+        magic, version, tip, height, count = SNAPSHOT_HEADER.unpack_from(body)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError("Not a state snapshot")
+
+        balances, nonces = {}, {}
+        offset = SNAPSHOT_HEADER.size
+        try:
+            for _ in range(count):
+                (length,) = _U16.unpack_from(body, offset)
+                offset += 2
+                account = bytes(body[offset:offset + length]).decode()
+                offset += length
+                balance, nonce = ACCOUNT.unpack_from(body, offset)
+                offset += ACCOUNT.size
+                if balance:
+                    balances[account] = balance
+                if nonce:
+                    nonces[account] = nonce
+        except struct.error:
+            raise ValueError("Truncated state snapshot")
+        if offset != len(body):
+            raise ValueError("Malformed state snapshot")
+
+        self.balances = balances
+        self.nonces = nonces
+        self.tip = tip.hex() if height >= 0 else None
+        self.height = height
+        self._undo.clear()
+
+    def __len__(self) -> int:
+        return len(self.balances)
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+from chain import Block
+from transaction import Transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    id TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    received REAL NOT NULL,
+    pooled INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS transactions_pooled ON transactions (pooled) WHERE pooled = 1;
+CREATE TABLE IF NOT EXISTS blocks (
+    hash TEXT PRIMARY KEY,
+    height INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blocks_height ON blocks (height);
+CREATE TABLE IF NOT EXISTS peers (
+    host TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    node_id TEXT,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (host, port)
+);
+"""
+
+
+class Storage:
+    """Embedded SQLite store for transactions, blocks and peers.
+
+    The database runs in WAL mode with ``synchronous=NORMAL``: a crash never
+    corrupts it, and at worst loses the last few commits. Writes are buffered
+    in memory, coalesced per key, and committed as one transaction once
+    ``batch_size`` are pending or ``flush_interval`` has passed, so the event
+    loop pays for one commit per batch instead of one per write. Transactions
+    are stored in their canonical binary encoding.
+    """
+
+    def __init__(self, path: str = 'deso.db', batch_size: int = 1000, flush_interval: float = 0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+        # Pending writes, keyed so repeated writes to one row collapse into one
+        self._transactions: Dict[str, tuple] = {}
+        self._pooled: Dict[str, bool] = {}
+        self._blocks: Dict[str, Optional[tuple]] = {}
+        self._peers: Dict[tuple, Optional[tuple]] = {}
+        self._pending = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.commits = 0
+        self.logger = logging.getLogger(__name__)
+
+    def _schedule(self):
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.flush()
+        elif self._flush_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._flush_handle = loop.call_later(self.flush_interval, self.flush)
+
+    def save_transaction(self, transaction: Transaction, pooled: bool = False):
+        """Store a transaction, optionally marking it as pending in the mempool"""
+        tx_id = transaction.calculate_hash()
+        if tx_id not in self._transactions:
+            self._transactions[tx_id] = (tx_id, transaction.serialize(), time.time(), 0)
+        if pooled:
+            self._pooled[tx_id] = True
+        self._schedule()
+
+    def unpool_transaction(self, tx_id: str):
+        """Mark a stored transaction as no longer pending"""
+        self._pooled[tx_id] = False
+        self._schedule()
+
+    def save_block(self, block: Block):
+        """Store a validated block"""
+        block_hash = block.calculate_hash()
+        self._blocks[block_hash] = (block_hash, block.height, block.serialize())
+        self._schedule()
+
+    def remove_block(self, block_hash: str):
+        """Delete a stored block the chain has rejected"""
+        self._blocks[block_hash] = None
+        self._schedule()
+
+    def save_peer(self, host: str, port: int, node_id: Optional[str] = None):
+        """Record that a peer was seen"""
+        previous = self._peers.get((host, port))
+        if node_id is None and previous is not None:
+            node_id = previous[2]
+        self._peers[(host, port)] = (host, port, node_id, time.time())
+        self._schedule()
+
+    def remove_peer(self, host: str, port: int):
+        self._peers[(host, port)] = None
+        self._schedule()
+
+    def flush(self):
+        """Commit all pending writes in one transaction"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        transactions, self._transactions = self._transactions, {}
+        pooled, self._pooled = self._pooled, {}
+        blocks, self._blocks = self._blocks, {}
+        peers, self._peers = self._peers, {}
+        self._pending = 0
+
+        try:
+            self.db.execute('BEGIN')
+            self.db.executemany('INSERT OR IGNORE INTO transactions VALUES (?, ?, ?, ?)', transactions.values())
+            self.db.executemany('UPDATE transactions SET pooled = ? WHERE id = ?',
+                                ((int(add), tx_id) for tx_id, add in pooled.items()))
+            self.db.executemany('INSERT OR REPLACE INTO blocks VALUES (?, ?, ?)',
+                                (row for row in blocks.values() if row is not None))
+            self.db.executemany('DELETE FROM blocks WHERE hash = ?',
+                                ((block_hash,) for block_hash, row in blocks.items() if row is None))
+            self.db.executemany(
+                'INSERT INTO peers VALUES (?, ?, ?, ?) ON CONFLICT (host, port) DO UPDATE SET '
+                'node_id = COALESCE(excluded.node_id, node_id), last_seen = excluded.last_seen',
+                (row for row in peers.values() if row is not None)
+            )
+            self.db.executemany('DELETE FROM peers WHERE host = ? AND port = ?',
+                                (peer for peer, row in peers.items() if row is None))
+            self.db.execute('COMMIT')
+            self.commits += 1
+        except sqlite3.Error as e:
+            self.db.execute('ROLLBACK')
+            self.logger.error("Storage flush failed: %s", e)
+
+    def load_transactions(self, max_age: Optional[float] = None, pooled: bool = False) -> List[Transaction]:
+        """Stored transactions in arrival order; ``pooled`` limits them to the mempool"""
+        conditions = ['pooled = 1'] if pooled else []
+        params = ()
+        if max_age is not None:
+            conditions.append('received >= ?')
+            params = (time.time() - max_age,)
+        query = 'SELECT data FROM transactions'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY rowid'
+        return [Transaction.deserialize(data) for (data,) in self.db.execute(query, params)]
+
+    def load_blocks(self) -> List[Block]:
+        """Stored blocks in height order"""
+        rows = self.db.execute('SELECT data FROM blocks ORDER BY height')
+        return [Block.deserialize(data) for (data,) in rows]
+
+    def load_peers(self, limit: Optional[int] = None) -> List[Tuple[str, int, Optional[str]]]:
+        """Known peers, most recently seen first"""
+        query = 'SELECT host, port, node_id FROM peers ORDER BY last_seen DESC'
+        if limit is not None:
+            query += f' LIMIT {int(limit)}'
+        return list(self.db.execute(query))
+
+    def prune(self, max_age: float) -> int:
+        """Delete transactions older than ``max_age`` that are not pending"""
+        self.flush()
+        cursor = self.db.execute(
+            'DELETE FROM transactions WHERE received < ? AND pooled = 0',
+            (time.time() - max_age,)
+        )
+        return cursor.rowcount
+
+    def close(self):
+        """Flush and close the database"""
+        self.flush()
+        self.db.close()
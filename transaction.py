@@ -1,86 +1,431 @@
 import hashlib
+import heapq
+import itertools
+import struct
+import sys
 import time
-import json
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Optional, Tuple, Union
 import base64
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from signatures import DEFAULT_SCHEME, get_scheme, scheme_for_key
+from utils import key_fingerprint
+
+# Canonical binary layout. The signed part is:
+#   version:u8 | sender_len:u16 sender | recipient_len:u16 recipient | amount:f64 | timestamp:i64
+# and the full encoding appends:
+#   scheme_len:u8 scheme | signature_len:u16 signature | public_key_len:u16 public_key
+# Every variable field is length-prefixed, so no two transactions share an encoding.
+TX_VERSION = 1
+_U8 = struct.Struct('>B')
+_U16 = struct.Struct('>H')
+_AMOUNT_TIME = struct.Struct('>dq')
+_VERSION_BYTE = _U8.pack(TX_VERSION)
 
 class Transaction:
-    def __init__(self, sender: str, recipient: str, amount: float):
-        self.sender = sender
-        self.recipient = recipient
+    """A transfer between two accounts.
+
+    Instances are compact: ``__slots__`` instead of a per-instance dict,
+    sender and recipient are interned identifiers (the sender is the
+    fingerprint of its public key), the PEM key itself is interned so all
+    transactions from one sender share a single copy, the signature is kept
+    as raw bytes and the hash is computed once. Fields covered by the hash
+    must not change after construction.
+    """
+
+    __slots__ = ('sender', 'recipient', 'amount', 'timestamp', 'signature', 'scheme', 'public_key', '_hash')
+
+    def __init__(self, sender: str, recipient: str, amount: float, timestamp: Optional[int] = None,
+                 signature: Optional[bytes] = None, scheme: str = DEFAULT_SCHEME,
+                 public_key: Optional[str] = None):
+        self.sender = sys.intern(sender)
+        self.recipient = sys.intern(recipient)
         self.amount = amount
-        self.timestamp = int(time.time())
-        self.signature = None
+        self.timestamp = int(time.time()) if timestamp is None else timestamp
+        self.signature = signature
+        self.scheme = sys.intern(scheme)
+        self.public_key = sys.intern(public_key) if public_key is not None else None
+        self._hash = None
+
+    @classmethod
+    def create(cls, public_key: str, recipient: str, amount: float) -> 'Transaction':
+        """New transaction from the holder of a serialized public key"""
+        return cls(key_fingerprint(public_key), recipient, amount, public_key=public_key)
 
     def to_dict(self) -> Dict:
         """Convert transaction to dictionary"""
-        return {
+        data = {
+            'id': self.calculate_hash(),
             'sender': self.sender,
             'recipient': self.recipient,
             'amount': self.amount,
             'timestamp': self.timestamp,
-            'signature': self.signature
+            'signature': base64.b64encode(self.signature).decode() if self.signature else None,
+            'scheme': self.scheme
         }
+        if self.public_key is not None:
+            data['public_key'] = self.public_key
+        return data
 
-    def calculate_hash(self) -> str:
-        """Calculate transaction hash"""
-        tx_string = f"{self.sender}{self.recipient}{self.amount}{self.timestamp}"
-        return hashlib.sha256(tx_string.encode()).hexdigest()
-
-    def sign(self, private_key: rsa.RSAPrivateKey):
-        """Sign the transaction"""
-        tx_hash = self.calculate_hash()
-        signature = private_key.sign(
-            tx_hash.encode(),
-            padding.PSS(
-                mgf=padding.MGF1(hashes.SHA256()),
-                salt_length=padding.PSS.MAX_LENGTH
-            ),
-            hashes.SHA256()
+    def signing_bytes(self) -> bytes:
+        """Canonical encoding of the fields covered by the hash and signature"""
+        sender = self.sender.encode()
+        recipient = self.recipient.encode()
+        return b''.join((
+            _VERSION_BYTE,
+            _U16.pack(len(sender)), sender,
+            _U16.pack(len(recipient)), recipient,
+            _AMOUNT_TIME.pack(float(self.amount), self.timestamp)
+        ))
+
+    def serialize(self) -> bytes:
+        """Canonical binary encoding of the whole transaction"""
+        scheme = self.scheme.encode()
+        signature = self.signature or b''
+        public_key = self.public_key.encode() if self.public_key is not None else b''
+        return b''.join((
+            self.signing_bytes(),
+            _U8.pack(len(scheme)), scheme,
+            _U16.pack(len(signature)), signature,
+            _U16.pack(len(public_key)), public_key
+        ))
+
+    @classmethod
+    def deserialize(cls, data) -> 'Transaction':
+        """Decode a canonical encoding; the hash comes straight from the signed bytes"""
+        data = bytes(data)
+        try:
+            if data[0] != TX_VERSION:
+                raise ValueError("Unsupported transaction encoding")
+            (length,) = _U16.unpack_from(data, 1)
+            sender_end = 3 + length
+            (length,) = _U16.unpack_from(data, sender_end)
+            recipient_end = sender_end + 2 + length
+            amount, timestamp = _AMOUNT_TIME.unpack_from(data, recipient_end)
+            signed_end = recipient_end + _AMOUNT_TIME.size
+            scheme_end = signed_end + 1 + data[signed_end]
+            (length,) = _U16.unpack_from(data, scheme_end)
+            signature_end = scheme_end + 2 + length
+            (length,) = _U16.unpack_from(data, signature_end)
+            end = signature_end + 2 + length
+        except (IndexError, struct.error):
+            raise ValueError("Truncated transaction")
+        if end != len(data):
+            raise ValueError("Malformed transaction encoding")
+
+        tx = cls(data[3:sender_end].decode(), data[sender_end + 2:recipient_end].decode(), amount,
+                 timestamp=timestamp, signature=data[scheme_end + 2:signature_end] or None,
+                 scheme=data[signed_end + 1:scheme_end].decode(),
+                 public_key=data[signature_end + 2:end].decode() or None)
+        tx._hash = sys.intern(hashlib.sha256(data[:signed_end]).hexdigest())
+        return tx
+
+    def encoded_size(self) -> int:
+        """Length of ``serialize()`` without building it"""
+        return (1 + 2 + len(self.sender) + 2 + len(self.recipient) + _AMOUNT_TIME.size
+                + 1 + len(self.scheme) + 2 + len(self.signature or b'')
+                + 2 + (len(self.public_key) if self.public_key is not None else 0))
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Transaction':
+        """Rebuild a transaction received from the network"""
+        signature = data['signature']
+        if isinstance(signature, str):
+            signature = base64.b64decode(signature)
+        return cls(
+            data['sender'], data['recipient'], data['amount'],
+            timestamp=data['timestamp'],
+            signature=signature,
+            scheme=data.get('scheme', DEFAULT_SCHEME),
+            public_key=data.get('public_key')
         )
-        self.signature = base64.b64encode(signature).decode()
 
-    def verify(self, public_key: rsa.RSAPublicKey) -> bool:
+    def calculate_hash(self) -> str:
+        """SHA-256 of the canonical signed encoding, computed once"""
+        if self._hash is None:
+            self._hash = sys.intern(hashlib.sha256(self.signing_bytes()).hexdigest())
+        return self._hash
+
+    def verification_key(self) -> str:
+        """Serialized key the signature is checked against.
+
+        Transactions created before senders were fingerprints carry the PEM
+        key as the sender itself.
+        """
+        return self.public_key if self.public_key is not None else self.sender
+
+    def sign(self, private_key):
+        """Sign the transaction with the scheme matching the key type"""
+        scheme = scheme_for_key(private_key)
+        self.signature = scheme.sign(private_key, bytes.fromhex(self.calculate_hash()))
+        self.scheme = scheme.name
+
+    def verify(self, public_key) -> bool:
         """Verify transaction signature"""
         if not self.signature:
             return False
+        # The sender fingerprint must belong to the attached key
+        if self.public_key is not None and key_fingerprint(self.public_key) != self.sender:
+            return False
 
         try:
-            signature = base64.b64decode(self.signature)
-            tx_hash = self.calculate_hash()
-
-            public_key.verify(
-                signature,
-                tx_hash.encode(),
-                padding.PSS(
-                    mgf=padding.MGF1(hashes.SHA256()),
-                    salt_length=padding.PSS.MAX_LENGTH
-                ),
-                hashes.SHA256()
-            )
-            return True
+            return get_scheme(self.scheme).verify(public_key, self.signature, bytes.fromhex(self.calculate_hash()))
         except Exception:
             return False
 
+def hash_transactions(transactions: List[Transaction]) -> List[str]:
+    """Hash many transactions in one pass, filling each one's memoized ID"""
+    sha256 = hashlib.sha256
+    pack_u16 = _U16.pack
+    pack_amount_time = _AMOUNT_TIME.pack
+    join = b''.join
+    intern = sys.intern
+    hashes = []
+    for tx in transactions:
+        if tx._hash is None:
+            sender = tx.sender.encode()
+            recipient = tx.recipient.encode()
+            tx._hash = intern(sha256(join((
+                _VERSION_BYTE, pack_u16(len(sender)), sender, pack_u16(len(recipient)), recipient,
+                pack_amount_time(float(tx.amount), tx.timestamp)
+            ))).hexdigest())
+        hashes.append(tx._hash)
+    return hashes
+
 class TransactionPool:
-    def __init__(self):
-        self.transactions: Dict[str, Transaction] = {}
+    """Mempool ordered by priority with per-sender index, size caps and TTL.
+
+    Three heaps share lazily-deleted entries: best-first for block selection,
+    worst-first for eviction and soonest-expiry for TTL. A heap entry is live
+    only while its hash is still pooled under the same sequence number, so
+    removal is O(1) and admission/eviction stay O(log n). Heaps are rebuilt
+    once stale entries outnumber live ones.
+    """
+
+    def __init__(self, max_count: int = 100000, max_bytes: int = 64 * 1024 * 1024,
+                 ttl: Optional[float] = 3 * 3600, priority: Callable[[Transaction], float] = None,
+                 storage=None, log=None, state=None):
+        # With an AccountState, a sender's pooled spends may not exceed its
+        # confirmed balance; ``spending`` keeps the running total per sender
+        self.state = state
+        self.spending: Dict[str, float] = {}
+        self.rejections = 0
+
+        # With a TransactionLog, pooled transactions live in the log and these
+        # dicts hold only their integer locations
+        self.log = log
+        self.transactions: Dict[str, Union[Transaction, int]] = {}
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.priority = priority or (lambda tx: tx.amount)
+        self.by_sender: Dict[str, Dict[str, Union[Transaction, int]]] = {}
+        self.total_bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+        # hash -> (priority, seq, size, sender, amount)
+        self._entries: Dict[str, Tuple[float, int, int, str, float]] = {}
+        self._best: List[Tuple[float, int, str]] = []
+        self._worst: List[Tuple[float, int, str]] = []
+        self._expiry: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+
+        # Pending transactions survive restarts when a Storage is given
+        self.storage = None
+        if storage is not None:
+            restored = storage.load_transactions(max_age=ttl, pooled=True)
+            self.restore(restored)
+            for transaction in restored:
+                if transaction.calculate_hash() not in self.transactions:
+                    storage.unpool_transaction(transaction.calculate_hash())
+            self.storage = storage
+        if log is not None and len(log):
+            restored = [log.read_transaction(location) for location in list(log.index.values())]
+            self.restore(restored)
+            for transaction in restored:
+                if transaction.calculate_hash() not in self.transactions:
+                    log.remove(transaction.calculate_hash())
+
+    @staticmethod
+    def transaction_size(transaction: Transaction) -> int:
+        """Encoded size of a transaction in bytes"""
+        return transaction.encoded_size()
+
+    def _live(self, tx_hash: str, seq: int) -> bool:
+        entry = self._entries.get(tx_hash)
+        return entry is not None and entry[1] == seq
 
     def add_transaction(self, transaction: Transaction) -> bool:
-        """Add a transaction to the pool"""
+        """Add a transaction to the pool, evicting lower-priority ones if it is full"""
         tx_hash = transaction.calculate_hash()
-        if tx_hash not in self.transactions:
-            self.transactions[tx_hash] = transaction
-            return True
-        return False
+        if tx_hash in self.transactions:
+            return False
+        self.expire()
+
+        priority = self.priority(transaction)
+        size = self.transaction_size(transaction)
+        if size > self.max_bytes:
+            return False
+        if self.state is not None and not self.affordable(transaction):
+            self.rejections += 1
+            return False
+        while len(self.transactions) >= self.max_count or self.total_bytes + size > self.max_bytes:
+            worst = self._peek_worst()
+            if worst is None or self._entries[worst][0] >= priority:
+                return False
+            self._remove(worst)
+            self.evictions += 1
+
+        seq = next(self._seq)
+        value = self.log.append(transaction) if self.log is not None else transaction
+        self.transactions[tx_hash] = value
+        self._entries[tx_hash] = (priority, seq, size, transaction.sender, transaction.amount)
+        self.by_sender.setdefault(transaction.sender, {})[tx_hash] = value
+        self.total_bytes += size
+        if self.state is not None:
+            self.spending[transaction.sender] = self.spending.get(transaction.sender, 0.0) + transaction.amount
+        heapq.heappush(self._best, (-priority, seq, tx_hash))
+        heapq.heappush(self._worst, (priority, -seq, tx_hash))
+        if self.ttl is not None:
+            heapq.heappush(self._expiry, (time.monotonic() + self.ttl, seq, tx_hash))
+        if self.storage is not None:
+            self.storage.save_transaction(transaction, pooled=True)
+        return True
+
+    def restore(self, transactions: List[Transaction]) -> int:
+        """Bulk-admit transactions, best first up to the caps, heapifying once"""
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        admitted = 0
+        for transaction in sorted(transactions, key=self.priority, reverse=True):
+            if len(self.transactions) >= self.max_count:
+                break
+            tx_hash = transaction.calculate_hash()
+            size = self.transaction_size(transaction)
+            if tx_hash in self.transactions or self.total_bytes + size > self.max_bytes:
+                continue
+            if self.state is not None:
+                if not self.affordable(transaction):
+                    continue
+                self.spending[transaction.sender] = self.spending.get(transaction.sender, 0.0) + transaction.amount
+            priority = self.priority(transaction)
+            seq = next(self._seq)
+            value = self.log.append(transaction) if self.log is not None else transaction
+            self.transactions[tx_hash] = value
+            self._entries[tx_hash] = (priority, seq, size, transaction.sender, transaction.amount)
+            self.by_sender.setdefault(transaction.sender, {})[tx_hash] = value
+            self.total_bytes += size
+            self._best.append((-priority, seq, tx_hash))
+            self._worst.append((priority, -seq, tx_hash))
+            if expires is not None:
+                self._expiry.append((expires, seq, tx_hash))
+            admitted += 1
+        for heap in (self._best, self._worst, self._expiry):
+            heapq.heapify(heap)
+        return admitted
+
+    def affordable(self, transaction: Transaction) -> bool:
+        """Whether the sender's balance covers this and everything it already has pooled"""
+        amount = transaction.amount
+        sender = transaction.sender
+        return amount > 0 and self.spending.get(sender, 0.0) + amount <= self.state.balance(sender)
+
+    def revalidate(self, senders) -> int:
+        """Drop pooled spends the senders' new balances no longer cover, lowest priority first"""
+        dropped = 0
+        for sender in senders:
+            excess = self.spending.get(sender, 0.0) - self.state.balance(sender)
+            if excess <= 1e-9:
+                continue
+            for tx_hash in sorted(self.by_sender[sender], key=lambda h: self._entries[h][0]):
+                excess -= self._entries[tx_hash][4]
+                self._remove(tx_hash)
+                dropped += 1
+                if excess <= 1e-9:
+                    break
+        return dropped
+
+    def _materialize(self, value: Union[Transaction, int]) -> Transaction:
+        return self.log.read_transaction(value) if self.log is not None else value
 
     def get_transaction(self, tx_hash: str) -> Optional[Transaction]:
         """Get a transaction from the pool"""
-        return self.transactions.get(tx_hash)
+        value = self.transactions.get(tx_hash)
+        return self._materialize(value) if value is not None else None
 
     def remove_transaction(self, tx_hash: str):
         """Remove a transaction from the pool"""
         if tx_hash in self.transactions:
-            del self.transactions[tx_hash]
\ No newline at end of file
+            self._remove(tx_hash)
+
+    def _remove(self, tx_hash: str):
+        del self.transactions[tx_hash]
+        _, _, size, sender, amount = self._entries.pop(tx_hash)
+        self.total_bytes -= size
+        if self.state is not None:
+            remaining = self.spending[sender] - amount
+            if remaining > 1e-9 and len(self.by_sender[sender]) > 1:
+                self.spending[sender] = remaining
+            else:
+                del self.spending[sender]
+        sender_txs = self.by_sender[sender]
+        del sender_txs[tx_hash]
+        if not sender_txs:
+            del self.by_sender[sender]
+        if self.storage is not None:
+            self.storage.unpool_transaction(tx_hash)
+        if self.log is not None:
+            self.log.remove(tx_hash)
+        if len(self._best) > 2 * len(self.transactions) + 64:
+            self._compact()
+
+    def _compact(self):
+        """Drop stale heap entries"""
+        self._best = [e for e in self._best if self._live(e[2], e[1])]
+        self._worst = [e for e in self._worst if self._live(e[2], -e[1])]
+        self._expiry = [e for e in self._expiry if self._live(e[2], e[1])]
+        for heap in (self._best, self._worst, self._expiry):
+            heapq.heapify(heap)
+
+    def _peek_worst(self) -> Optional[str]:
+        while self._worst:
+            _, neg_seq, tx_hash = self._worst[0]
+            if self._live(tx_hash, -neg_seq):
+                return tx_hash
+            heapq.heappop(self._worst)
+        return None
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Remove transactions older than the TTL"""
+        now = time.monotonic() if now is None else now
+        expired = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            _, seq, tx_hash = heapq.heappop(self._expiry)
+            if self._live(tx_hash, seq):
+                self._remove(tx_hash)
+                expired += 1
+        self.expirations += expired
+        return expired
+
+    def top(self, count: int) -> List[Transaction]:
+        """The ``count`` highest-priority transactions, best first, in O(count log n)"""
+        popped = []
+        selected = []
+        while self._best and len(selected) < count:
+            entry = heapq.heappop(self._best)
+            if self._live(entry[2], entry[1]):
+                popped.append(entry)
+                selected.append(self._materialize(self.transactions[entry[2]]))
+        for entry in popped:
+            heapq.heappush(self._best, entry)
+        return selected
+
+    def pending_from(self, sender: str) -> List[Transaction]:
+        """All pooled transactions from a sender"""
+        values = self.by_sender.get(sender, {}).values()
+        if self.log is None:
+            return list(values)
+        return [self.log.read_transaction(location) for location in values]
+
+    def __len__(self) -> int:
+        return len(self.transactions)
+
+    def __contains__(self, tx_hash: str) -> bool:
+        return tx_hash in self.transactions
@@ -0,0 +1,259 @@
+import asyncio
+import errno
+import itertools
+import random
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+from codec import MAX_FRAME_SIZE
+
+Handler = Callable[[asyncio.StreamReader, object], Awaitable[None]]
+
+# Unsent bytes a link buffers before ``drain`` waits, as asyncio's default
+HIGH_WATER = 64 * 1024
+
+
+class TcpTransport:
+    """Real sockets through asyncio streams; the default everywhere"""
+
+    async def start_server(self, handler: Handler, host: str, port: int):
+        return await asyncio.start_server(handler, host, port, limit=MAX_FRAME_SIZE)
+
+    async def open_connection(self, host: str, port: int):
+        return await asyncio.open_connection(host, port, limit=MAX_FRAME_SIZE)
+
+
+class _Link:
+    """One direction of an in-memory connection.
+
+    Writes queue behind the link's bandwidth, then arrive after the
+    network's latency, never overtaking earlier writes. As over TCP, a lost
+    write is not dropped but retransmitted after ``rto``, holding up
+    everything behind it.
+    """
+
+    def __init__(self, network: 'MemoryNetwork', source: tuple, destination: tuple,
+                 reader: asyncio.StreamReader):
+        self.network = network
+        self.source = source
+        self.destination = destination
+        self.reader = reader
+        self.busy_until = 0.0
+        self.last_arrival = 0.0
+        self.closed = False
+        self.reverse: Optional['_Link'] = None
+
+    def send(self, data: bytes):
+        network = self.network
+        if self.closed:
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        start = max(now, self.busy_until)
+        self.busy_until = start + (len(data) / network.bandwidth if network.bandwidth else 0.0)
+        delay = network.delay()
+        if network.loss and network.rng.random() < network.loss:
+            network.retransmits += 1
+            delay += network.rto
+        self.last_arrival = max(self.busy_until + delay, self.last_arrival)
+        network.delivered += len(data)
+        if self.last_arrival <= now:
+            self.reader.feed_data(data)
+        else:
+            loop.call_at(self.last_arrival, self._deliver, data)
+
+    def _deliver(self, data: bytes):
+        if not self.closed:
+            self.reader.feed_data(data)
+
+    def backlog(self) -> float:
+        """Seconds until the bytes not yet transmitted fall to ``HIGH_WATER``"""
+        if not self.network.bandwidth:
+            return 0.0
+        return self.busy_until - asyncio.get_running_loop().time() - HIGH_WATER / self.network.bandwidth
+
+    def finish(self):
+        """End of stream for the reader, after everything already in flight"""
+        if self.closed:
+            return
+        loop = asyncio.get_running_loop()
+        at = max(loop.time() + self.network.latency, self.last_arrival)
+        loop.call_at(at, self.abort)
+
+    def abort(self):
+        """End of stream for the reader now, discarding anything in flight"""
+        if not self.closed:
+            self.closed = True
+            self.reader.feed_eof()
+            if self.reverse is not None and self.reverse.closed:
+                self.network.connections.discard(self)
+                self.network.connections.discard(self.reverse)
+
+
+class MemoryWriter:
+    """The parts of ``asyncio.StreamWriter`` the node uses, over a pair of links"""
+
+    def __init__(self, outgoing: _Link, incoming: _Link, sockname: tuple, peername: tuple):
+        self._outgoing = outgoing
+        self._incoming = incoming
+        self._closing = False
+        self._extra = {'sockname': sockname, 'peername': peername}
+
+    def write(self, data: bytes):
+        if not self._closing:
+            self._outgoing.send(bytes(data))
+
+    def writelines(self, lines: Iterable[bytes]):
+        self.write(b''.join(lines))
+
+    async def drain(self):
+        if self.is_closing():
+            raise ConnectionResetError("Connection lost")
+        delay = self._outgoing.backlog()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def is_closing(self) -> bool:
+        return self._closing or self._outgoing.closed
+
+    def close(self):
+        if not self._closing:
+            self._closing = True
+            self._outgoing.finish()
+            self._incoming.abort()
+
+    async def wait_closed(self):
+        pass
+
+    def get_extra_info(self, name: str, default=None):
+        return self._extra.get(name, default)
+
+
+class MemoryServer:
+    """Listener registered with a ``MemoryNetwork``; mirrors ``asyncio.Server``"""
+
+    def __init__(self, network: 'MemoryNetwork', address: tuple, handler: Handler):
+        self.network = network
+        self.address = address
+        self.handler = handler
+        self.closed = False
+        self._serving: Optional[asyncio.Future] = None
+
+    def is_serving(self) -> bool:
+        return not self.closed
+
+    async def serve_forever(self):
+        self._serving = asyncio.get_running_loop().create_future()
+        await self._serving
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.network.listeners.get(self.address) is self:
+            del self.network.listeners[self.address]
+        if self._serving is not None and not self._serving.done():
+            self._serving.cancel()
+
+    async def wait_closed(self):
+        pass
+
+
+class MemoryNetwork:
+    """Simulated network joining every ``MemoryTransport`` made from it.
+
+    Every link gets ``latency`` seconds of one-way delay plus up to
+    ``jitter`` more, and ``bandwidth`` bytes per second in each direction
+    (unlimited when None). Each write is lost with probability ``loss``
+    and arrives ``rto`` seconds late, as a TCP retransmission would; jitter
+    and loss are drawn from a generator seeded with ``seed`` so runs can be
+    repeated. ``partition`` cuts links between groups of addresses until
+    ``heal``: connections across the cut are reset and new ones fail.
+
+    No sockets are opened and no kernel work is done, so thousands of
+    nodes fit in one process. Time is still the event loop's real clock.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, bandwidth: Optional[float] = None,
+                 loss: float = 0.0, rto: float = 0.2, seed: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.loss = loss
+        # Linux's minimum retransmission timeout
+        self.rto = rto
+        self.rng = random.Random(seed)
+        self.listeners: Dict[tuple, MemoryServer] = {}
+        self.groups: Dict[tuple, int] = {}
+        # Client-to-server link of every open connection
+        self.connections: Set[_Link] = set()
+        self.retransmits = 0
+        self.delivered = 0
+        self._ports = itertools.count(40000)
+
+    def transport(self, address: Optional[tuple] = None) -> 'MemoryTransport':
+        return MemoryTransport(self, address)
+
+    def delay(self) -> float:
+        return self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def partition(self, *groups: Iterable[tuple]):
+        """Cut every link between addresses in different groups; unlisted addresses reach everyone"""
+        self.groups = {address: i for i, group in enumerate(groups) for address in group}
+        for link in list(self.connections):
+            if not self.reachable(link.source, link.destination):
+                link.abort()
+                link.reverse.abort()
+
+    def heal(self):
+        self.groups = {}
+
+    def reachable(self, source: Optional[tuple], destination: tuple) -> bool:
+        a, b = self.groups.get(source), self.groups.get(destination)
+        return a is None or b is None or a == b
+
+    async def connect(self, source: Optional[tuple], destination: tuple) -> Tuple[asyncio.StreamReader, MemoryWriter]:
+        """Open a stream after one round trip, as a TCP handshake would"""
+        rtt = self.delay() + self.delay()
+        if rtt:
+            await asyncio.sleep(rtt)
+        if not self.reachable(source, destination):
+            raise OSError(errno.EHOSTUNREACH, f"No route to {destination[0]}:{destination[1]}")
+        server = self.listeners.get(destination)
+        if server is None:
+            raise ConnectionRefusedError(errno.ECONNREFUSED, f"Connection refused by {destination[0]}:{destination[1]}")
+
+        local = (source[0] if source is not None else '127.0.0.1', next(self._ports))
+        client_reader = asyncio.StreamReader(limit=MAX_FRAME_SIZE)
+        server_reader = asyncio.StreamReader(limit=MAX_FRAME_SIZE)
+        outbound = _Link(self, source, destination, server_reader)
+        inbound = _Link(self, destination, source, client_reader)
+        outbound.reverse, inbound.reverse = inbound, outbound
+        self.connections.add(outbound)
+        client = MemoryWriter(outbound, inbound, local, destination)
+        accepted = MemoryWriter(inbound, outbound, destination, local)
+        asyncio.create_task(server.handler(server_reader, accepted))
+        return client_reader, client
+
+
+class MemoryTransport:
+    """A node's attachment to a ``MemoryNetwork``.
+
+    Its address, used for partitions, is the one given here or else the
+    first one it listens on.
+    """
+
+    def __init__(self, network: MemoryNetwork, address: Optional[tuple] = None):
+        self.network = network
+        self.address = address
+
+    async def start_server(self, handler: Handler, host: str, port: int) -> MemoryServer:
+        address = (host, port)
+        if address in self.network.listeners:
+            raise OSError(errno.EADDRINUSE, f"Address already in use: {host}:{port}")
+        if self.address is None:
+            self.address = address
+        server = MemoryServer(self.network, address, handler)
+        self.network.listeners[address] = server
+        return server
+
+    async def open_connection(self, host: str, port: int) -> Tuple[asyncio.StreamReader, MemoryWriter]:
+        return await self.network.connect(self.address, (host, port))
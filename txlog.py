@@ -0,0 +1,254 @@
+import logging
+import mmap
+import os
+import struct
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+from transaction import Transaction
+
+# Record layout; segments are preallocated and zero-filled, so kind 0 marks the end:
+#   payload_len:u32 | kind:u8 | crc32:u32 | tx_id:32 | payload
+# A transaction record's payload is the canonical encoding; a removal's is the
+# 8-byte location of the record it cancels.
+RECORD = struct.Struct('>IBI32s')
+LOCATION = struct.Struct('>Q')
+KIND_TRANSACTION = 1
+KIND_REMOVAL = 2
+SEGMENT_PREFIX = 'txlog-'
+SEGMENT_SUFFIX = '.log'
+
+
+def make_location(segment_id: int, offset: int) -> int:
+    """Pack a segment ID and record offset into one integer"""
+    return (segment_id << 32) | offset
+
+
+def split_location(location: int) -> Tuple[int, int]:
+    return location >> 32, location & 0xFFFFFFFF
+
+
+class Segment:
+    """One preallocated, memory-mapped log file"""
+
+    def __init__(self, path: str, segment_id: int, size: int):
+        self.path = path
+        self.segment_id = segment_id
+        create = not os.path.exists(path)
+        with open(path, 'a+b') as f:
+            if create or os.path.getsize(path) < size:
+                f.truncate(size)
+            self.size = os.path.getsize(path)
+            self.mmap = mmap.mmap(f.fileno(), self.size)
+        self.view = memoryview(self.mmap)
+        self.write_offset = 0
+        self.live = 0
+        self.live_bytes = 0
+
+    def scan(self) -> Iterator[Tuple[int, int, bytes, int]]:
+        """Yield (offset, kind, tx_id, end) for every intact record, stopping at the first torn one"""
+        offset = 0
+        while offset + RECORD.size <= self.size:
+            length, kind, crc, tx_id = RECORD.unpack_from(self.mmap, offset)
+            end = offset + RECORD.size + length
+            if kind not in (KIND_TRANSACTION, KIND_REMOVAL) or end > self.size:
+                break
+            if zlib.crc32(self.view[offset + RECORD.size:end], zlib.crc32(tx_id)) != crc:
+                break
+            yield offset, kind, tx_id, end
+            offset = end
+        self.write_offset = offset
+
+    def write(self, kind: int, tx_id: bytes, payload: bytes) -> Optional[int]:
+        """Append a record, returning its offset, or None if the segment is full"""
+        end = self.write_offset + RECORD.size + len(payload)
+        if end > self.size:
+            return None
+        offset = self.write_offset
+        # Payload first, header last: a torn write leaves kind 0 or a bad CRC
+        self.mmap[offset + RECORD.size:end] = payload
+        self.mmap[offset:offset + RECORD.size] = RECORD.pack(
+            len(payload), kind, zlib.crc32(payload, zlib.crc32(tx_id)), tx_id)
+        self.write_offset = end
+        return offset
+
+    def record(self, offset: int) -> memoryview:
+        """Header and payload of the record at ``offset``"""
+        (length,) = struct.unpack_from('>I', self.mmap, offset)
+        return self.view[offset:offset + RECORD.size + length]
+
+    def close(self) -> bool:
+        """Unmap the file; False while readers still hold slices of it"""
+        try:
+            self.view.release()
+            self.mmap.close()
+            return True
+        except BufferError:
+            return False
+
+
+class TransactionLog:
+    """Segmented, memory-mapped append-only log of transactions.
+
+    Accepted transactions are appended in their canonical encoding to the
+    active segment, which rolls over at ``segment_size``. The only in-memory
+    state is a dict from 32-byte transaction ID to an integer location, so
+    the log can hold far more transactions than fit in memory as objects,
+    and ``get`` returns a zero-copy slice of the mapped file. Removals, when
+    transactions are confirmed or expire, are logged as small tombstones.
+    Once live data in a sealed segment drops below ``compact_ratio`` of what
+    was written, its surviving records are copied forward and the file is
+    deleted. On open, segments are scanned to rebuild the index, stopping at
+    the first torn record.
+    """
+
+    def __init__(self, directory: str, segment_size: int = 64 * 1024 * 1024,
+                 compact_ratio: float = 0.5, sync: bool = False):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.compact_ratio = compact_ratio
+        self.sync = sync
+        self.index: Dict[bytes, int] = {}
+        self.segments: Dict[int, Segment] = {}
+        self.retired: List[Segment] = []
+        self.compactions = 0
+        self.logger = logging.getLogger(__name__)
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    def _segment_path(self, segment_id: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{segment_id:08d}{SEGMENT_SUFFIX}")
+
+    def _recover(self):
+        segment_ids = sorted(
+            int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+        for segment_id in segment_ids:
+            segment = Segment(self._segment_path(segment_id), segment_id, self.segment_size)
+            self.segments[segment_id] = segment
+            for offset, kind, tx_id, _ in segment.scan():
+                if kind == KIND_TRANSACTION:
+                    self.index[tx_id] = make_location(segment_id, offset)
+                elif self.index.get(tx_id) == LOCATION.unpack_from(segment.mmap, offset + RECORD.size)[0]:
+                    del self.index[tx_id]
+
+        for location in self.index.values():
+            segment_id, offset = split_location(location)
+            segment = self.segments[segment_id]
+            segment.live += 1
+            segment.live_bytes += len(segment.record(offset))
+
+        self.active = self.segments[segment_ids[-1]] if segment_ids else self._new_segment()
+        if segment_ids:
+            self.logger.info("Recovered %d transactions from %d segments", len(self.index), len(segment_ids))
+
+    def _new_segment(self) -> Segment:
+        segment_id = max(self.segments, default=0) + 1
+        segment = Segment(self._segment_path(segment_id), segment_id, self.segment_size)
+        self.segments[segment_id] = segment
+        return segment
+
+    def _write(self, kind: int, tx_id: bytes, payload: bytes) -> int:
+        if RECORD.size + len(payload) > self.segment_size:
+            raise ValueError(f"Record of {len(payload)} bytes exceeds segment size")
+        offset = self.active.write(kind, tx_id, payload)
+        if offset is None:
+            if self.sync:
+                self.active.mmap.flush()
+            self.active = self._new_segment()
+            offset = self.active.write(kind, tx_id, payload)
+        return make_location(self.active.segment_id, offset)
+
+    def append(self, transaction: Transaction) -> int:
+        """Log a transaction, returning its location; already-logged ones are not rewritten"""
+        tx_id = bytes.fromhex(transaction.calculate_hash())
+        location = self.index.get(tx_id)
+        if location is not None:
+            return location
+        payload = transaction.serialize()
+        location = self._write(KIND_TRANSACTION, tx_id, payload)
+        self.index[tx_id] = location
+        self.active.live += 1
+        self.active.live_bytes += RECORD.size + len(payload)
+        return location
+
+    def location(self, tx_hash: str) -> Optional[int]:
+        return self.index.get(bytes.fromhex(tx_hash))
+
+    def read(self, location: int) -> memoryview:
+        """Canonical encoding stored at ``location``, as a slice of the mapped file"""
+        segment_id, offset = split_location(location)
+        return self.segments[segment_id].record(offset)[RECORD.size:]
+
+    def read_transaction(self, location: int) -> Transaction:
+        return Transaction.deserialize(self.read(location))
+
+    def get(self, tx_hash: str) -> Optional[memoryview]:
+        """Zero-copy encoding of a logged transaction"""
+        location = self.location(tx_hash)
+        return self.read(location) if location is not None else None
+
+    def get_transaction(self, tx_hash: str) -> Optional[Transaction]:
+        location = self.location(tx_hash)
+        return self.read_transaction(location) if location is not None else None
+
+    def remove(self, tx_hash: str):
+        """Forget a confirmed or expired transaction"""
+        tx_id = bytes.fromhex(tx_hash)
+        location = self.index.pop(tx_id, None)
+        if location is None:
+            return
+        segment_id, offset = split_location(location)
+        segment = self.segments[segment_id]
+        segment.live -= 1
+        segment.live_bytes -= len(segment.record(offset))
+        self._write(KIND_REMOVAL, tx_id, LOCATION.pack(location))
+        if segment is not self.active and segment.live_bytes < segment.write_offset * self.compact_ratio:
+            self.compact(segment)
+
+    def compact(self, segment: Segment):
+        """Copy a sealed segment's live records forward and delete it"""
+        for offset, kind, tx_id, end in list(segment.scan()):
+            payload = segment.mmap[offset + RECORD.size:end]
+            if kind == KIND_TRANSACTION:
+                if self.index.get(tx_id) != make_location(segment.segment_id, offset):
+                    continue
+                location = self._write(KIND_TRANSACTION, tx_id, payload)
+                self.index[tx_id] = location
+                self.active.live += 1
+                self.active.live_bytes += RECORD.size + len(payload)
+            else:
+                # A tombstone matters only while the record it cancels still exists
+                target_segment, _ = split_location(LOCATION.unpack(payload)[0])
+                if target_segment in self.segments and target_segment != segment.segment_id:
+                    self._write(KIND_REMOVAL, tx_id, payload)
+        del self.segments[segment.segment_id]
+        self.retired.append(segment)
+        self._release_retired()
+        self.compactions += 1
+
+    def _release_retired(self):
+        still_mapped = []
+        for segment in self.retired:
+            if segment.close():
+                os.remove(segment.path)
+            else:
+                still_mapped.append(segment)
+        self.retired = still_mapped
+
+    def flush(self):
+        """Write dirty pages of the active segment to disk"""
+        self.active.mmap.flush()
+
+    def __contains__(self, tx_hash: str) -> bool:
+        return bytes.fromhex(tx_hash) in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def close(self):
+        self.flush()
+        self._release_retired()
+        for segment in self.segments.values():
+            segment.close()
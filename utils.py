@@ -1,35 +1,65 @@
+import hashlib
 import uuid
-from cryptography.hazmat.primitives.asymmetric import rsa
+from collections import OrderedDict
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.backends import default_backend
+from signatures import DEFAULT_SCHEME, get_scheme
 
 def generate_node_id() -> str:
     """Generate a unique node ID"""
     return str(uuid.uuid4())
 
-def generate_key_pair():
-    """Generate RSA key pair"""
-    private_key = rsa.generate_private_key(
-        public_exponent=65537,
-        key_size=2048,
-        backend=default_backend()
-    )
-
-    public_key = private_key.public_key()
-
-    return private_key, public_key
+def generate_key_pair(scheme: str = DEFAULT_SCHEME):
+    """Generate a key pair for a signature scheme (RSA-2048 by default)"""
+    return get_scheme(scheme).generate_key_pair()
 
 def serialize_public_key(public_key) -> str:
     """Serialize public key to string"""
     return public_key.public_bytes(
         encoding=serialization.Encoding.PEM,
-        format=serialization.PublicFormat.SubjectPublicKeyInfo,
-        backend=default_backend()
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
     ).decode()
 
+def key_fingerprint(key_str: str) -> str:
+    """Short stable identifier for a serialized public key"""
+    return hashlib.sha256(key_str.encode()).hexdigest()
+
+class PublicKeyCache:
+    """LRU cache of parsed public keys keyed by fingerprint, so repeat senders skip PEM parsing"""
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.keys = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key_str: str):
+        fingerprint = key_fingerprint(key_str)
+        key = self.keys.get(fingerprint)
+        if key is not None:
+            self.keys.move_to_end(fingerprint)
+            self.hits += 1
+            return key
+
+        self.misses += 1
+        key = serialization.load_pem_public_key(key_str.encode(), backend=default_backend())
+        self.keys[fingerprint] = key
+        if len(self.keys) > self.maxsize:
+            self.keys.popitem(last=False)
+        return key
+
+    def clear(self):
+        self.keys.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+public_key_cache = PublicKeyCache()
+
 def deserialize_public_key(key_str: str):
-    """Deserialize public key from string"""
-    return serialization.load_pem_public_key(
-        key_str.encode(),
-        backend=default_backend()
-    )
\ No newline at end of file
+    """Deserialize public key from string, reusing previously parsed keys"""
+    return public_key_cache.get(key_str)
\ No newline at end of file
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import List, Optional, Tuple
+from transaction import Transaction
+from utils import deserialize_public_key
+
+
+def verify_transaction_dict(data: dict) -> bool:
+    """Check a wire transaction's ID and signature against its sender key"""
+    try:
+        tx = Transaction.from_dict(data)
+        if tx.calculate_hash() != data['id']:
+            return False
+        return tx.verify(deserialize_public_key(tx.verification_key()))
+    except Exception:
+        # Malformed fields fail in many ways (struct.error, OverflowError, ...);
+        # any of them makes this transaction invalid, never its batch
+        return False
+
+
+def verify_batch(batch: List[dict]) -> List[bool]:
+    """Verify a batch of wire transactions; runs inside a worker process"""
+    return [verify_transaction_dict(data) for data in batch]
+
+
+class VerificationPipeline:
+    """Batches transaction signature checks onto a process pool.
+
+    ``submit`` queues a transaction and returns once its batch has been
+    verified. A batch is dispatched when it reaches ``batch_size`` or when
+    ``max_delay`` has passed since its first entry, so verification never
+    runs on the event loop and all cores share the load. If the pool itself
+    fails, ``submit`` raises instead of reporting the batch as invalid.
+    """
+
+    def __init__(self, workers: Optional[int] = None, batch_size: int = 64,
+                 max_delay: float = 0.005, executor: Optional[Executor] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.executor = executor or ProcessPoolExecutor(max_workers=self.workers)
+        self.pending: List[Tuple[dict, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.verified = 0
+        self.rejected = 0
+        self.failed = 0
+        self.logger = logging.getLogger(__name__)
+
+    async def submit(self, transaction: dict) -> bool:
+        """Verify a transaction as part of the next batch; raises if the batch could not be run"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((transaction, future))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_delay, self.flush)
+        return await future
+
+    def flush(self):
+        """Dispatch everything pending to the pool"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self.pending:
+            batch, self.pending = self.pending, []
+            asyncio.create_task(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[dict, asyncio.Future]]):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, verify_batch, [tx for tx, _ in batch])
+        except Exception as e:
+            self.logger.error("Verification batch failed: %s", e)
+            self.failed += len(batch)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), valid in zip(batch, results):
+            if valid:
+                self.verified += 1
+            else:
+                self.rejected += 1
+            if not future.done():
+                future.set_result(valid)
+
+    def close(self):
+        """Shut down the worker pool, abandoning anything not yet dispatched"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        for _, future in self.pending:
+            future.cancel()
+        self.pending = []
+        self.executor.shutdown(wait=False, cancel_futures=True)